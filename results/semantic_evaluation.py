@@ -1,14 +1,20 @@
+import argparse
 import json
-from bert_score import score
-from rouge_score import rouge_scorer
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-import matplotlib.pyplot as plt
-import numpy as np
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from model_registry import get_bert_scorer
+from result_stream import iter_results
+
+# rouge_score and nltk are imported lazily (in worker processes too), matplotlib only for plots;
+# nothing is downloaded at import, whitespace tokenization does not need the punkt data
+
+LEXICAL_CHUNK_SIZE = 2000
+_rouge = None
 
-# Download NLTK data (first time only)
-import nltk
-nltk.download('punkt')
 
 def load_json_file(filepath):
     """Load JSON file with UTF-8 encoding"""
@@ -24,42 +30,80 @@ def load_json_file(filepath):
             with open(filepath, 'r', encoding='latin-1') as f:
                 return json.load(f)
 
-def evaluate_answers(data):
-    """Perform all evaluations on QA pairs"""
-    # Extract texts
-    questions = [item['question'] for item in data]
-    ground_truths = [item['ground_truth'] for item in data]
-    predictions = [item['predicted'] for item in data]
+def unique_pairs(predictions, ground_truths):
+    """
+    Distinct (prediction, ground truth) pairs and, per input pair, the index of its distinct pair;
+    evaluation files repeat the same short answers a lot
+    """
+    positions = {}
+    inverse = np.empty(len(predictions), dtype=np.int64)
+    for i, pair in enumerate(zip(predictions, ground_truths)):
+        inverse[i] = positions.setdefault(pair, len(positions))
+    return list(positions), inverse
+
+def bertscore(predictions, ground_truths, model_type='bert-base-uncased', batch_size=64, verbose=False):
+    """
+    (precision, recall, f1) arrays; the scorer is loaded once per process by the model registry
+    and every distinct pair is scored once
+    """
+    pairs, inverse = unique_pairs(predictions, ground_truths)
+    if not pairs:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    scorer = get_bert_scorer(model_type, lang='en')
+    P, R, F1 = scorer.score([p for p, _ in pairs], [gt for _, gt in pairs], batch_size=batch_size, verbose=verbose)
+    return P.numpy()[inverse], R.numpy()[inverse], F1.numpy()[inverse]
+
+def lexical_scores(pairs):
+    """
+    [(rougeL precision, recall, fmeasure, bleu)] for (prediction, ground truth) pairs
+    """
+    global _rouge
+    from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+    if _rouge is None:
+        from rouge_score import rouge_scorer
+        _rouge = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=True)
 
-    # 1. BERTScore
-    print("Running BERTScore...")
-    P_bert, R_bert, F1_bert = score(
-        predictions, ground_truths, 
-        lang='en', 
-        model_type='bert-base-uncased',
-        verbose=True
-    )
-
-    # 2. ROUGE-L
-    print("\nCalculating ROUGE-L...")
-    scorer = rouge_scorer.RougeScorer(['rougeL'], use_stemmer=True)
-    rouge_results = [scorer.score(gt, pred)['rougeL'] for gt, pred in zip(ground_truths, predictions)]
-
-    # 3. BLEU
-    print("\nCalculating BLEU...")
     smooth = SmoothingFunction().method4
-    bleu_scores = []
-    for gt, pred in zip(ground_truths, predictions):
+    scores = []
+    for pred, gt in pairs:
+        rouge = _rouge.score(gt, pred)['rougeL']
         try:
             bleu = sentence_bleu(
-                [gt.split()], 
+                [gt.split()],
                 pred.split(),
                 smoothing_function=smooth,
                 weights=(0.25, 0.25, 0.25, 0.25)
             )
-            bleu_scores.append(bleu)
-        except:
-            bleu_scores.append(0.0)  # Default score for empty/error cases
+        except Exception:
+            bleu = 0.0  # Default score for empty/error cases
+        scores.append((rouge.precision, rouge.recall, rouge.fmeasure, float(bleu)))
+    return scores
+
+def rouge_bleu(predictions, ground_truths, executor=None, chunk_size=LEXICAL_CHUNK_SIZE):
+    """
+    (n, 4) array of ROUGE-L precision/recall/fmeasure and BLEU; distinct pairs are scored
+    in chunks on the executor's worker processes, or inline without one
+    """
+    pairs, inverse = unique_pairs(predictions, ground_truths)
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    if executor is None or len(chunks) < 2:
+        results = map(lexical_scores, chunks)
+    else:
+        results = executor.map(lexical_scores, chunks)
+    scores = np.array([s for chunk in results for s in chunk], dtype=np.float64).reshape(-1, 4)
+    return scores[inverse]
+
+def evaluate_answers(data, model_type='bert-base-uncased', batch_size=64, executor=None, verbose=False):
+    """Perform all evaluations on QA pairs"""
+    # Extract texts
+    ground_truths = [str(item['ground_truth']) for item in data]
+    predictions = [str(item['predicted']) for item in data]
+
+    # 1. BERTScore
+    P_bert, R_bert, F1_bert = bertscore(predictions, ground_truths, model_type, batch_size, verbose)
+
+    # 2. ROUGE-L and 3. BLEU
+    lexical = rouge_bleu(predictions, ground_truths, executor)
 
     # Compile results
     results = []
@@ -73,65 +117,130 @@ def evaluate_answers(data):
                     'f1': float(F1_bert[i])
                 },
                 'rougeL': {
-                    'precision': rouge_results[i].precision,
-                    'recall': rouge_results[i].recall,
-                    'fmeasure': rouge_results[i].fmeasure
+                    'precision': float(lexical[i, 0]),
+                    'recall': float(lexical[i, 1]),
+                    'fmeasure': float(lexical[i, 2])
                 },
-                'bleu': float(bleu_scores[i])
+                'bleu': float(lexical[i, 3])
             }
         })
-    
+
     return results
 
-# Load your data
-try:
-    data = load_json_file('input.json')
-except Exception as e:
-    print(f"Error loading JSON file: {e}")
-    sys.exit(1)
-
-# Run evaluation
-evaluated_data = evaluate_answers(data)
-
-# Save results
-try:
-    with open('evaluated_results.json', 'w', encoding='utf-8') as f:
-        json.dump(evaluated_data, f, indent=2, ensure_ascii=False)
-except Exception as e:
-    print(f"Error saving results: {e}")
-
-# Generate report
-avg_scores = {
-    'BERTScore F1': np.mean([item['scores']['bertscore']['f1'] for item in evaluated_data]),
-    'ROUGE-L F1': np.mean([item['scores']['rougeL']['fmeasure'] for item in evaluated_data]),
-    'BLEU': np.mean([item['scores']['bleu'] for item in evaluated_data])
-}
-
-print("\n=== Evaluation Summary ===")
-for metric, value in avg_scores.items():
-    print(f"{metric}: {value:.3f}")
-
-# Visualization
-# Replace the visualization section with this corrected version:
-
-plt.figure(figsize=(15, 5))
-metrics = [
-    ('bertscore', 'f1', 'BERTScore F1', 'skyblue'),
-    ('rougeL', 'fmeasure', 'ROUGE-L F1', 'lightgreen'),
-    ('bleu', None, 'BLEU Score', 'salmon')
-]
-
-for i, (metric, subkey, title, color) in enumerate(metrics):
-    plt.subplot(1, 3, i+1)
-    if subkey:
-        values = [item['scores'][metric][subkey] for item in evaluated_data]
-    else:
-        values = [item['scores'][metric] for item in evaluated_data]
-    plt.hist(values, bins=20, color=color, edgecolor='black')
-    plt.title(title)
-    plt.xlabel('Score')
-    plt.grid(True, alpha=0.3)
-
-plt.tight_layout()
-plt.savefig('evaluation_metrics.png', bbox_inches='tight')
-plt.show()
+def iter_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def summarize(evaluated_data):
+    return {
+        'BERTScore F1': float(np.mean([item['scores']['bertscore']['f1'] for item in evaluated_data])),
+        'ROUGE-L F1': float(np.mean([item['scores']['rougeL']['fmeasure'] for item in evaluated_data])),
+        'BLEU': float(np.mean([item['scores']['bleu'] for item in evaluated_data]))
+    }
+
+def plot_metrics(evaluated_data, path='evaluation_metrics.png', show=True):
+    import matplotlib
+    if not show:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(15, 5))
+    metrics = [
+        ('bertscore', 'f1', 'BERTScore F1', 'skyblue'),
+        ('rougeL', 'fmeasure', 'ROUGE-L F1', 'lightgreen'),
+        ('bleu', None, 'BLEU Score', 'salmon')
+    ]
+
+    for i, (metric, subkey, title, color) in enumerate(metrics):
+        plt.subplot(1, 3, i+1)
+        if subkey:
+            values = [item['scores'][metric][subkey] for item in evaluated_data]
+        else:
+            values = [item['scores'][metric] for item in evaluated_data]
+        plt.hist(values, bins=20, color=color, edgecolor='black')
+        plt.title(title)
+        plt.xlabel('Score')
+        plt.grid(True, alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig(path, bbox_inches='tight')
+    if show:
+        plt.show()
+    plt.close()
+
+class _NoPool:
+    # stands in for the process pool when scoring runs in this process
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+def evaluate_file(input_path, output_path=None, model_type='bert-base-uncased', batch_size=64, workers=None,
+                  chunk_size=4096):
+    """
+    Score a .json results file, or a .jsonl file streamed by evaluate_rag chunk by chunk;
+    writes the scored records to output_path and returns only their scores
+    """
+    jsonl = input_path.endswith('.jsonl')
+    output_path = output_path or ('evaluated_results.jsonl' if jsonl else 'evaluated_results.json')
+    workers = workers or os.cpu_count()
+
+    evaluated_data = []
+    # one worker pool for the whole file, each process keeps its RougeScorer
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else _NoPool() as executor:
+        if jsonl:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                for chunk in iter_chunks(iter_results(input_path), chunk_size):
+                    for item in evaluate_answers(chunk, model_type, batch_size, executor):
+                        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                        evaluated_data.append({'scores': item['scores']})
+        else:
+            evaluated_data = evaluate_answers(load_json_file(input_path), model_type, batch_size, executor)
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(evaluated_data, f, indent=2, ensure_ascii=False)
+    return evaluated_data
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', nargs='?', default='input.json')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--model-type', default='bert-base-uncased')
+    parser.add_argument('--batch-size', type=int, default=64, help='BERTScore batch size')
+    parser.add_argument('--workers', type=int, default=None, help='ROUGE/BLEU processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=4096, help='records per chunk for .jsonl inputs')
+    parser.add_argument('--headless', action='store_true', help='no plots, for scheduled jobs')
+    parser.add_argument('--offline', action='store_true', help='only use models already in the local HF cache')
+    args = parser.parse_args(argv)
+
+    if args.offline:
+        # read when the BERTScore model is first loaded, so setting it here is early enough
+        os.environ['HF_HUB_OFFLINE'] = '1'
+        os.environ['TRANSFORMERS_OFFLINE'] = '1'
+
+    try:
+        evaluated_data = evaluate_file(args.input, args.output, args.model_type, args.batch_size, args.workers,
+                                       args.chunk_size)
+    except (OSError, ValueError) as e:
+        print(f"Error evaluating {args.input}: {e}")
+        return 1
+    if not evaluated_data:
+        print(f"No results found in {args.input}")
+        return 1
+
+    print("\n=== Evaluation Summary ===")
+    for metric, value in summarize(evaluated_data).items():
+        print(f"{metric}: {value:.3f}")
+
+    if not args.headless:
+        plot_metrics(evaluated_data)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
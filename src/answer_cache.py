@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+import faiss
+import numpy as np
+from build_db import fact_hash
+from embedding_cache import cached_encode, normalize_text
+
+
+class SemanticAnswerCache:
+    """
+    Answers of earlier questions, found again by exact text or by question-embedding similarity.
+
+    Each entry keeps the question embedding (in a small inner-product FAISS index), the ids of
+    the facts the answer was generated from with a hash of their text, and the answer. A lookup
+    hits when a cached question has cosine similarity >= threshold and the entry is still valid:
+    not older than ttl seconds and, when metadata is given, every source fact still exists with
+    the same text. Entries can also be dropped by fact id with invalidate_facts, e.g. after an
+    incremental index update. Beyond max_entries the least recently used entry goes.
+
+    Similarity alone cannot tell template questions about different entities apart ("Who is
+    the leader of Latvia?" / "... of Lithuania?"), so a semantic hit also needs the first
+    match_facts fact ids retrieved for the new question to be those of the cached entry.
+    Lookups without fact ids, and entries stored without them, only hit on the exact text;
+    match_facts=None matches on similarity alone.
+    """
+
+    def __init__(self, metadata=None, threshold=0.95, ttl=None, max_entries=10_000, model_name="all-MiniLM-L6-v2",
+                 match_facts=3, candidates=4):
+        self.metadata = metadata
+        self.threshold = threshold
+        self.match_facts = match_facts
+        self.candidates = candidates
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.model_name = model_name
+        self.index = None
+        self.entries = OrderedDict()
+        self.by_text = {}
+        self.by_fact = defaultdict(set)
+        self.next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0, "fact_mismatches": 0,
+                      "expired": 0, "stale": 0, "invalidated": 0, "evicted": 0}
+
+    def embed(self, questions):
+        emb = np.ascontiguousarray(cached_encode(questions, self.model_name), dtype=np.float32)
+        faiss.normalize_L2(emb)
+        return emb
+
+    def _top_facts(self, fact_ids):
+        if self.match_facts is None:
+            return None
+        return frozenset(int(i) for i in list(fact_ids)[:self.match_facts])
+
+    def _source_hashes(self, fact_ids):
+        if self.metadata is None:
+            return {int(i): None for i in fact_ids}
+        return {int(i): fact_hash(self.metadata[int(i)]) for i in fact_ids}
+
+    def _valid(self, entry):
+        if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+            self.stats["expired"] += 1
+            return False
+        if self.metadata is not None:
+            for fact_id, h in entry["facts"].items():
+                try:
+                    if fact_hash(self.metadata[fact_id]) != h:
+                        break
+                except (KeyError, IndexError):
+                    break
+            else:
+                return True
+            self.stats["stale"] += 1
+            return False
+        return True
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self.index.remove_ids(np.array([entry_id], dtype=np.int64))
+        if self.by_text.get(entry["key"]) == entry_id:
+            del self.by_text[entry["key"]]
+        for fact_id in entry["facts"]:
+            self.by_fact[fact_id].discard(entry_id)
+            if not self.by_fact[fact_id]:
+                del self.by_fact[fact_id]
+
+    def _hit(self, entry_id):
+        entry = self.entries[entry_id]
+        if not self._valid(entry):
+            self._remove(entry_id)
+            return None
+        self.entries.move_to_end(entry_id)
+        return entry["answer"]
+
+    def lookup_batch(self, questions, fact_ids=None):
+        """
+        Cached answer or None per question; fact_ids[i] are the ids of the facts retrieved for
+        questions[i], best first. Exact repeats skip the embedder, the rest share one encode
+        call and one index search.
+        """
+        fact_ids = fact_ids or [()] * len(questions)
+        answers = [None] * len(questions)
+        with self._lock:
+            self.stats["lookups"] += len(questions)
+            pending = []
+            for i, question in enumerate(questions):
+                entry_id = self.by_text.get(normalize_text(question).lower())
+                answer = self._hit(entry_id) if entry_id is not None else None
+                if answer is not None:
+                    answers[i] = answer
+                    self.stats["exact_hits"] += 1
+                elif self.match_facts is None or len(fact_ids[i]):
+                    pending.append(i)
+
+            if pending and self.entries:
+                k = min(self.candidates, len(self.entries))
+                scores, ids = self.index.search(self.embed([questions[i] for i in pending]), k)
+                for i, row_scores, row in zip(pending, scores, ids):
+                    top = self._top_facts(fact_ids[i])
+                    for score, entry_id in zip(row_scores, row):
+                        if entry_id == -1 or score < self.threshold or int(entry_id) not in self.entries:
+                            continue
+                        if top is not None and self.entries[int(entry_id)]["top"] != top:
+                            # a similar question about other facts, e.g. the same template for another entity
+                            self.stats["fact_mismatches"] += 1
+                            continue
+                        answers[i] = self._hit(int(entry_id))
+                        if answers[i] is not None:
+                            self.stats["semantic_hits"] += 1
+                            break
+
+            self.stats["misses"] += sum(answer is None for answer in answers)
+        return answers
+
+    def lookup(self, question, fact_ids=()):
+        return self.lookup_batch([question], [fact_ids])[0]
+
+    def put_batch(self, questions, answers, fact_ids=None):
+        """
+        Store answers; fact_ids[i] are the ids of the facts answers[i] was generated from
+        """
+        fact_ids = fact_ids or [()] * len(questions)
+        emb = self.embed(questions)
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(emb.shape[1]))
+            for question, answer, ids, vector in zip(questions, answers, fact_ids, emb):
+                key = normalize_text(question).lower()
+                if key in self.by_text:
+                    self._remove(self.by_text[key])
+
+                entry_id = self.next_id
+                self.next_id += 1
+                self.index.add_with_ids(vector[None, :], np.array([entry_id], dtype=np.int64))
+                # entries without source facts have nothing to compare and only hit on their text
+                self.entries[entry_id] = {"key": key, "answer": answer, "facts": self._source_hashes(ids),
+                                          "top": self._top_facts(ids) if len(ids) else None,
+                                          "created": time.time()}
+                self.by_text[key] = entry_id
+                for fact_id in self.entries[entry_id]["facts"]:
+                    self.by_fact[fact_id].add(entry_id)
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.stats["evicted"] += 1
+
+    def put(self, question, answer, fact_ids=()):
+        self.put_batch([question], [answer], [fact_ids])
+
+    def invalidate_facts(self, fact_ids):
+        """
+        Drop every answer generated from any of the given facts; returns how many were dropped
+        """
+        with self._lock:
+            entry_ids = set()
+            for fact_id in fact_ids:
+                entry_ids.update(self.by_fact.get(int(fact_id), ()))
+            for entry_id in entry_ids:
+                self._remove(entry_id)
+            self.stats["invalidated"] += len(entry_ids)
+        return len(entry_ids)
+
+    def clear(self):
+        with self._lock:
+            if self.index is not None:
+                self.index.reset()
+            self.entries.clear()
+            self.by_text.clear()
+            self.by_fact.clear()
+
+    def hit_rate(self):
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        return hits / self.stats["lookups"] if self.stats["lookups"] else 0.0
+
+    def report(self):
+        return {**self.stats, "entries": len(self.entries), "hit_rate": self.hit_rate()}
@@ -0,0 +1,103 @@
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+from build_db import INDEX_BACKENDS, build_faiss_index, embed_facts, load_facts
+from prompt_llm import embed_queries, set_search_params
+
+# search-time knob values swept per backend
+SEARCH_SWEEP = {
+    "flat": [{}],
+    "ivf_flat": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "ivf_pq": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "hnsw": [{"ef_search": ef} for ef in (16, 64, 256)],
+}
+
+
+def synthetic_vectors(n, dim=384, n_clusters=256, seed=0):
+
+    # clustered gaussian data behaves more like sentence embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def index_bytes(index):
+    return len(faiss.serialize_index(index))
+
+
+def run_benchmark(vectors, queries, k=10, backends=INDEX_BACKENDS, repeats=3):
+    results = []
+    exact = build_faiss_index(vectors.copy(), backend="flat")
+    _, truth = exact.search(queries, k)
+
+    for backend in backends:
+        start = time.perf_counter()
+        index = build_faiss_index(vectors.copy(), backend=backend)
+        build_time = time.perf_counter() - start
+        size = index_bytes(index)
+
+        for knobs in SEARCH_SWEEP[backend]:
+            set_search_params(index, **knobs)
+            # best of a few runs, to keep one-off scheduler noise out of the numbers
+            elapsed = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                _, found = index.search(queries, k)
+                elapsed = min(elapsed, time.perf_counter() - start)
+
+            results.append({
+                "backend": backend,
+                **knobs,
+                "recall_at_k": recall_at_k(found, truth, k),
+                "qps": len(queries) / elapsed,
+                "index_mb": size / 2**20,
+                "build_s": build_time,
+            })
+    return results
+
+
+def print_results(results, k):
+    print(f"{'backend':<10} {'knobs':<16} {'recall@' + str(k):>10} {'QPS':>12} {'index MB':>10} {'build s':>9}")
+    for r in results:
+        knobs = ", ".join(f"{key}={r[key]}" for key in ("nprobe", "ef_search") if key in r)
+        print(f"{r['backend']:<10} {knobs:<16} {r['recall_at_k']:>10.3f} {r['qps']:>12.0f} {r['index_mb']:>10.2f} {r['build_s']:>9.2f}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Recall/latency/memory benchmark of the fact index backends")
+    parser.add_argument("--facts", default="../data/leaders_facts.json")
+    parser.add_argument("--qa", default="../data/all_domains_combined_qa_dataset.json")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark on N synthetic vectors instead of the facts")
+    parser.add_argument("--queries", type=int, default=1000, help="number of synthetic queries")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--backends", nargs="+", default=list(INDEX_BACKENDS), choices=INDEX_BACKENDS)
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        # queries are drawn from the same clusters as the indexed vectors
+        vectors = synthetic_vectors(args.synthetic + args.queries)
+        vectors, queries = vectors[:args.synthetic], vectors[args.synthetic:]
+    else:
+        vectors = np.ascontiguousarray(embed_facts(load_facts(args.facts)), dtype=np.float32)
+        with open(args.qa, "r", encoding="utf-8") as f:
+            queries = embed_queries([entry["question"] for entry in json.load(f)])
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, dim {vectors.shape[1]}")
+    results = run_benchmark(vectors, queries, k=args.k, backends=args.backends)
+    print_results(results, args.k)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
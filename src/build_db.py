@@ -1,7 +1,12 @@
+import argparse
+import hashlib
 import json
+import os
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from embedding_cache import cached_encode
+from fact_store import write_fact_store
+from sparse_index import BM25Index, remove_sparse_index, sparse_index_path
 
 def load_facts(json_path):
 
@@ -12,16 +17,52 @@ def load_facts(json_path):
 
 def embed_facts(facts, model_name = "all-MiniLM-L6-v2"): 
 
-    # encode each fact into semantic embedding
-    model = SentenceTransformer(model_name)
+    # encode each fact into semantic embedding, facts seen in earlier builds come from the cache
     texts = [fact['text'] for fact in facts]
-    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
+    embeddings = cached_encode(texts, model_name, show_progress_bar=True)
     return embeddings
 
-def build_faiss_index(embeddings):
+INDEX_BACKENDS = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+def make_index(dim, backend="flat", n_train=None, nlist=None, hnsw_m=32, ef_construction=200, pq_m=16, pq_bits=8):
+    """
+    Create an empty inner-product index. IVF backends still need training.
+    """
+    if backend == "flat":
+        return faiss.IndexFlatIP(dim)
+    if backend == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        return index
+
+    if nlist is None:
+        # ~4*sqrt(n) lists, but faiss wants at least ~39 training points per list
+        n = n_train or 10000
+        nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+    quantizer = faiss.IndexFlatIP(dim)
+    if backend == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    if backend == "ivf_pq":
+        if dim % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}")
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits, faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown index backend '{backend}', expected one of {INDEX_BACKENDS}")
+
+
+def build_faiss_index(embeddings, backend="flat", trained_path=None, **index_params):
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)  
     faiss.normalize_L2(embeddings)  # normalize embeddings for cosine similarity
+
+    if trained_path and os.path.exists(trained_path):
+        # reuse a previously trained quantizer instead of re-running k-means
+        index = faiss.read_index(trained_path)
+    else:
+        index = make_index(dim, backend, n_train=len(embeddings), **index_params)
+        if not index.is_trained:
+            index.train(embeddings)
+            if trained_path:
+                save_index(index, trained_path)
+
     index.add(embeddings)
     return index
 
@@ -32,19 +73,187 @@ def save_index(index, index_path):
 
 def save_metadata(facts, metadata_path):
 
+    # .bin paths get the memory-mapped store, which retrieval can read without parsing every fact
+    if metadata_path.endswith(".bin"):
+        write_fact_store(facts, metadata_path)
+        return
+
     # save original facts for retrieval
     with open(metadata_path, "w", encoding="utf-8") as f:
         json.dump(facts, f, ensure_ascii=False, indent=2)
 
 
+def build_sparse_index(facts, sparse_path, doc_ids=None):
+
+    # BM25 postings over the same facts and ids as the FAISS index, for hybrid retrieval;
+    # facts may also be a generator streaming a fact file
+    sparse = BM25Index.build((fact['text'] for fact in facts), doc_ids)
+    sparse.save(sparse_path)
+    print(f"BM25 index: {len(sparse.terms)} terms, {len(sparse.docs)} postings")
+    return sparse
+
+
+def atomic_write_json(obj, path):
+
+    # write to a temp file next to the target and swap it in, so readers never see a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def fact_hash(fact):
+    return hashlib.sha1(fact['text'].encode("utf-8")).hexdigest()
+
+
+def load_index_state(state_path):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_incremental_index(facts, index_path, metadata_path, state_path=None, model_name="all-MiniLM-L6-v2",
+                            sparse_path=None):
+    """
+    Update an ID-mapped index in place: only facts whose text hash is new get embedded,
+    facts that disappeared are removed by id. Identical texts are stored once.
+    Metadata entries carry their stable "id", which is also the FAISS id.
+    With a sparse_path, the BM25 index is rebuilt over the current facts (no embedding involved).
+    """
+    state_path = state_path or index_path + ".state.json"
+    state = load_index_state(state_path)
+
+    # full rebuild if there is no previous state or it was built with another embedder
+    if state is None or state.get("model") != model_name or not os.path.exists(index_path):
+        state = {"model": model_name, "next_id": 0, "hashes": {}}
+        index = None
+    else:
+        index = faiss.read_index(index_path)
+        # index was rebuilt in full mode since the last incremental run: a plain index has no id map
+        # (removal by position, no add_with_ids), and the count alone misses same-size rebuilds
+        if not hasattr(index, "id_map") or index.ntotal != len(state["hashes"]):
+            state = {"model": model_name, "next_id": 0, "hashes": {}}
+            index = None
+
+    # dedupe by content hash, keeping the first occurrence
+    current = {}
+    for fact in facts:
+        h = fact_hash(fact)
+        if h not in current:
+            current[h] = fact
+
+    old_hashes = state["hashes"]
+    removed_ids = [old_hashes[h] for h in old_hashes if h not in current]
+    added = [h for h in current if h not in old_hashes]
+
+    if index is not None and removed_ids:
+        index.remove_ids(np.array(removed_ids, dtype=np.int64))
+
+    if added:
+        new_ids = np.arange(state["next_id"], state["next_id"] + len(added), dtype=np.int64)
+        embeddings = np.ascontiguousarray(embed_facts([current[h] for h in added], model_name), dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        if index is None:
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(embeddings.shape[1]))
+        index.add_with_ids(embeddings, new_ids)
+        state["next_id"] += len(added)
+        for h, fact_id in zip(added, new_ids):
+            old_hashes[h] = int(fact_id)
+
+    for h in [h for h in old_hashes if h not in current]:
+        del old_hashes[h]
+
+    print(f"Incremental update: {len(added)} added, {len(removed_ids)} removed, {len(current)} facts in index")
+
+    if index is None:
+        return None
+
+    metadata = [{**fact, "id": old_hashes[h]} for h, fact in current.items()]
+    save_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    if metadata_path.endswith(".bin"):
+        write_fact_store(metadata, metadata_path)
+    else:
+        atomic_write_json(metadata, metadata_path)
+    if sparse_path:
+        build_sparse_index(metadata, sparse_path, [fact["id"] for fact in metadata])
+    # state goes last: if we crash before this point the next run redoes the same delta
+    atomic_write_json(state, state_path)
+    return index
+
+
 if __name__ == "__main__":
 
-    facts = load_facts("../data/leaders_facts.json")  
-    embeddings = embed_facts(facts)
-    index = build_faiss_index(embeddings)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facts", nargs="+", default=["../data/leaders_facts.json"],
+                        help="one or more fact files, indexed together")
+    parser.add_argument("--index", default="../data/leaders_index.faiss")
+    parser.add_argument("--metadata", default="../data/leaders_metadata.json",
+                        help="a .bin path writes the memory-mapped fact store instead of JSON")
+    parser.add_argument("--incremental", action="store_true", help="only embed new or changed facts")
+    parser.add_argument("--backend", default="flat", choices=INDEX_BACKENDS)
+    parser.add_argument("--trained", default=None, help="path to save/reuse the trained IVF quantizer")
+    parser.add_argument("--no-sparse", action="store_true", help="skip the BM25 index used for hybrid retrieval")
+    parser.add_argument("--shard-by", default=None, help="build one index per value of this field (e.g. category) "
+                                                         "into the directory given by --index")
+    parser.add_argument("--workers", type=int, default=None, help="parallel shard builds / embedding processes")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream facts (JSON or JSONL) through a pool of CPU embedding processes into a memmap")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="facts per embedding task with --stream")
+    parser.add_argument("--sparse", action="store_true",
+                        help="also build the BM25 index with --stream (its postings grow with the corpus)")
+    args = parser.parse_args()
+    if args.stream:
+        for flag, value in (("--incremental", args.incremental), ("--shard-by", args.shard_by),
+                            ("--trained", args.trained)):
+            if value:
+                parser.error(f"--stream does not support {flag}")
+    if args.incremental:
+        # the incremental index is always a flat index inside an id map
+        for flag, value in (("--backend", args.backend != "flat"), ("--trained", args.trained),
+                            ("--shard-by", args.shard_by)):
+            if value:
+                parser.error(f"--incremental does not support {flag}")
+        if args.sparse and args.no_sparse:
+            parser.error("--sparse and --no-sparse exclude each other")
+    # a streaming build keeps peak memory fixed, BM25 postings do not, so there it is opt-in
+    build_sparse = args.sparse if args.stream else not args.no_sparse
+    sparse_path = sparse_index_path(args.index) if build_sparse else None
+    if not build_sparse:
+        # BM25 files of an earlier build would no longer match the rebuilt index
+        remove_sparse_index(sparse_index_path(args.index))
 
-    save_index(index, "../data/leaders_index.faiss")
-    save_metadata(facts, "../data/leaders_metadata.json")
+    if args.stream:
+        # memory stays bounded: facts are never all loaded, vectors go through a memmap
+        from embedding_pipeline import build_streaming_index, iter_facts
+        build_streaming_index(args.facts, args.index, args.metadata, backend=args.backend, workers=args.workers,
+                              chunk_size=args.chunk_size)
+        if sparse_path:
+            # second pass over the files, texts are tokenized one at a time
+            build_sparse_index((fact for path in args.facts for fact in iter_facts(path)), sparse_path)
+        raise SystemExit
 
+    facts = [fact for path in args.facts for fact in load_facts(path)]
 
+    if args.shard_by:
+        # --index is a directory; shards are searched with metadata filters (see sharded_index.py)
+        from sharded_index import build_sharded_index
+        build_sharded_index(facts, args.index, shard_field=args.shard_by, backend=args.backend, workers=args.workers)
+        if sparse_path:
+            build_sparse_index(facts, sparse_path)
+    elif args.incremental:
+        build_incremental_index(facts, args.index, args.metadata, sparse_path=sparse_path)
+    else:
+        embeddings = embed_facts(facts)
+        index = build_faiss_index(embeddings, backend=args.backend, trained_path=args.trained)
 
+        save_index(index, args.index)
+        save_metadata(facts, args.metadata)
+        # the state of an earlier incremental build describes an index that is now gone
+        if os.path.exists(args.index + ".state.json"):
+            os.remove(args.index + ".state.json")
+        if sparse_path:
+            build_sparse_index(facts, sparse_path)
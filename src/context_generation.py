@@ -1,15 +1,12 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
 import json
+from fact_templates import LEADER, transform_batch, transform_facts
+from wikidata_harvester import SparqlClient, get_facts_batch
+
+# cached, rate-limited client shared by all worker threads
+sparql_client = SparqlClient(user_agent="HipiProject/1.0 hipi@example.com")
 
 def run_sparql_query(query):
-    endpoint_url = "https://query.wikidata.org/sparql"
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    sparql.setTimeout(30)
-    sparql.addCustomHttpHeader("User-Agent", "HipiProject/1.0 hipi@example.com")
-    results = sparql.query().convert()
-    return results
+    return sparql_client.query(query)
 
 def get_current_world_leaders(limit=100):
 
@@ -54,137 +51,36 @@ def get_leader_facts(leader_qid):
             facts.append({"propertyLabel": prop, "valueLabel": val})
     return facts
 
+def get_leader_facts_batch(leader_qids, chunk_size=50):
+    """
+    Same as get_leader_facts for many leaders at once: {qid: facts}
+    """
+    return get_facts_batch(leader_qids, run_sparql_query, chunk_size=chunk_size)
+
 def transform_leader_facts(sparql_results, leader_name=None):
-    facts = []
     leader = leader_name or "Unknown"
-    country = None
-    occupations = set()
-    positions = set()
-    memberships = set()
-    significant_events = set()
-    nicknames = set()
-    spouses = set()
-    children = set()
-    education = set()
-    parents = set()
-
-    birth_info = None
-    birth_place = None
-
-    for item in sparql_results:
-        prop = item.get('propertyLabel')
-        val = item.get('valueLabel')
-
-        if prop == "country of citizenship":
-            country = val
-        elif prop == "occupation":
-            occupations.add(val)
-        elif prop == "position held":
-            positions.add(val)
-        elif prop == "member of":
-            memberships.add(val)
-        elif prop == "significant event":
-            significant_events.add(val)
-        elif prop == "nickname":
-            nicknames.add(val)
-        elif prop == "date of birth":
-            birth_info = val
-        elif prop == "place of birth":
-            birth_place = val
-        elif prop == "spouse":
-            spouses.add(val)
-        elif prop == "child":
-            children.add(val)
-        elif prop == "educated at":
-            education.add(val)
-        elif prop in ["father", "mother"]:
-            parents.add(val)
-
-
-    if birth_info and birth_place:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"{leader} was born on {birth_info} in {birth_place}."
-        })
-
-    if occupations:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"{leader} is a " + ", ".join(sorted(occupations)) + "."
-        })
-
-    if positions:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"{leader} has held positions including " + ", ".join(sorted(positions)) + "."
-        })
-
-    if memberships:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"{leader} is a member of " + ", ".join(sorted(memberships)) + "."
-        })
+    return transform_facts(sparql_results, LEADER, leader, {"leader": leader})
 
-    if significant_events:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"Significant events include " + ", ".join(sorted(significant_events)) + "."
-        })
-
-    if nicknames:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"Nicknames include " + ", ".join(sorted(nicknames)) + "."
-        })
-
-    if spouses:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"{leader} is married to " + ", ".join(sorted(spouses)) + "."
-        })
-
-    if children:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"{leader} has children: " + ", ".join(sorted(children)) + "."
-        })
-
-    if education:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"{leader} studied at " + ", ".join(sorted(education)) + "."
-        })
-
-    if parents:
-        facts.append({
-            "leader": leader,
-            "country": country,
-            "text": f"{leader}'s parents include " + ", ".join(sorted(parents)) + "."
-        })
-
-   
-    return facts
+def transform_leader_facts_batch(leaders, leader_results):
+    """
+    Facts of every leader in one bulk transform; returns one fact list per leader, in order
+    """
+    results = {i: leader_results[leader['qid']] for i, leader in enumerate(leaders)}
+    names = {i: leader['name'] or "Unknown" for i, leader in enumerate(leaders)}
+    facts = transform_batch(LEADER, results, names, {i: {"leader": name} for i, name in names.items()})
+    return [facts.get(i, []) for i in range(len(leaders))]
 
 if __name__ == "__main__":
 
     print("Fetching current European world leaders: ")
     leaders_list = get_current_world_leaders(limit=100)
 
-    all_facts = []
-    for leader in leaders_list:
-        print(f"Fetching facts for {leader['name']} ({leader['qid']})")
-        sparql_results = get_leader_facts(leader['qid'])
-        facts = transform_leader_facts(sparql_results, leader['name'])
+    # one VALUES query per chunk of leaders instead of one query per leader
+    print(f"Fetching facts for {len(leaders_list)} leaders")
+    leader_results = get_leader_facts_batch([leader['qid'] for leader in leaders_list])
 
+    all_facts = []
+    for leader, facts in zip(leaders_list, transform_leader_facts_batch(leaders_list, leader_results)):
         for f in facts:
             if "country" not in f or not f["country"]:
                 f["country"] = leader["country"]
@@ -193,6 +89,7 @@ if __name__ == "__main__":
         all_facts.extend(facts)
 
     print(f"Collected facts for {len(leaders_list)} leaders.")
+    print(f"SPARQL stats: {sparql_client.stats}")
     
     with open("../data/leaders_facts.json", "w", encoding="utf-8") as f:
         json.dump(all_facts, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import numpy as np
+from embedding_cache import cached_encode
+
+
+class ContextPacker:
+    """
+    Fits retrieved facts into a fixed token budget before they are joined into a RAG prompt.
+
+    Candidates come in retrieval order (best first). They are tokenized once, in one tokenizer
+    call, and embedded in one cached encode call. A candidate is dropped as a near-duplicate
+    when its cosine similarity to an already kept fact reaches dedup_threshold. The rest are
+    packed greedily: a fact that does not fit is skipped and smaller, lower-ranked facts can
+    still fill the remaining budget. stats accumulates how many context tokens this saved.
+    """
+
+    def __init__(self, tokenizer, budget_tokens=256, dedup_threshold=0.92, model_name="all-MiniLM-L6-v2",
+                 length_cache_size=100_000):
+        self.tokenizer = tokenizer
+        self.budget_tokens = budget_tokens
+        self.dedup_threshold = dedup_threshold
+        self.model_name = model_name
+        self.length_cache_size = length_cache_size
+        self._lengths = OrderedDict()
+        self.stats = {"queries": 0, "candidates": 0, "duplicates": 0, "over_budget": 0,
+                      "candidate_tokens": 0, "packed_tokens": 0, "tokens_saved": 0}
+
+    def token_lengths(self, texts):
+        # facts repeat across questions, so lengths are remembered and only new texts are tokenized
+        missing = list(dict.fromkeys(t for t in texts if t not in self._lengths))
+        if missing:
+            # +1 for the space build_rag_prompt puts between facts
+            for text, ids in zip(missing, self.tokenizer(missing, add_special_tokens=False)["input_ids"]):
+                self._lengths[text] = len(ids) + 1
+            while len(self._lengths) > self.length_cache_size:
+                self._lengths.popitem(last=False)
+        return [self._lengths[t] for t in texts]
+
+    def duplicates(self, texts):
+        """
+        Mask of texts that are near-duplicates of an earlier (better ranked) kept text
+        """
+        dropped = np.zeros(len(texts), dtype=bool)
+        if self.dedup_threshold is None or len(texts) < 2:
+            return dropped
+        vectors = cached_encode(texts, self.model_name)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ vectors.T
+        kept = []
+        for i in range(len(texts)):
+            if kept and similarity[i, kept].max() >= self.dedup_threshold:
+                dropped[i] = True
+            else:
+                kept.append(i)
+        return dropped
+
+    def pack(self, facts, budget_tokens=None):
+        """
+        (kept facts in retrieval order, report) for facts given as {"text", ...} dicts
+        """
+        budget = self.budget_tokens if budget_tokens is None else budget_tokens
+        texts = [fact["text"] for fact in facts]
+        lengths = self.token_lengths(texts)
+        duplicate = self.duplicates(texts)
+
+        packed, used, over_budget = [], 0, 0
+        for fact, length, is_duplicate in zip(facts, lengths, duplicate):
+            if is_duplicate:
+                continue
+            if used + length > budget:
+                over_budget += 1
+                continue
+            packed.append(fact)
+            used += length
+
+        report = {"candidates": len(facts), "duplicates": int(duplicate.sum()), "over_budget": over_budget,
+                  "candidate_tokens": sum(lengths), "packed_tokens": used, "tokens_saved": sum(lengths) - used}
+        self.stats["queries"] += 1
+        for key, value in report.items():
+            self.stats[key] += value
+        return packed, report
+
+    def pack_batch(self, facts_per_query, budget_tokens=None):
+        # one tokenizer call for every new fact of the batch instead of one per query
+        self.token_lengths([fact["text"] for facts in facts_per_query for fact in facts])
+        return [self.pack(facts, budget_tokens)[0] for facts in facts_per_query]
+
+    def report(self):
+        report = dict(self.stats)
+        report["mean_packed_tokens"] = self.stats["packed_tokens"] / max(self.stats["queries"], 1)
+        report["saved_fraction"] = self.stats["tokens_saved"] / max(self.stats["candidate_tokens"], 1)
+        return report
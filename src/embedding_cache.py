@@ -0,0 +1,217 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from model_registry import get_embedder
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock, see DiskTier
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "embedding_cache")
+KEY_SIZE = 20  # sha1 digest
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name, text):
+    return hashlib.sha1(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class DiskTier:
+    """
+    Persistent float32 vectors for one model: an append-only vectors file read through
+    np.memmap, plus an append-only file of keys whose i-th key belongs to the i-th row.
+
+    Several processes may share a directory: appends hold an exclusive lock on the lock file
+    and first read the rows other processes appended, so row numbers come from the files and
+    never collide. Without fcntl (Windows) there is no lock and one process per directory
+    may write.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.keys_path = os.path.join(directory, "keys.bin")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.lock_path = os.path.join(directory, "lock")
+        self.dim = None
+        self.rows = {}
+        self.count = 0  # rows read from the files so far
+        self._vectors = None
+
+        if os.path.exists(self.meta_path):
+            with self._locked():
+                self._sync()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+            yield
+
+    def _sync(self):
+        """
+        Read rows appended since the last sync (by any process); call with the lock held
+        """
+        if self.dim is None:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        keys = b""
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                f.seek(self.count * KEY_SIZE)
+                keys = f.read()
+        vector_bytes = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        # a crash can leave more keys than vectors (or a partial key), only trust complete pairs
+        n = min(self.count + len(keys) // KEY_SIZE, vector_bytes // (4 * self.dim))
+        for i in range(self.count, n):
+            offset = (i - self.count) * KEY_SIZE
+            self.rows.setdefault(keys[offset:offset + KEY_SIZE], i)
+        self.count = n
+        self._truncate(n)
+
+    def _truncate(self, n):
+        with open(self.keys_path, "ab") as f:
+            f.truncate(n * KEY_SIZE)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(n * 4 * self.dim)
+
+    def get(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        if self._vectors is None or row >= len(self._vectors):
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r").reshape(-1, self.dim)
+        return np.array(self._vectors[row])
+
+    def put_many(self, keys, vectors):
+        with self._locked():
+            if self.dim is None and not os.path.exists(self.meta_path):
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            self._sync()
+            new = [(k, v) for k, v in zip(keys, vectors) if k not in self.rows]
+            if not new:
+                return
+            # vectors first, so every persisted key always has its vector
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray([v for _, v in new], dtype=np.float32).tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(k for k, _ in new))
+            for i, (k, _) in enumerate(new):
+                self.rows[k] = self.count + i
+            self.count += len(new)
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of embeddings keyed by (model name, normalized text): an in-memory LRU
+    bounded by max_bytes, backed by a memory-mapped on-disk tier per model.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=256 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = {}
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _disk_tier(self, model_name):
+        if self.cache_dir is None:
+            return None
+        tier = self._disk.get(model_name)
+        if tier is None:
+            safe_name = model_name.replace("/", "__")
+            tier = self._disk[model_name] = DiskTier(os.path.join(self.cache_dir, safe_name))
+        return tier
+
+    def _remember(self, key, vector):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+        while self._memory_bytes > self.max_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def encode(self, model_name, texts, encode_fn):
+        """
+        Embeddings for texts as a new (n, dim) float32 array. Only texts missing from
+        both tiers are passed to encode_fn, in a single call.
+        """
+        keys = [cache_key(model_name, text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = {}
+
+        with self._lock:
+            disk = self._disk_tier(model_name)
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                elif disk is not None and key in disk.rows:
+                    vector = disk.get(key)
+                    self._remember(key, vector)
+                    self.stats["disk_hits"] += 1
+                else:
+                    # duplicates within one call are encoded once
+                    missing.setdefault(key, []).append(i)
+                    continue
+                vectors[i] = vector
+
+        if missing:
+            first = [indices[0] for indices in missing.values()]
+            encoded = np.asarray(encode_fn([texts[i] for i in first]), dtype=np.float32)
+            with self._lock:
+                self.stats["misses"] += len(missing)
+                for (key, indices), vector in zip(missing.items(), encoded):
+                    # copy so the cached row does not keep the whole batch array alive
+                    vector = vector.copy()
+                    self._remember(key, vector)
+                    for i in indices:
+                        vectors[i] = vector
+                if disk is not None:
+                    disk.put_many(list(missing), encoded)
+
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def hit_rate(self):
+        total = sum(self.stats.values())
+        return (self.stats["memory_hits"] + self.stats["disk_hits"]) / total if total else 0.0
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+
+embedding_cache = EmbeddingCache()
+
+
+def cached_encode(texts, model_name="all-MiniLM-L6-v2", batch_size=64, show_progress_bar=False):
+    """
+    Drop-in for SentenceTransformer.encode(texts, convert_to_numpy=True) that goes through the shared cache
+    """
+    def encode_fn(missing):
+        model = get_embedder(model_name)
+        return model.encode(missing, batch_size=batch_size, convert_to_numpy=True,
+                            show_progress_bar=show_progress_bar)
+
+    return embedding_cache.encode(model_name, texts, encode_fn)
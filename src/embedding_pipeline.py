@@ -0,0 +1,190 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import faiss
+import numpy as np
+
+READ_BLOCK = 1 << 20
+
+
+def iter_facts(path):
+    """
+    Facts of a JSONL file (one per line) or of a JSON array, read incrementally: only the
+    current block of the file is held in memory, never the whole list
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer, pos = "", 0
+        while True:
+            # skip whitespace, the brackets and separators up to the next object
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+                pos += 1
+            if pos < len(buffer):
+                try:
+                    fact, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    end = None
+                if end is not None and end < len(buffer):
+                    yield fact
+                    pos = end
+                    continue
+            block = f.read(READ_BLOCK)
+            if not block:
+                if pos < len(buffer):
+                    fact, _ = decoder.raw_decode(buffer, pos)
+                    yield fact
+                return
+            buffer = buffer[pos:] + block
+            pos = 0
+
+
+def iter_chunks(facts, chunk_size):
+    chunk = []
+    for fact in facts:
+        chunk.append(fact)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_worker(threads):
+    # each worker gets its share of the cores instead of every torch pool claiming all of them
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _encode_chunk(texts, model_name, batch_size):
+    from model_registry import get_embedder
+    model = get_embedder(model_name, device="cpu")  # loaded once per worker process
+    emb = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    emb = np.ascontiguousarray(emb, dtype=np.float32)
+    faiss.normalize_L2(emb)
+    return emb
+
+
+class JsonArrayWriter:
+    """
+    Writes a JSON array one element at a time, so metadata never has to be held as a list
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.f = open(self.tmp_path, "w", encoding="utf-8")
+        self.f.write("[")
+        self.count = 0
+
+    def write(self, item):
+        self.f.write(",\n" if self.count else "\n")
+        self.f.write(json.dumps(item, ensure_ascii=False))
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n]\n")
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def embed_to_memmap(fact_paths, vectors_path, metadata_path, model_name="all-MiniLM-L6-v2", workers=None,
+                    chunk_size=4096, batch_size=64):
+    """
+    Stream facts from JSON/JSONL files, encode chunks of chunk_size texts on a pool of CPU
+    worker processes and append the normalized float32 vectors to vectors_path in input order.
+    At most two chunks per worker are in flight, so memory stays bounded however many facts
+    there are. Metadata is streamed to metadata_path (fact id = position).
+    Returns (number of facts, embedding dimension).
+    """
+    workers = workers or os.cpu_count()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    start = time.time()
+    count, dim = 0, None
+
+    metadata = JsonArrayWriter(metadata_path)
+    with open(vectors_path, "wb") as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        pending = deque()
+
+        def drain(limit):
+            nonlocal count, dim
+            while len(pending) > limit:
+                emb = pending.popleft().result()
+                dim = emb.shape[1]
+                out.write(emb.tobytes())
+                count += len(emb)
+                elapsed = time.time() - start
+                print(f"\rEmbedded {count} facts ({count / max(elapsed, 1e-9):.0f} facts/s)", end="", flush=True)
+
+        for chunk in iter_chunks((fact for path in fact_paths for fact in iter_facts(path)), chunk_size):
+            for fact in chunk:
+                metadata.write(fact)
+            pending.append(pool.submit(_encode_chunk, [fact["text"] for fact in chunk], model_name, batch_size))
+            drain(2 * workers)
+        drain(0)
+    metadata.close()
+    print()
+
+    elapsed = time.time() - start
+    print(f"Embedded {count} facts in {elapsed:.1f} s ({count / max(elapsed, 1e-9):.0f} facts/s, "
+          f"{workers} workers)")
+    return count, dim
+
+
+def open_vectors(vectors_path, dim):
+    count = os.path.getsize(vectors_path) // (4 * dim)
+    return np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(count, dim))
+
+
+def index_from_memmap(vectors, backend="flat", add_batch=65536, max_train=100_000, seed=0):
+    """
+    Build an index from memory-mapped vectors, adding add_batch rows at a time; IVF backends
+    train on a random sample of at most max_train rows
+    """
+    from build_db import make_index
+
+    start = time.time()
+    index = make_index(vectors.shape[1], backend, n_train=min(len(vectors), max_train))
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(vectors), size=min(len(vectors), max_train), replace=False))
+        index.train(np.ascontiguousarray(vectors[sample]))
+
+    for b in range(0, len(vectors), add_batch):
+        index.add(np.ascontiguousarray(vectors[b:b + add_batch]))
+    elapsed = time.time() - start
+    print(f"Indexed {len(vectors)} vectors in {elapsed:.1f} s ({len(vectors) / max(elapsed, 1e-9):.0f} facts/s)")
+    return index
+
+
+def build_streaming_index(fact_paths, index_path, metadata_path, backend="flat", workers=None, chunk_size=4096,
+                          batch_size=64, vectors_path=None, model_name="all-MiniLM-L6-v2"):
+    """
+    Streaming counterpart of build_db's full build: facts -> memmap vectors -> index.
+    Vectors stay in vectors_path (default: next to the index) and can be re-indexed with
+    another backend without embedding again.
+    """
+    vectors_path = vectors_path or index_path + ".f32"
+    json_metadata = metadata_path if not metadata_path.endswith(".bin") else metadata_path + ".json"
+    count, dim = embed_to_memmap(fact_paths, vectors_path, json_metadata, model_name, workers, chunk_size,
+                                 batch_size)
+    if count == 0:
+        print("No facts found")
+        return None
+
+    index = index_from_memmap(open_vectors(vectors_path, dim), backend)
+    faiss.write_index(index, index_path)
+    if metadata_path.endswith(".bin"):
+        # the fact store keeps one encoded row per fact in memory while it is written
+        from fact_store import write_fact_store
+        write_fact_store(iter_facts(json_metadata), metadata_path)
+        os.remove(json_metadata)
+    return index
@@ -0,0 +1,90 @@
+import json
+import mmap
+import os
+import numpy as np
+
+# file layout: MAGIC | uint64 row count n | (n + 1) uint64 offsets | UTF-8 blob of compact JSON rows
+# row i lives at blob[offsets[i]:offsets[i + 1]]; an empty row marks a deleted/unused id
+MAGIC = b"FACTMETA"
+HEADER_SIZE = len(MAGIC) + 8
+
+
+def write_fact_store(facts, path):
+    """
+    Write facts so that row i is the fact whose FAISS id is i. Facts carrying an
+    "id" field (incremental indexes) are placed at that id, others by position.
+    """
+    rows = {}
+    for position, fact in enumerate(facts):
+        rows[fact.get("id", position)] = json.dumps(fact, ensure_ascii=False).encode("utf-8")
+
+    n = max(rows) + 1 if rows else 0
+    lengths = np.zeros(n, dtype=np.uint64)
+    for fact_id, row in rows.items():
+        lengths[fact_id] = len(row)
+    offsets = np.zeros(n + 1, dtype=np.uint64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(n).tobytes())
+        f.write(offsets.tobytes())
+        for fact_id in range(n):
+            if fact_id in rows:
+                f.write(rows[fact_id])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class FactStore:
+    """
+    Read-only, memory-mapped fact metadata. Only the rows that are asked for get parsed,
+    so opening a store costs the same regardless of how many facts it holds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a fact store file")
+        self._n = int(np.frombuffer(self._mm, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        self._offsets = np.frombuffer(self._mm, dtype=np.uint64, count=self._n + 1, offset=HEADER_SIZE)
+        self._blob_start = HEADER_SIZE + 8 * (self._n + 1)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, fact_id):
+        if not 0 <= fact_id < self._n:
+            raise IndexError(f"fact id {fact_id} out of range")
+        start, end = int(self._offsets[fact_id]), int(self._offsets[fact_id + 1])
+        if start == end:
+            raise KeyError(f"fact id {fact_id} is not in the store")
+        return json.loads(self._mm[self._blob_start + start:self._blob_start + end].decode("utf-8"))
+
+    def get(self, fact_id, default=None):
+        try:
+            return self[fact_id]
+        except (IndexError, KeyError):
+            return default
+
+    def __iter__(self):
+        for fact_id in range(self._n):
+            fact = self.get(fact_id)
+            if fact is not None:
+                yield fact
+
+    def close(self):
+        # drop numpy views first, mmap refuses to close while buffers are exported
+        self._offsets = None
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,175 @@
+"""
+Table-driven transformation of SPARQL (propertyLabel, valueLabel) rows into fact sentences.
+
+A domain table maps property labels to accumulator slots and lists sentence templates.
+Each template entry is a list of alternatives; the first one whose required slots are
+all filled is rendered. Set slots are rendered as a sorted, comma separated list.
+Adding a domain means adding a table, not another if/elif chain.
+"""
+
+SET = "set"    # collect every value
+LAST = "last"  # keep the last value seen
+
+
+PERSON = {
+    "slots": {
+        "occupation": ("occupations", SET),
+        "position held": ("positions", SET),
+        "member of": ("memberships", SET),
+        "significant event": ("significant_events", SET),
+        "nickname": ("nicknames", SET),
+        "date of birth": ("birth_info", LAST),
+        "place of birth": ("birth_place", LAST),
+        "date of death": ("death_info", LAST),
+        "place of death": ("death_place", LAST),
+        "spouse": ("spouses", SET),
+        "child": ("children", SET),
+        "educated at": ("education", SET),
+        "father": ("parents", SET),
+        "mother": ("parents", SET),
+        "award received": ("awards", SET),
+        "notable work": ("notable_works", SET),
+    },
+    "templates": [
+        [(("birth_info", "birth_place"), "{name} was born on {birth_info} in {birth_place}.")],
+        [(("death_info", "death_place"), "{name} died on {death_info} in {death_place}.")],
+        [(("occupations",), "{name} is a {occupations}.")],
+        [(("positions",), "{name} has held positions including {positions}.")],
+        [(("awards",), "{name} received awards including {awards}.")],
+        [(("notable_works",), "{name} created notable works including {notable_works}.")],
+        [(("education",), "{name} studied at {education}.")],
+        [(("spouses",), "{name} is married to {spouses}.")],
+    ],
+}
+
+COMPANY = {
+    "slots": {
+        "industry": ("industries", SET),
+        "product or material produced": ("products", SET),
+        "service": ("services", SET),
+        "subsidiary": ("subsidiaries", SET),
+        "headquarters location": ("headquarters", SET),
+        "founded by": ("founders", SET),
+        "chief executive officer": ("ceos", SET),
+        "number of employees": ("employees", LAST),
+        "revenue": ("revenue", LAST),
+        "inception": ("founded_date", LAST),
+        "location of formation": ("founded_place", LAST),
+        "stock exchange": ("stock_exchange", SET),
+        "brand": ("brands", SET),
+    },
+    "templates": [
+        [(("founded_date", "founded_place"), "{name} was founded on {founded_date} in {founded_place}."),
+         (("founded_date",), "{name} was founded on {founded_date}.")],
+        [(("headquarters",), "{name} has headquarters in {headquarters}.")],
+        [(("industries",), "{name} operates in industries including {industries}.")],
+        [(("products",), "{name} produces {products}.")],
+        [(("founders",), "{name} was founded by {founders}.")],
+        [(("ceos",), "{name} has been led by CEOs including {ceos}.")],
+        [(("employees",), "{name} has {employees} employees.")],
+        [(("subsidiaries",), "{name} owns subsidiaries including {subsidiaries}.")],
+        # "country" is not a row property, the caller passes it in as an extra slot
+        [(("country",), "{name} is based in {country}.")],
+    ],
+}
+
+LEADER = {
+    "slots": {
+        "country of citizenship": ("country", LAST),
+        "occupation": ("occupations", SET),
+        "position held": ("positions", SET),
+        "member of": ("memberships", SET),
+        "significant event": ("significant_events", SET),
+        "nickname": ("nicknames", SET),
+        "date of birth": ("birth_info", LAST),
+        "place of birth": ("birth_place", LAST),
+        "spouse": ("spouses", SET),
+        "child": ("children", SET),
+        "educated at": ("education", SET),
+        "father": ("parents", SET),
+        "mother": ("parents", SET),
+    },
+    # slots copied into every fact record instead of the text
+    "field_slots": {"country": "country"},
+    "templates": [
+        [(("birth_info", "birth_place"), "{name} was born on {birth_info} in {birth_place}.")],
+        [(("occupations",), "{name} is a {occupations}.")],
+        [(("positions",), "{name} has held positions including {positions}.")],
+        [(("memberships",), "{name} is a member of {memberships}.")],
+        [(("significant_events",), "Significant events include {significant_events}.")],
+        [(("nicknames",), "Nicknames include {nicknames}.")],
+        [(("spouses",), "{name} is married to {spouses}.")],
+        [(("children",), "{name} has children: {children}.")],
+        [(("education",), "{name} studied at {education}.")],
+        [(("parents",), "{name}'s parents include {parents}.")],
+    ],
+}
+
+
+def accumulate_batch(results, domain, extras=None):
+    """
+    Single pass over the rows of many entities ({key: rows}) into one accumulator per entity:
+    one dict lookup per row to find its slot. Entities whose rows are None are left out.
+    """
+    slots = domain["slots"]
+    extras = extras or {}
+    accs = {}
+    for key, rows in results.items():
+        if rows is None:
+            continue
+        extra = extras.get(key)
+        acc = accs[key] = dict(extra) if extra else {}
+        for item in rows:
+            slot = slots.get(item.get('propertyLabel'))
+            if slot is None:
+                continue
+            slot_key, kind = slot
+            if kind is SET:
+                values = acc.get(slot_key)
+                if values is None:
+                    values = acc[slot_key] = set()
+                values.add(item.get('valueLabel'))
+            else:
+                acc[slot_key] = item.get('valueLabel')
+    return accs
+
+
+def accumulate(rows, domain, extra=None):
+    return accumulate_batch({None: rows}, domain, {None: extra})[None]
+
+
+def render(acc, domain, name, fields):
+    record = dict(fields)
+    for field, slot in domain.get("field_slots", {}).items():
+        record[field] = acc.get(slot)
+
+    values = {"name": name}
+    for key, value in acc.items():
+        values[key] = ", ".join(sorted(value)) if isinstance(value, set) else value
+
+    facts = []
+    for alternatives in domain["templates"]:
+        for required, template in alternatives:
+            if all(acc.get(slot) for slot in required):
+                facts.append({**record, "text": template.format(**values)})
+                break
+    return facts
+
+
+def transform_facts(rows, domain, name, fields, extra=None):
+    """
+    Turn one entity's SPARQL rows into fact records {**fields, "text": ...}
+    """
+    return render(accumulate(rows, domain, extra), domain, name, fields)
+
+
+
+
+def transform_batch(domain, results, names, fields, extras=None):
+    """
+    Bulk mode, e.g. over the {qid: rows} output of get_facts_batch: names, fields and extras
+    are keyed like results. Returns {key: facts}; entities whose rows are None (a failed
+    chunk) are left out.
+    """
+    accs = accumulate_batch(results, domain, extras)
+    return {key: render(acc, domain, names[key], fields[key]) for key, acc in accs.items()}
@@ -0,0 +1,217 @@
+import dataclasses
+import hashlib
+import json
+import os
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+PROMPT_TEMPLATE = "### Instruction:\n{question}\n\n### Response:\n"
+PIPELINE_VERSION = 1  # bump when the tokenization below changes, so old caches are not reused
+
+
+def format_example(example):
+    return PROMPT_TEMPLATE.format(question=example["question"]) + str(example["answer"])
+
+
+def load_texts(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [format_example(ex) for ex in json.load(f)]
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    Hash of everything that decides the token ids: tokenizer class, vocabulary and special tokens
+    """
+    h = hashlib.sha1()
+    h.update(type(tokenizer).__name__.encode("utf-8"))
+    h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode("utf-8"))
+    if hasattr(tokenizer, "backend_tokenizer"):
+        # normalizer, pre-tokenizer and merges of fast tokenizers; truncation and padding are
+        # call-time state that the first tokenizer call changes
+        backend = json.loads(tokenizer.backend_tokenizer.to_str())
+        backend.pop("truncation", None)
+        backend.pop("padding", None)
+        h.update(json.dumps(backend, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_key(tokenizer, texts, max_length):
+    h = hashlib.sha1(f"{PIPELINE_VERSION}\0{max_length}\0{tokenizer_fingerprint(tokenizer)}".encode("utf-8"))
+    for text in texts:
+        h.update(text.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class TokenizedDataset(Dataset):
+    """
+    Unpadded token ids of all examples, stored flat with offsets (like the .npz graph store)
+    so the cache loads in one read and padding is left to the collator
+    """
+
+    def __init__(self, ids, offsets):
+        self.ids = ids
+        self.offsets = offsets
+        self.lengths = np.diff(offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return {"input_ids": self.ids[self.offsets[i]:self.offsets[i + 1]].tolist()}
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, ids=self.ids, offsets=self.offsets)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["ids"], data["offsets"])
+
+
+def tokenize_texts(texts, tokenizer, max_length=512, batch_size=1024):
+    chunks, offsets = [], [0]
+    for b in range(0, len(texts), batch_size):
+        for ids in tokenizer(texts[b:b + batch_size], truncation=True, max_length=max_length)["input_ids"]:
+            chunks.append(np.asarray(ids, dtype=np.int32))
+            offsets.append(offsets[-1] + len(ids))
+    ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+    return TokenizedDataset(ids, np.asarray(offsets, dtype=np.int64))
+
+
+def load_or_tokenize(texts, tokenizer, max_length=512, cache_dir="./tokenized_cache"):
+    """
+    Tokenized dataset from cache_dir when the same tokenizer already saw the same texts,
+    otherwise tokenize once and store it there
+    """
+    path = os.path.join(cache_dir, cache_key(tokenizer, texts, max_length) + ".npz")
+    if os.path.exists(path):
+        print(f"Loaded tokenized dataset from {path}")
+        return TokenizedDataset.load(path)
+    dataset = tokenize_texts(texts, tokenizer, max_length)
+    os.makedirs(cache_dir, exist_ok=True)
+    dataset.save(path)
+    print(f"Tokenized {len(dataset)} examples, cached in {path}")
+    return dataset
+
+
+class PackedDataset(Dataset):
+    """
+    Several short examples per training row. Rows are filled first-fit in order of decreasing
+    length up to max_length tokens; each row keeps its example lengths so the collator can
+    restart position ids (and with them the attention) at every example boundary.
+    """
+
+    def __init__(self, dataset, max_length=512):
+        self.dataset = dataset
+        rows, free = [], []
+        for i in np.argsort(-dataset.lengths, kind="stable"):
+            length = int(dataset.lengths[i])
+            for r, space in enumerate(free):
+                if length <= space:
+                    rows[r].append(int(i))
+                    free[r] -= length
+                    break
+            else:
+                rows.append([int(i)])
+                free.append(max_length - length)
+        self.rows = rows
+        self.lengths = np.array([max_length - space for space in free], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, r):
+        examples = [self.dataset[i]["input_ids"] for i in self.rows[r]]
+        return {"input_ids": [t for ids in examples for t in ids], "seq_lengths": [len(ids) for ids in examples]}
+
+
+class PaddingCollator:
+    """
+    Pads each batch only to its own longest example (rounded up to pad_to_multiple_of);
+    padding is masked out of the attention and the loss
+    """
+
+    def __init__(self, tokenizer, pad_to_multiple_of=8):
+        self.pad_id = tokenizer.pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        length = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            length = -(-length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        input_ids = torch.full((len(features), length), self.pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), length), dtype=torch.long)
+        for row, f in enumerate(features):
+            n = len(f["input_ids"])
+            input_ids[row, :n] = torch.tensor(f["input_ids"], dtype=torch.long)
+            attention_mask[row, :n] = 1
+        # pad == eos for Mistral, so the mask (not the token id) decides what is padding
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+
+class PackedCollator:
+    """
+    Flattens a batch of packed rows into one sequence without attention_mask. Position ids
+    restart at 0 for every example, which flash-attention varlen kernels and the packed-sequence
+    detection of recent transformers turn into block-diagonal causal attention. The first token
+    of each example is not predicted from the previous example. The model has to run with
+    use_cache=False, otherwise transformers skips the packed-sequence detection.
+    """
+
+    def __call__(self, features):
+        input_ids, position_ids, labels = [], [], []
+        for f in features:
+            start = 0
+            for n in f["seq_lengths"]:
+                ids = f["input_ids"][start:start + n]
+                input_ids.extend(ids)
+                position_ids.extend(range(n))
+                labels.extend([-100] + ids[1:])
+                start += n
+        return {"input_ids": torch.tensor([input_ids], dtype=torch.long),
+                "position_ids": torch.tensor([position_ids], dtype=torch.long),
+                "labels": torch.tensor([labels], dtype=torch.long)}
+
+
+def packing_supported(model):
+    """
+    Whether the model keeps packed examples apart given only position ids
+    """
+    if getattr(model.config, "_attn_implementation", None) == "flash_attention_2":
+        return True
+    try:
+        from transformers.masking_utils import find_packed_sequence_indices  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def length_grouping_args(training_args_cls):
+    # renamed from group_by_length to train_sampling_strategy in newer transformers
+    names = {field.name for field in dataclasses.fields(training_args_cls)}
+    if "train_sampling_strategy" in names:
+        return {"train_sampling_strategy": "group_by_length"}
+    return {"group_by_length": True}
+
+
+def build_train_data(texts, tokenizer, max_length=512, pack=False, cache_dir="./tokenized_cache"):
+    """
+    (train dataset, data collator) for the Trainer; the Trainer must keep unused columns
+    (remove_unused_columns=False) because packed rows carry their example lengths
+    """
+    dataset = load_or_tokenize(texts, tokenizer, max_length, cache_dir)
+    real_tokens = int(dataset.lengths.sum())
+    if pack:
+        packed = PackedDataset(dataset, max_length)
+        print(f"Packed {len(dataset)} examples into {len(packed)} rows "
+              f"({real_tokens / max(len(packed) * max_length, 1):.0%} of row tokens used)")
+        return packed, PackedCollator()
+    print(f"{len(dataset)} examples, {real_tokens} tokens "
+          f"(padding every example to {max_length} would be {len(dataset) * max_length})")
+    return dataset, PaddingCollator(tokenizer)
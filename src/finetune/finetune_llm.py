@@ -1,8 +1,8 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForLanguageModeling
+from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer
 from peft import get_peft_model, LoraConfig, TaskType
-from datasets import Dataset
-import json
+import argparse
 import torch
+from data_pipeline import build_train_data, length_grouping_args, load_texts, packing_supported
 
 print("tuka")
 
@@ -10,44 +10,48 @@ MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.3"
 DATA_PATH = "qa_dataset_wikidata.json"
 OUTPUT_DIR = "./mistral-lora"
 MAX_LENGTH = 512
+CACHE_DIR = "./tokenized_cache"
 
-def load_dataset_from_json(path):
-    with open(path, "r", encoding="utf-8") as f:
-        raw = json.load(f)
+parser = argparse.ArgumentParser()
+parser.add_argument("--model", default=MODEL_NAME)
+parser.add_argument("--data", default=DATA_PATH)
+parser.add_argument("--output", default=OUTPUT_DIR)
+parser.add_argument("--max-length", type=int, default=MAX_LENGTH)
+parser.add_argument("--cache-dir", default=CACHE_DIR, help="tokenized datasets, keyed by tokenizer and data hash")
+parser.add_argument("--pack", action="store_true", help="pack several QA examples into each training sequence")
+parser.add_argument("--epochs", type=float, default=30)
+parser.add_argument("--cpu", action="store_true", help="full-precision run without 4-bit loading, e.g. a tiny model")
+args = parser.parse_args()
 
-
-    formatted = [{
-        "text": f"### Instruction:\n{ex['question']}\n\n### Response:\n{ex['answer']}"
-    } for ex in raw]
-
-    return Dataset.from_list(formatted)
-
-dataset = load_dataset_from_json(DATA_PATH)
+texts = load_texts(args.data)
 
 print("dataset loaded")
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=False)
+tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=False)
 tokenizer.pad_token = tokenizer.eos_token
 
-
-
-def tokenize(example):
-    return tokenizer(
-        example["text"],
-        padding="max_length",
-        truncation=True,
-        max_length=MAX_LENGTH,
+if args.cpu:
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32)
+else:
+    model = AutoModelForCausalLM.from_pretrained(args.model,
+        device_map="auto",
+        torch_dtype=torch.float16,
+        load_in_4bit=True
     )
 
-tokenized_dataset = dataset.map(tokenize, batched=True)
+pack = args.pack
+if pack and not packing_supported(model):
+    # without it packed examples would attend to each other
+    print("This transformers version cannot mask packed sequences by position ids, training unpacked")
+    pack = False
+# training never reuses the KV cache, and with a cache transformers skips the packed-sequence masking
+model.config.use_cache = False
 
-print("tokenization")
+# no padding to MAX_LENGTH: batches are padded to their longest example, or examples are packed
+train_dataset, data_collator = build_train_data(texts, tokenizer, args.max_length, pack=pack,
+                                                cache_dir=args.cache_dir)
 
-model = AutoModelForCausalLM.from_pretrained(MODEL_NAME,
-    device_map="auto",
-    torch_dtype=torch.float16,
-    load_in_4bit=True
-)
+print("tokenization")
 
 print("fine-tunning")
 
@@ -64,25 +68,28 @@ model = get_peft_model(model, lora_config)
 model.print_trainable_parameters()
 
 training_args = TrainingArguments(
-    output_dir=OUTPUT_DIR,
-    per_device_train_batch_size=1,
-    gradient_accumulation_steps=8,
-    num_train_epochs=30,
+    output_dir=args.output,
+    per_device_train_batch_size=1 if pack else 8,  # a packed row already holds many examples
+    gradient_accumulation_steps=8 if pack else 1,
+    num_train_epochs=args.epochs,
     learning_rate=2e-4,
-    fp16=True,
+    fp16=not args.cpu,
+    use_cpu=args.cpu,
     logging_steps=10,
     save_strategy="epoch",
-    report_to="none"
+    report_to="none",
+    remove_unused_columns=False,  # the collators pick their own fields
+    # similar lengths in one batch keep dynamic padding small
+    **(length_grouping_args(TrainingArguments) if not pack else {})
 )
 
 trainer = Trainer(
     model=model,
     args=training_args,
-    train_dataset=tokenized_dataset,
-    tokenizer=tokenizer,
-    data_collator=DataCollatorForLanguageModeling(tokenizer, mlm=False),
+    train_dataset=train_dataset,
+    data_collator=data_collator,
 )
 
 trainer.train()
-model.save_pretrained(OUTPUT_DIR)
-tokenizer.save_pretrained(OUTPUT_DIR)
\ No newline at end of file
+model.save_pretrained(args.output)
+tokenizer.save_pretrained(args.output)
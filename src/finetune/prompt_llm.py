@@ -1,35 +1,154 @@
 from transformers import AutoTokenizer, AutoModelForCausalLM
+import argparse
+import functools
+import hashlib
+import json
+import os
+import time
 import torch
+from data_pipeline import PROMPT_TEMPLATE
 
 MODEL_PATH = "./mistral-lora"
+MERGED_PATH = "./mistral-lora-merged"
 MAX_LENGTH = 512
+MAX_NEW_TOKENS = 32
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-model = AutoModelForCausalLM.from_pretrained(MODEL_PATH)
-model.eval()
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-
-def generate_answer(question):
-    prompt = f"### Instruction:\n{question}\n\n### Response:\n"
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=MAX_LENGTH).to(device)
-    outputs = model.generate(
-        **inputs,
-        max_length=MAX_LENGTH,
-        do_sample=False,
-        pad_token_id=tokenizer.eos_token_id
-    )
-    text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    answer = text.split("### Response:")[-1].strip()
-    return answer
+
+def adapter_fingerprint(adapter_path):
+    # the merged checkpoint is reused only while the adapter files are unchanged
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(adapter_path)):
+        if name.startswith("adapter_"):
+            stat = os.stat(os.path.join(adapter_path, name))
+            h.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return h.hexdigest()
+
+def merge_adapter(adapter_path=MODEL_PATH, merged_path=MERGED_PATH, dtype=torch.float16):
+    """
+    Fold the LoRA weights into the base model once and save the result, so later loads
+    are a plain checkpoint without adapter layers in the forward pass. Each dtype gets its own
+    checkpoint (merged_path + "-float16", ...): fp16-rounded weights are not reused for fp32
+    """
+    dtype_name = str(dtype).replace("torch.", "")
+    merged_path = f"{merged_path}-{dtype_name}"
+    fingerprint = adapter_fingerprint(adapter_path)
+    marker = os.path.join(merged_path, "merged_from.json")
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as f:
+            merged_from = json.load(f)
+        if merged_from.get("adapter") == fingerprint and merged_from.get("dtype") == dtype_name:
+            return merged_path
+
+    from peft import AutoPeftModelForCausalLM
+    print(f"Merging LoRA adapter {adapter_path} into {merged_path}")
+    model = AutoPeftModelForCausalLM.from_pretrained(adapter_path, torch_dtype=dtype, low_cpu_mem_usage=True)
+    model = model.merge_and_unload()
+    model.save_pretrained(merged_path)
+    AutoTokenizer.from_pretrained(adapter_path).save_pretrained(merged_path)
+    # marker goes last: an interrupted merge is redone on the next load
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump({"adapter": fingerprint, "dtype": dtype_name}, f)
+    return merged_path
+
+def load_model(adapter_path=MODEL_PATH, merged_path=MERGED_PATH, device=None, quantize=False):
+    """
+    (model, tokenizer) of the merged finetuned model: fp16 on GPU, fp32 on CPU, or dynamically
+    int8-quantized linear layers on CPU with quantize=True
+    """
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    dtype = torch.float16 if device.type == "cuda" else torch.float32
+    path = merge_adapter(adapter_path, merged_path, dtype)
+
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    tokenizer.padding_side = "left"  # generated tokens follow the prompt directly in every row
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    model = AutoModelForCausalLM.from_pretrained(path, torch_dtype=dtype, low_cpu_mem_usage=True)
+    model.eval()
+    if quantize:
+        if device.type != "cpu":
+            raise ValueError("dynamic int8 quantization only runs on CPU")
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model.to(device), tokenizer
+
+@functools.lru_cache(maxsize=4)
+def stop_token_ids(tokenizer):
+    """
+    EOS and every token whose text contains a newline: answers are one line
+    """
+    ids = {tokenizer.eos_token_id}
+    for token, i in tokenizer.get_vocab().items():
+        if "\n" in tokenizer.convert_tokens_to_string([token]):
+            ids.add(i)
+    return tuple(sorted(ids))
+
+def generate_answers(questions, model, tokenizer, batch_size=16, max_new_tokens=MAX_NEW_TOKENS, stop_ids=None):
+    """
+    Greedy answers for many questions. Questions are sorted by prompt length and decoded in
+    left-padded batches; each sequence stops at its first EOS or newline and a batch ends
+    as soon as all of its sequences have stopped.
+    """
+    stop_ids = stop_ids or stop_token_ids(tokenizer)
+    prompts = [PROMPT_TEMPLATE.format(question=q) for q in questions]
+    lengths = [len(ids) for ids in tokenizer(prompts)["input_ids"]]
+    order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+
+    answers = [None] * len(prompts)
+    for b in range(0, len(order), batch_size):
+        batch_ids = order[b:b + batch_size]
+        inputs = tokenizer([prompts[i] for i in batch_ids], return_tensors="pt", padding=True, truncation=True,
+                           max_length=MAX_LENGTH).to(model.device)
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                eos_token_id=list(stop_ids),  # finished rows are padded until the whole batch is done
+                pad_token_id=tokenizer.pad_token_id
+            )
+        decoded = tokenizer.batch_decode(outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+        for i, text in zip(batch_ids, decoded):
+            answers[i] = text.strip().split("\n", 1)[0].strip()
+    return answers
+
+def generate_answer(question, model, tokenizer, max_new_tokens=MAX_NEW_TOKENS):
+    return generate_answers([question], model, tokenizer, batch_size=1, max_new_tokens=max_new_tokens)[0]
 
 if __name__ == "__main__":
 
-    questions = [
-        "Who is the head of state of United Kingdom?"
-    ]
-    
-    for q in questions:
-        print("Q:", q)
-        print("A:", generate_answer(q))
-        print("-" * 50)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--adapter", default=MODEL_PATH)
+    parser.add_argument("--merged", default=MERGED_PATH, help="where the merged checkpoint is cached, one directory per dtype with this prefix")
+    parser.add_argument("--qa", default=None, help="JSON list of {question, answer}; answers go to --output")
+    parser.add_argument("--output", default="finetuned_results.json")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--quantize", action="store_true", help="dynamic int8 linear layers (CPU only)")
+    parser.add_argument("--device", default=None)
+    args = parser.parse_args()
+
+    model, tokenizer = load_model(args.adapter, args.merged, args.device, args.quantize)
+
+    if args.qa is None:
+        questions = [
+            "Who is the head of state of United Kingdom?"
+        ]
+
+        for q, a in zip(questions, generate_answers(questions, model, tokenizer, max_new_tokens=args.max_new_tokens)):
+            print("Q:", q)
+            print("A:", a)
+            print("-" * 50)
+    else:
+        with open(args.qa, "r", encoding="utf-8") as f:
+            qa_pairs = json.load(f)
+        start_time = time.time()
+        answers = generate_answers([qa["question"] for qa in qa_pairs], model, tokenizer, args.batch_size,
+                                   args.max_new_tokens)
+        elapsed = time.time() - start_time
+        print(f"Generated {len(answers)} answers in {elapsed:.2f} seconds ({len(answers) / elapsed:.1f} questions/s)")
+        # same record layout as the RAG evaluation, so semantic_evaluation.py scores it directly
+        results = [{"question": qa["question"], "ground_truth": qa["answer"], "predicted": answer}
+                   for qa, answer in zip(qa_pairs, answers)]
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
@@ -1,15 +1,12 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
 import json
+from fact_templates import COMPANY, PERSON, transform_batch, transform_facts
+from wikidata_harvester import SparqlClient, get_facts_batch
+
+# cached, rate-limited client shared by all worker threads
+sparql_client = SparqlClient(user_agent="GeneralKnowledgeProject/1.0 knowledge@example.com")
 
 def run_sparql_query(query):
-    endpoint_url = "https://query.wikidata.org/sparql"
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    sparql.setTimeout(30)
-    sparql.addCustomHttpHeader("User-Agent", "GeneralKnowledgeProject/1.0 knowledge@example.com")
-    results = sparql.query().convert()
-    return results
+    return sparql_client.query(query)
 
 def get_famous_scientists(limit=15):
     """
@@ -191,242 +188,37 @@ def get_company_facts(company_qid):
             facts.append({"propertyLabel": prop, "valueLabel": val})
     return facts
 
-def transform_person_facts(sparql_results, person_name=None, category=None):
-    
-    facts = []
-    name = person_name or "Unknown"
-    
-    occupations = set()
-    positions = set()
-    memberships = set()
-    significant_events = set()
-    nicknames = set()
-    spouses = set()
-    children = set()
-    education = set()
-    parents = set()
-    awards = set()
-    notable_works = set()
-    
-    birth_info = None
-    birth_place = None
-    death_info = None
-    death_place = None
-
-    for item in sparql_results:
-        prop = item.get('propertyLabel')
-        val = item.get('valueLabel')
-
-        if prop == "occupation":
-            occupations.add(val)
-        elif prop == "position held":
-            positions.add(val)
-        elif prop == "member of":
-            memberships.add(val)
-        elif prop == "significant event":
-            significant_events.add(val)
-        elif prop == "nickname":
-            nicknames.add(val)
-        elif prop == "date of birth":
-            birth_info = val
-        elif prop == "place of birth":
-            birth_place = val
-        elif prop == "date of death":
-            death_info = val
-        elif prop == "place of death":
-            death_place = val
-        elif prop == "spouse":
-            spouses.add(val)
-        elif prop == "child":
-            children.add(val)
-        elif prop == "educated at":
-            education.add(val)
-        elif prop in ["father", "mother"]:
-            parents.add(val)
-        elif prop == "award received":
-            awards.add(val)
-        elif prop == "notable work":
-            notable_works.add(val)
-
-    if birth_info and birth_place:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} was born on {birth_info} in {birth_place}."
-        })
-
-    if death_info and death_place:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} died on {death_info} in {death_place}."
-        })
-
-    if occupations:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} is a " + ", ".join(sorted(occupations)) + "."
-        })
-
-    if positions:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} has held positions including " + ", ".join(sorted(positions)) + "."
-        })
-
-    if awards:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} received awards including " + ", ".join(sorted(awards)) + "."
-        })
-
-    if notable_works:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} created notable works including " + ", ".join(sorted(notable_works)) + "."
-        })
-
-    if education:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} studied at " + ", ".join(sorted(education)) + "."
-        })
-
-    if spouses:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} is married to " + ", ".join(sorted(spouses)) + "."
-        })
+def get_entity_facts_batch(qids, chunk_size=50):
+    """
+    Facts for many people/companies at once, as {qid: facts} in the get_person_facts format
+    """
+    return get_facts_batch(qids, run_sparql_query, chunk_size=chunk_size)
 
-    return facts
+def transform_person_facts(sparql_results, person_name=None, category=None):
+    return transform_facts(sparql_results, PERSON, person_name or "Unknown",
+                           {"name": person_name or "Unknown", "category": category})
 
 def transform_company_facts(sparql_results, company_name=None, category=None, country=None):
-    
-    facts = []
-    name = company_name or "Unknown"
-    
-    industries = set()
-    products = set()
-    services = set()
-    subsidiaries = set()
-    headquarters = set()
-    founders = set()
-    ceos = set()
-    employees = None
-    revenue = None
-    founded_date = None
-    founded_place = None
-    stock_exchange = set()
-    brands = set()
-    
-    for item in sparql_results:
-        prop = item.get('propertyLabel')
-        val = item.get('valueLabel')
-        
-        if prop == "industry":
-            industries.add(val)
-        elif prop == "product or material produced":
-            products.add(val)
-        elif prop == "service":
-            services.add(val)
-        elif prop == "subsidiary":
-            subsidiaries.add(val)
-        elif prop == "headquarters location":
-            headquarters.add(val)
-        elif prop == "founded by":
-            founders.add(val)
-        elif prop == "chief executive officer":
-            ceos.add(val)
-        elif prop == "number of employees":
-            employees = val
-        elif prop == "revenue":
-            revenue = val
-        elif prop == "inception":
-            founded_date = val
-        elif prop == "location of formation":
-            founded_place = val
-        elif prop == "stock exchange":
-            stock_exchange.add(val)
-        elif prop == "brand":
-            brands.add(val)
-    
-    # Generate company facts
-    if founded_date and founded_place:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} was founded on {founded_date} in {founded_place}."
-        })
-    elif founded_date:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} was founded on {founded_date}."
-        })
+    return transform_facts(sparql_results, COMPANY, company_name or "Unknown",
+                           {"name": company_name or "Unknown", "category": category},
+                           extra={"country": country})
 
-    if headquarters:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} has headquarters in " + ", ".join(sorted(headquarters)) + "."
-        })
-    
-    if industries:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} operates in industries including " + ", ".join(sorted(industries)) + "."
-        })
-    
-    if products:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} produces " + ", ".join(sorted(products)) + "."
-        })
-    
-    if founders:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} was founded by " + ", ".join(sorted(founders)) + "."
-        })
-    
-    if ceos:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} has been led by CEOs including " + ", ".join(sorted(ceos)) + "."
-        })
-    
-    if employees:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} has {employees} employees."
-        })
-    
-    if subsidiaries:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} owns subsidiaries including " + ", ".join(sorted(subsidiaries)) + "."
-        })
-    
-    if country:
-        facts.append({
-            "name": name,
-            "category": category,
-            "text": f"{name} is based in {country}."
-        })
+def transform_entity_facts_batch(entities, entity_results):
+    """
+    Facts of every entity in one bulk transform per domain; returns one fact list per entity, in order
+    """
+    results = {"Company": {}, "Person": {}}
+    names, fields, extras = {}, {}, {}
+    for i, entity in enumerate(entities):
+        domain = "Company" if entity['category'] == 'Company' else "Person"
+        results[domain][i] = entity_results[entity['qid']]
+        names[i] = entity['name'] or "Unknown"
+        fields[i] = {"name": names[i], "category": entity['category']}
+        extras[i] = {"country": entity.get('country', None)}
 
-    return facts
+    facts = transform_batch(COMPANY, results["Company"], names, fields, extras)
+    facts.update(transform_batch(PERSON, results["Person"], names, fields))
+    return [facts.get(i, []) for i in range(len(entities))]
 
 if __name__ == "__main__":
     print("Fetching famous people and companies from different categories...")
@@ -466,25 +258,12 @@ if __name__ == "__main__":
     print(f"  - People: {people_count}")
     print(f"  - Companies: {company_count}")
     
+    # one VALUES query per chunk of entities instead of one query per entity
+    print(f"Fetching facts for {total_entities} entities")
+    entity_results = get_entity_facts_batch([entity['qid'] for entity in all_entities])
+
     all_facts = []
-    for entity in all_entities:  
-        entity_type = "Company" if entity['category'] == 'Company' else "Person"
-        print(f"Fetching facts for {entity['name']} ({entity['qid']}) - {entity_type}")
-        
-        if entity['category'] == 'Company':
-            #  COMPANIES using company functions
-            sparql_results = get_company_facts(entity['qid'])
-            facts = transform_company_facts(
-                sparql_results, 
-                entity['name'], 
-                entity['category'],
-                entity.get('country', None)
-            )
-        else:
-            
-            sparql_results = get_person_facts(entity['qid'])
-            facts = transform_person_facts(sparql_results, entity['name'], entity['category'])
-        
+    for entity, facts in zip(all_entities, transform_entity_facts_batch(all_entities, entity_results)):
         for f in facts:
             if "category" not in f or not f["category"]:
                 f["category"] = entity["category"]
@@ -494,6 +273,7 @@ if __name__ == "__main__":
         all_facts.extend(facts)
     
     print(f"Collected {len(all_facts)} facts for {total_entities} entities (people + companies).")
+    print(f"SPARQL stats: {sparql_client.stats}")
     
     output_file = 'data/general_knowledge_facts.json'
     
@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+import torch
+from kv_cache import PrefixKVCache, expand_batch, from_legacy, pad_left, template_prefix, to_legacy
+from model_registry import get_generator
+from retrieval_server import read_request, response_head, write_json
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationStream:
+    """
+    Handle returned by submit(): iterate it for text deltas as they are generated,
+    or call text() to block until the answer is complete
+    """
+
+    _DONE = object()
+
+    def __init__(self, prompt, max_new_tokens, stop_at_newline):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.stop_at_newline = stop_at_newline
+        self.tokens = []
+        self.emitted = ""
+        self.submitted = time.perf_counter()
+        self.first_token_at = None
+        self.error = None
+        self._queue = queue.Queue()
+
+    def _push(self, delta):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self._queue.put(delta)
+
+    def _finish(self, error=None):
+        self.error = error
+        self._queue.put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    def text(self):
+        return "".join(self).strip()
+
+
+class ContinuousBatchScheduler:
+    """
+    Continuous batching for a Hugging Face causal LM on a background thread.
+
+    New requests are prefilled (left padded, together with whoever else arrived) and then join
+    the running batch at the next decode step by merging their KV cache into the batch cache;
+    finished sequences leave the batch immediately, so short answers never wait for long ones.
+    Each decode step feeds one token per sequence and reuses the cached keys/values.
+    Greedy decoding, max_new_tokens counts only generated tokens.
+    With a PrefixKVCache, prompts sharing a registered prefix only prefill their own suffix.
+    """
+
+    def __init__(self, tokenizer, model, device=None, max_batch=8, idle_wait=0.01, prefix_cache=None):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.prefix_cache = prefix_cache
+        self.device = device or next(model.parameters()).device
+        self.max_batch = max_batch
+        self.idle_wait = idle_wait
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self.pending = queue.Queue()
+        self.active = []
+        self.past = None
+        self.mask = None
+        self.last_tokens = None
+        self.stats = {"requests": 0, "completed": 0, "generated_tokens": 0, "decode_steps": 0, "prefills": 0}
+        self.first_token_latency = deque(maxlen=10000)
+        self.total_latency = deque(maxlen=10000)
+        self._started = time.perf_counter()
+        self._stats_lock = threading.Lock()  # submit() runs on caller threads
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, prompt, max_new_tokens=32, stop_at_newline=False):
+        if max_new_tokens < 1:
+            raise ValueError(f"max_new_tokens must be at least 1, got {max_new_tokens}")
+        stream = GenerationStream(prompt, max_new_tokens, stop_at_newline)
+        with self._stats_lock:
+            self.stats["requests"] += 1
+        self.pending.put(stream)
+        return stream
+
+    def generate(self, prompt, max_new_tokens=32, stop_at_newline=False):
+        return self.submit(prompt, max_new_tokens, stop_at_newline).text()
+
+    # ---- scheduling ----
+
+    def _loop(self):
+        while not self._stop.is_set():
+            admitted = self._admit()
+            if not self.active:
+                if not admitted:
+                    time.sleep(self.idle_wait)
+                continue
+            try:
+                self._decode_step()
+            except Exception as e:
+                logger.exception("Decode step failed")
+                for stream in self.active:
+                    stream._finish(e)
+                self._reset()
+
+    def _admit(self):
+        arrivals = []
+        while len(self.active) + len(arrivals) < self.max_batch:
+            try:
+                arrivals.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if not arrivals:
+            return False
+        try:
+            with torch.no_grad():
+                groups = self._prefill_groups(arrivals)
+        except Exception as e:
+            logger.exception("Prefill failed")
+            for stream in arrivals:
+                stream._finish(e)
+            return True
+        for streams, (past, mask, logits) in groups:
+            self.stats["prefills"] += 1
+            self._join(streams, past, mask, logits.argmax(dim=-1))
+        return True
+
+    def _prefill_groups(self, arrivals):
+        """
+        Prefill the arrivals, one batch per shared cached prefix plus one for prompts without one
+        """
+        sequences = self.tokenizer([stream.prompt for stream in arrivals])["input_ids"]
+        if self.prefix_cache is None:
+            return [(arrivals, self._prefill(sequences))]
+
+        groups = {}
+        for stream, ids in zip(arrivals, sequences):
+            length, past = self.prefix_cache.lookup(ids)
+            group = groups.setdefault((length, id(past)), (length, past, [], []))
+            group[2].append(stream)
+            group[3].append(ids[length:])
+        return [(streams, self._prefill(suffixes, past, length)) for length, past, streams, suffixes in groups.values()]
+
+    def _prefill(self, sequences, prefix_past=None, prefix_len=0):
+        """
+        Run the token sequences through the model, optionally after a cached prefix shared by all of
+        them; returns (legacy KV cache, attention mask, last-position logits)
+        """
+        width = max(len(ids) for ids in sequences)
+        pad_id = self.tokenizer.pad_token_id
+        input_ids = torch.tensor([[pad_id] * (width - len(ids)) + ids for ids in sequences], device=self.device)
+        mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in sequences], device=self.device)
+        past = None
+        if prefix_past is not None:
+            # padding sits between the prefix and each suffix, the mask hides it
+            mask = torch.cat([mask.new_ones(len(sequences), prefix_len), mask], dim=1)
+            past = from_legacy(expand_batch(prefix_past, len(sequences)))
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)[:, prefix_len:]
+        outputs = self.model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids,
+                             past_key_values=past, use_cache=True)
+        return to_legacy(outputs.past_key_values), mask, outputs.logits[:, -1, :]
+
+    def _join(self, arrivals, past, mask, first_tokens):
+        if self.active:
+            length = max(self.mask.shape[1], mask.shape[1])
+            self.past, self.mask = pad_left(self.past, self.mask, length)
+            past, mask = pad_left(past, mask, length)
+            self.past = tuple((torch.cat([k1, k2]), torch.cat([v1, v2])) for (k1, v1), (k2, v2) in zip(self.past, past))
+            self.mask = torch.cat([self.mask, mask])
+            self.last_tokens = torch.cat([self.last_tokens, first_tokens.unsqueeze(-1)])
+        else:
+            self.past, self.mask, self.last_tokens = past, mask, first_tokens.unsqueeze(-1)
+        self.active.extend(arrivals)
+        # the prefill already produced each newcomer's first token
+        finished = [self._emit(stream, int(token)) for stream, token in zip(arrivals, first_tokens)]
+        self._retire([False] * (len(self.active) - len(arrivals)) + finished)
+
+    def _decode_step(self):
+        self.mask = torch.cat([self.mask, self.mask.new_ones(self.mask.shape[0], 1)], dim=1)
+        position_ids = self.mask.sum(-1, keepdim=True) - 1
+        with torch.no_grad():
+            outputs = self.model(input_ids=self.last_tokens, attention_mask=self.mask, position_ids=position_ids,
+                                 past_key_values=from_legacy(self.past), use_cache=True)
+        self.past = to_legacy(outputs.past_key_values)
+        tokens = outputs.logits[:, -1, :].argmax(dim=-1)
+        self.last_tokens = tokens.unsqueeze(-1)
+        self.stats["decode_steps"] += 1
+        self._retire([self._emit(stream, int(token)) for stream, token in zip(self.active, tokens)])
+
+    def _emit(self, stream, token):
+        """
+        Record one generated token and stream its text; returns True when the sequence is done
+        """
+        if token == self.tokenizer.eos_token_id:
+            return True
+        stream.tokens.append(token)
+        self.stats["generated_tokens"] += 1
+        # decode the whole answer so multi-token characters and word pieces come out right
+        text = self.tokenizer.decode(stream.tokens, skip_special_tokens=True)
+        stop = False
+        if stream.stop_at_newline:
+            # leading newlines are skipped, the first one after some text ends the answer
+            answer = text.lstrip("\n")
+            if "\n" in answer:
+                text = text[:len(text) - len(answer) + answer.index("\n")]
+                stop = True
+        if text.startswith(stream.emitted) and len(text) > len(stream.emitted):
+            stream._push(text[len(stream.emitted):])
+            stream.emitted = text
+        return stop or len(stream.tokens) >= stream.max_new_tokens
+
+    def _retire(self, finished):
+        if not any(finished):
+            return
+        now = time.perf_counter()
+        keep = [i for i, done in enumerate(finished) if not done]
+        for i, done in enumerate(finished):
+            if done:
+                stream = self.active[i]
+                self.first_token_latency.append((stream.first_token_at or now) - stream.submitted)
+                self.total_latency.append(now - stream.submitted)
+                self.stats["completed"] += 1
+                stream._finish()
+        if not keep:
+            self._reset()
+            return
+
+        rows = torch.tensor(keep, device=self.mask.device)
+        self.active = [self.active[i] for i in keep]
+        self.mask = self.mask.index_select(0, rows)
+        self.last_tokens = self.last_tokens.index_select(0, rows)
+        # drop leading columns that are padding for every remaining sequence
+        start = int((self.mask.sum(0) > 0).nonzero()[0])
+        self.mask = self.mask[:, start:]
+        self.past = tuple((k.index_select(0, rows)[:, :, start:], v.index_select(0, rows)[:, :, start:])
+                          for k, v in self.past)
+
+    def _reset(self):
+        self.active, self.past, self.mask, self.last_tokens = [], None, None, None
+
+    def report(self):
+        elapsed = time.perf_counter() - self._started
+        report = {**self.stats, "active": len(self.active), "queued": self.pending.qsize(),
+                  "prefix_cache": dict(self.prefix_cache.stats) if self.prefix_cache is not None else None,
+                  "tokens_per_second": self.stats["generated_tokens"] / elapsed if elapsed else 0.0}
+        for name, values in (("first_token", self.first_token_latency), ("total", self.total_latency)):
+            values = np.array(values) * 1000
+            for p in (50, 90, 99):
+                report[f"{name}_p{p}_ms"] = float(np.percentile(values, p)) if len(values) else 0.0
+        return report
+
+
+class GenerationServer:
+    """
+    asyncio HTTP front end for a ContinuousBatchScheduler:
+      POST /generate {"prompt": ..., "max_new_tokens": 32, "stop_at_newline": false, "stream": false}
+           -> {"text": ...}, or with "stream": true a chunked NDJSON stream of {"token": ...}
+              lines followed by {"done": true, "text": ...}
+      GET  /stats    throughput and latency report
+    """
+
+    def __init__(self, scheduler, host="127.0.0.1", port=8766):
+        self.scheduler = scheduler
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Generation server listening on http://{self.host}:{self.port}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _stream(self, writer, stream, keep_alive):
+        loop = asyncio.get_running_loop()
+        writer.write(response_head(200, keep_alive, "application/x-ndjson", "Transfer-Encoding: chunked\r\n"))
+        parts = []
+        iterator = iter(stream)
+        while True:
+            # blocking queue reads happen off the event loop
+            delta = await loop.run_in_executor(None, next, iterator, None)
+            line = {"token": delta} if delta is not None else {"done": True, "text": "".join(parts).strip()}
+            data = (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()
+            if delta is None:
+                break
+            parts.append(delta)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close" and body is not None
+                if method == "GET" and path == "/stats":
+                    await write_json(writer, 200, self.scheduler.report(), keep_alive)
+                elif method == "POST" and path == "/generate" and body is not None:
+                    try:
+                        payload = json.loads(body or b"{}")
+                        stream = self.scheduler.submit(payload["prompt"], int(payload.get("max_new_tokens", 32)),
+                                                       bool(payload.get("stop_at_newline", False)))
+                    except (ValueError, KeyError, TypeError) as e:
+                        await write_json(writer, 400, {"error": f"bad request: {e}"}, keep_alive)
+                    else:
+                        if payload.get("stream"):
+                            await self._stream(writer, stream, keep_alive)
+                        else:
+                            text = await asyncio.get_running_loop().run_in_executor(None, stream.text)
+                            await write_json(writer, 200, {"text": text}, keep_alive)
+                elif body is None:
+                    await write_json(writer, 413, {"error": "request body too large"}, keep_alive)
+                else:
+                    await write_json(writer, 404, {"error": "not found"}, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="mistralai/Mistral-7B-Instruct-v0.3",
+                        help="e.g. TinyLlama/TinyLlama-1.1B-Chat-v1.0 to run on CPU")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--prefix", action="append", default=[],
+                        help="prompt prefix (or template, up to its first placeholder) whose KV state is cached")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    tokenizer, model = get_generator(args.model, device=args.device)
+    prefix_cache = None
+    if args.prefix:
+        prefix_cache = PrefixKVCache(model, tokenizer)
+        for prefix in args.prefix:
+            prefix_cache.register(template_prefix(prefix))
+    scheduler = ContinuousBatchScheduler(tokenizer, model, device=args.device, max_batch=args.max_batch,
+                                         prefix_cache=prefix_cache).start()
+    asyncio.run(GenerationServer(scheduler, args.host, args.port).serve_forever())
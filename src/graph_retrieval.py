@@ -0,0 +1,152 @@
+import json
+import re
+from kg_store import normalize_label
+
+DEFAULT_CONFIG_PATH = "../improved_kg_vectorstore/config.json"
+
+# question wording that points at a relation but never spells out its label
+QUESTION_CUES = {
+    "head of state": ("head of state", "president of", "monarch of"),
+    "head of government": ("head of government", "prime minister of"),
+    "place of birth": ("born", "birthplace", "birth place"),
+    "educated at": ("university", "educated", "education", "studied", "study", "attend"),
+    "located in": ("which country", "what country"),
+    "spouse": ("spouse", "married", "wife", "husband"),
+    "country of citizenship": ("citizenship", "citizen of"),
+    "chief executive officer": ("ceo", "chief executive"),
+    "headquarters location": ("headquarters", "headquartered"),
+}
+# leading words of relation_map phrases ("was born in") that do not appear in questions
+PHRASE_PREFIXES = ("is ", "was ", "has ", "holds ")
+
+
+def load_relation_map(config_path=DEFAULT_CONFIG_PATH):
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("relation_map", {})
+
+
+def contains_phrase(text, phrase):
+    return re.search(r"(?<!\w)" + re.escape(phrase) + r"(?!\w)", text) is not None
+
+
+class GraphRetriever:
+    """
+    Answers multi-hop questions by walking the KGStore instead of retrieving flat facts.
+
+    The question is linked to an anchor node (longest label span) and a set of relations
+    (label, relation_map phrase or cue word). A bounded search then looks for paths from the
+    anchor that use every linked relation exactly once, in either edge direction. One distinct
+    end node is returned as the answer, several become a minimal path context for the LLM.
+    """
+
+    def __init__(self, store, relation_map=None, max_hops=3, max_paths=64, max_span=8):
+        self.store = store
+        self.max_hops = max_hops
+        self.max_paths = max_paths
+        self.max_span = max_span
+        self.stats = {"answered": 0, "path_context": 0, "unresolved": 0}
+        self.relation_cues = self._build_cues(relation_map or {})
+
+    @classmethod
+    def from_config(cls, store, config_path=DEFAULT_CONFIG_PATH, **kwargs):
+        return cls(store, load_relation_map(config_path), **kwargs)
+
+    def _build_cues(self, relation_map):
+        cues = {}
+        for rel, name in enumerate(self.store.relations):
+            phrases = cues.setdefault(rel, set())
+            phrases.add(name.lower())
+            phrases.update(QUESTION_CUES.get(name, ()))
+
+        for key, value in relation_map.items():
+            if key.startswith("http"):
+                # ".../prop/direct/P35": "head of state", the URI itself can appear in raw questions
+                rel = self.store.relation(value)
+                phrase = key.lower()
+            else:
+                rel = self.store.relation(key)
+                phrase = value.lower()
+                for prefix in PHRASE_PREFIXES:
+                    if phrase.startswith(prefix):
+                        phrase = phrase[len(prefix):]
+                        break
+            if rel is not None:
+                cues[rel].add(phrase)
+        return cues
+
+    def link_entities(self, question):
+        """
+        Nodes whose label matches a span of the question, longest spans first
+        """
+        words = re.findall(r"[\w'.,-]+", question)
+        words = [w.strip("?,.") for w in words]
+        found, seen = [], set()
+        for size in range(min(self.max_span, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                span = " ".join(words[start:start + size])
+                for node in self.store.nodes_for_label(span):
+                    if node not in seen:
+                        seen.add(node)
+                        found.append(node)
+        return found
+
+    def link_relations(self, question):
+        question = normalize_label(question)
+        return [rel for rel, phrases in self.relation_cues.items()
+                if any(contains_phrase(question, phrase) for phrase in phrases)]
+
+    def find_paths(self, anchor, relations):
+        """
+        Paths from anchor that use each of the relations exactly once, as lists of triples
+        """
+        paths = []
+        stack = [(anchor, (), frozenset(relations))]
+        while stack and len(paths) < self.max_paths:
+            node, path, remaining = stack.pop()
+            if not remaining:
+                paths.append(list(path))
+                continue
+            for neighbor, rel, outgoing in self.store.edges(node):
+                if rel not in remaining:
+                    continue
+                triple = (node, rel, neighbor) if outgoing else (neighbor, rel, node)
+                if triple in path:
+                    continue
+                stack.append((neighbor, path + (triple,), remaining - {rel}))
+        return paths
+
+    @staticmethod
+    def path_end(anchor, path):
+        node = anchor
+        for s, _, o in path:
+            node = o if s == node else s
+        return node
+
+    def facts(self, triples):
+        return [{"text": text} for text in self.store.humanize(triples)]
+
+    def resolve(self, question):
+        """
+        {"answer": label or None, "path": triples, "context": fact records {"text": ...}},
+        or None when the question cannot be linked to the graph at all
+        """
+        relations = self.link_relations(question)
+        if not relations or len(relations) > self.max_hops:
+            self.stats["unresolved"] += 1
+            return None
+
+        for anchor in self.link_entities(question):
+            paths = self.find_paths(anchor, relations)
+            if not paths:
+                continue
+            answers = {self.store.label(self.path_end(anchor, path)) for path in paths}
+            if len(answers) == 1:
+                self.stats["answered"] += 1
+                return {"answer": answers.pop(), "path": paths[0], "context": self.facts(paths[0])}
+            # ambiguous: the union of the competing paths is still far smaller than k retrieved facts
+            triples = sorted({triple for path in paths for triple in path})
+            self.stats["path_context"] += 1
+            return {"answer": None, "path": triples, "context": self.facts(triples)}
+
+        self.stats["unresolved"] += 1
+        return None
@@ -0,0 +1,304 @@
+import json
+import re
+from collections import deque
+import numpy as np
+
+WIKIDATA_ID = re.compile(r"^[QP]\d+$")
+# keys that hold a usable name when a node label is a dict of properties
+NAME_KEYS = ("Commons category", "en", "name", "label")
+
+
+def node_label(node):
+    label = node.get("label")
+    if isinstance(label, dict):
+        found = next((label[key] for key in NAME_KEYS if isinstance(label.get(key), str)), None)
+        label = found or next((value for value in label.values() if isinstance(value, str)), None)
+    return label if isinstance(label, str) else None
+
+
+def normalize_label(label):
+    return " ".join(label.lower().split())
+
+
+class KGStore:
+    """
+    Global triple store merged from the per-question graphs of the QA datasets.
+
+    Nodes and relations are interned to integer ids. Triples are kept twice in CSR form,
+    sorted by (subject, relation) and by (object, relation), so "objects of s via r" and
+    "subjects of o via r" are a slice plus a binary search, with no per-question graph building.
+    Wikidata ids (Q.../P...) are merged across datasets directly; generated node ids
+    (uuids in qa_dataset_wikidata.json) are merged by label.
+    """
+
+    def __init__(self):
+        self.node_keys = []
+        self.node_labels = []
+        self.relations = []
+        self.relation_pids = []
+        self._node_index = {}
+        self._relation_index = {}
+        self._label_index = {}
+        self._pending = []
+        self._built = False
+
+    # ---- building ----
+
+    def _intern_node(self, key, label):
+        node = self._node_index.get(key)
+        if node is None:
+            node = self._node_index[key] = len(self.node_keys)
+            self.node_keys.append(key)
+            self.node_labels.append(label or key)
+        elif label and self.node_labels[node] == key:
+            self.node_labels[node] = label
+        if label:
+            ids = self._label_index.setdefault(normalize_label(label), [])
+            if node not in ids:
+                ids.append(node)
+        return node
+
+    def _intern_relation(self, relation, pid=None):
+        rel = self._relation_index.get(relation)
+        if rel is None:
+            rel = self._relation_index[relation] = len(self.relations)
+            self.relations.append(relation)
+            self.relation_pids.append(pid)
+        elif pid and not self.relation_pids[rel]:
+            self.relation_pids[rel] = pid
+        return rel
+
+    def add_graph(self, graph, entity=None, entity_id=None):
+        """
+        Merge one {"nodes": [...], "edges": [...]} graph into the store
+        """
+        local = {}
+        for node in graph.get("nodes", []):
+            node_id = str(node["id"])
+            label = node_label(node)
+            if not label and entity and node_id == entity_id:
+                label = entity
+            if WIKIDATA_ID.match(node_id) or not label:
+                key = node_id
+            else:
+                key = "label:" + normalize_label(label)
+            local[node_id] = self._intern_node(key, label)
+
+        for edge in graph.get("edges", []):
+            source, target = str(edge["source"]), str(edge["target"])
+            s = local.get(source)
+            if s is None:
+                s = local[source] = self._intern_node(source, None)
+            o = local.get(target)
+            if o is None:
+                o = local[target] = self._intern_node(target, None)
+            r = self._intern_relation(edge.get("relation") or edge.get("relation_id", "related to"),
+                                      edge.get("relation_id"))
+            self._pending.append((s, r, o))
+        self._built = False
+
+    def add_dataset(self, items):
+        for item in items:
+            if "graph" in item:
+                self.add_graph(item["graph"], item.get("entity"), item.get("entity_id"))
+        return self
+
+    @classmethod
+    def from_files(cls, paths):
+        store = cls()
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                store.add_dataset(json.load(f))
+        store.build()
+        return store
+
+    def build(self):
+        triples = np.unique(np.array(self._pending, dtype=np.int64).reshape(-1, 3), axis=0)
+        self._pending = [tuple(t) for t in triples]
+        self.triples = triples
+        n = len(self.node_keys)
+
+        def csr(key_col, rel_col, val_col):
+            order = np.lexsort((triples[:, val_col], triples[:, rel_col], triples[:, key_col]))
+            keys = triples[order, key_col]
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+            return indptr, triples[order, rel_col].copy(), triples[order, val_col].copy()
+
+        self.out_indptr, self.out_rel, self.out_obj = csr(0, 1, 2)
+        self.in_indptr, self.in_rel, self.in_subj = csr(2, 1, 0)
+        self._built = True
+        return self
+
+    def _ensure_built(self):
+        if not self._built:
+            self.build()
+
+    # ---- lookup ----
+
+    def __len__(self):
+        self._ensure_built()
+        return len(self.triples)
+
+    def node(self, key):
+        return self._node_index.get(key)
+
+    def nodes_for_label(self, label):
+        return list(self._label_index.get(normalize_label(label), []))
+
+    def relation(self, name):
+        return self._relation_index.get(name)
+
+    def label(self, node):
+        return self.node_labels[node]
+
+    def _slice(self, indptr, rels, vals, node, relation):
+        start, end = indptr[node], indptr[node + 1]
+        if relation is None:
+            return vals[start:end], rels[start:end]
+        # relations are sorted within each node's slice
+        lo = start + np.searchsorted(rels[start:end], relation, side="left")
+        hi = start + np.searchsorted(rels[start:end], relation, side="right")
+        return vals[lo:hi], rels[lo:hi]
+
+    def objects(self, subject, relation=None):
+        self._ensure_built()
+        return self._slice(self.out_indptr, self.out_rel, self.out_obj, subject, relation)[0]
+
+    def subjects(self, obj, relation=None):
+        self._ensure_built()
+        return self._slice(self.in_indptr, self.in_rel, self.in_subj, obj, relation)[0]
+
+    def edges(self, node, direction="both", relation=None):
+        """
+        (neighbor, relation, is_outgoing) for every edge touching node
+        """
+        self._ensure_built()
+        result = []
+        if direction in ("out", "both"):
+            vals, rels = self._slice(self.out_indptr, self.out_rel, self.out_obj, node, relation)
+            result.extend((int(v), int(r), True) for v, r in zip(vals, rels))
+        if direction in ("in", "both"):
+            vals, rels = self._slice(self.in_indptr, self.in_rel, self.in_subj, node, relation)
+            result.extend((int(v), int(r), False) for v, r in zip(vals, rels))
+        return result
+
+    def k_hop(self, seeds, k, direction="both", relations=None):
+        """
+        All nodes within k hops of the seed nodes, optionally following only the given relation ids
+        """
+        self._ensure_built()
+        allowed = set(relations) if relations is not None else None
+        visited = set(seeds)
+        frontier = list(seeds)
+        for _ in range(k):
+            next_frontier = []
+            for node in frontier:
+                for neighbor, rel, _ in self.edges(node, direction):
+                    if allowed is not None and rel not in allowed:
+                        continue
+                    if neighbor not in visited:
+                        visited.add(neighbor)
+                        next_frontier.append(neighbor)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return visited
+
+    def find_path(self, source, target, max_hops=3, direction="both"):
+        """
+        Shortest path as a list of (subject, relation, object) triples, or None.
+        Edges walked against their direction are still reported subject -> object.
+        """
+        self._ensure_built()
+        if source == target:
+            return []
+        parents = {source: None}
+        queue = deque([(source, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            if depth == max_hops:
+                continue
+            for neighbor, rel, outgoing in self.edges(node, direction):
+                if neighbor in parents:
+                    continue
+                triple = (node, rel, neighbor) if outgoing else (neighbor, rel, node)
+                parents[neighbor] = (node, triple)
+                if neighbor == target:
+                    path = []
+                    while parents[neighbor] is not None:
+                        neighbor, step = parents[neighbor]
+                        path.append(step)
+                    return path[::-1]
+                queue.append((neighbor, depth + 1))
+        return None
+
+    def neighborhood_triples(self, seeds, k=1, direction="both"):
+        """
+        Every triple among the nodes of the k-hop neighborhood of the seeds
+        """
+        nodes = self.k_hop(seeds, k, direction)
+        result = set()
+        for node in nodes:
+            for neighbor, rel, outgoing in self.edges(node, "out"):
+                if neighbor in nodes:
+                    result.add((node, rel, neighbor))
+        return sorted(result)
+
+    def relation_label(self, relation, property_labels=None):
+        pid = self.relation_pids[relation]
+        if property_labels and pid in property_labels:
+            return property_labels[pid]
+        return self.relations[relation]
+
+    def humanize(self, triples, property_labels=None):
+        return [f"{self.label(s)} {self.relation_label(r, property_labels)} {self.label(o)}" for s, r, o in triples]
+
+    def entity_facts(self, node, property_labels=None):
+        """
+        "source relation target" sentences for every outgoing edge of node
+        """
+        return self.humanize([(node, r, o) for o, r, _ in self.edges(node, "out")], property_labels)
+
+    def describe_path(self, path):
+        """
+        find_path output in the notebooks' path_data format
+        """
+        return [{"source": self.node_keys[s], "source_label": self.label(s),
+                 "target": self.node_keys[o], "target_label": self.label(o),
+                 "relation": self.relations[r]} for s, r, o in path]
+
+    # ---- persistence ----
+
+    def save(self, path):
+        """
+        Save as path + ".npz" (CSR arrays) and path + ".json" (node and relation tables)
+        """
+        self._ensure_built()
+        np.savez(path + ".npz", triples=self.triples,
+                 out_indptr=self.out_indptr, out_rel=self.out_rel, out_obj=self.out_obj,
+                 in_indptr=self.in_indptr, in_rel=self.in_rel, in_subj=self.in_subj)
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump({"node_keys": self.node_keys, "node_labels": self.node_labels,
+                       "relations": self.relations, "relation_pids": self.relation_pids}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            tables = json.load(f)
+        store.node_keys = tables["node_keys"]
+        store.node_labels = tables["node_labels"]
+        store.relations = tables["relations"]
+        store.relation_pids = tables["relation_pids"]
+        store._node_index = {key: i for i, key in enumerate(store.node_keys)}
+        store._relation_index = {rel: i for i, rel in enumerate(store.relations)}
+        for i, label in enumerate(store.node_labels):
+            if label != store.node_keys[i]:
+                store._label_index.setdefault(normalize_label(label), []).append(i)
+        arrays = np.load(path + ".npz")
+        for name in arrays.files:
+            setattr(store, name, arrays[name])
+        store._pending = [tuple(t) for t in store.triples]
+        store._built = True
+        return store
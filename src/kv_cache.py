@@ -0,0 +1,179 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+
+try:
+    from transformers import DynamicCache
+except ImportError:  # older transformers only know the legacy tuple cache
+    DynamicCache = None
+
+
+def to_legacy(cache):
+    """
+    ((key, value) per layer) view of whatever cache object the model returned
+    """
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    if hasattr(cache, "layers"):
+        return tuple((layer.keys, layer.values) for layer in cache.layers)
+    return cache
+
+
+def from_legacy(past):
+    if DynamicCache is None:
+        return past
+    cache = DynamicCache()
+    for layer_idx, (key, value) in enumerate(past):
+        cache.update(key, value, layer_idx)
+    return cache
+
+
+def pad_left(past, mask, length):
+    """
+    Left-pad a legacy KV cache and its attention mask to `length` positions
+    """
+    missing = length - mask.shape[1]
+    if missing <= 0:
+        return past, mask
+    padded = []
+    for key, value in past:
+        pad = key.new_zeros(key.shape[0], key.shape[1], missing, key.shape[3])
+        padded.append((torch.cat([pad, key], dim=2), torch.cat([pad.clone(), value], dim=2)))
+    return tuple(padded), torch.cat([mask.new_zeros(mask.shape[0], missing), mask], dim=1)
+
+
+def expand_batch(past, batch_size):
+    return tuple((k.expand(batch_size, -1, -1, -1).contiguous(), v.expand(batch_size, -1, -1, -1).contiguous())
+                 for k, v in past)
+
+
+def template_prefix(template):
+    """
+    Fixed text of a prompt template before its first placeholder
+    """
+    return template.split("{", 1)[0]
+
+
+class PrefixKVCache:
+    """
+    KV state of shared prompt prefixes (e.g. a fixed RAG instruction), computed once per model
+    and reused by every prompt that starts with the same tokens.
+
+    Prefixes are registered as text. A prompt reuses the longest registered prefix it shares
+    token-for-token (the last prefix token may tokenize differently once text follows it, so
+    the shared length is measured on the prompt's own tokens). Entries are keyed by a hash of
+    those prefix token ids and evicted least recently used.
+    """
+
+    def __init__(self, model, tokenizer, max_entries=8, min_prefix_tokens=4):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = next(model.parameters()).device
+        self.max_entries = max_entries
+        self.min_prefix_tokens = min_prefix_tokens
+        self.prefixes = []
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "reused_tokens": 0}
+
+    @staticmethod
+    def key(ids):
+        return hashlib.sha1(np.asarray(ids, dtype=np.int64).tobytes()).hexdigest()
+
+    def register(self, prefix_text):
+        ids = self.tokenizer(prefix_text)["input_ids"]
+        if len(ids) >= self.min_prefix_tokens and ids not in self.prefixes:
+            self.prefixes.append(ids)
+        return self
+
+    def match(self, ids):
+        """
+        Number of leading tokens of ids covered by a registered prefix, 0 if none
+        """
+        best = 0
+        for prefix in self.prefixes:
+            shared = 0
+            for a, b in zip(prefix, ids):
+                if a != b:
+                    break
+                shared += 1
+            best = max(best, shared)
+        # at least one prompt token has to go through the model to get next-token logits
+        best = min(best, len(ids) - 1)
+        return best if best >= self.min_prefix_tokens else 0
+
+    def lookup(self, ids):
+        """
+        (prefix length, legacy KV cache of ids[:length]) for the prompt's shared prefix, or (0, None)
+        """
+        length = self.match(ids)
+        if not length:
+            return 0, None
+        key = self.key(ids[:length])
+        with self._lock:
+            past = self._entries.get(key)
+            if past is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["reused_tokens"] += length
+                return length, past
+            self.stats["misses"] += 1
+
+        with torch.no_grad():
+            outputs = self.model(input_ids=torch.tensor([ids[:length]], device=self.device), use_cache=True)
+        past = to_legacy(outputs.past_key_values)
+        with self._lock:
+            self._entries[key] = past
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return length, past
+
+    def generate(self, prompt, max_new_tokens=32, **generate_kwargs):
+        """
+        model.generate for one prompt starting from the cached prefix state; returns the output ids
+        """
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        length, past = self.lookup(inputs["input_ids"][0].tolist())
+        if past is not None:
+            # a fresh cache object, generate extends it in place
+            generate_kwargs["past_key_values"] = from_legacy(past)
+        with torch.no_grad():
+            return self.model.generate(**inputs, max_new_tokens=max_new_tokens, **generate_kwargs)
+
+    def generate_batch(self, prompts, max_new_tokens=32, **generate_kwargs):
+        """
+        model.generate for many prompts; prompts sharing a cached prefix are decoded as one batch
+        from its state, with the padding between the prefix and each prompt's own tokens (the
+        attention mask hides it). Returns the generated ids of every prompt, in input order.
+        """
+        sequences = self.tokenizer(prompts)["input_ids"]
+        groups = {}
+        for i, ids in enumerate(sequences):
+            length, past = self.lookup(ids)
+            groups.setdefault((length, id(past)), (length, past, []))[2].append(i)
+
+        pad_id = generate_kwargs.get("pad_token_id", self.tokenizer.pad_token_id)
+        generated = [None] * len(prompts)
+        for length, past, members in groups.values():
+            prefix = sequences[members[0]][:length]
+            suffixes = [sequences[i][length:] for i in members]
+            width = max(len(ids) for ids in suffixes)
+            input_ids = torch.tensor([prefix + [pad_id] * (width - len(ids)) + ids for ids in suffixes],
+                                     device=self.device)
+            mask = torch.tensor([[1] * length + [0] * (width - len(ids)) + [1] * len(ids) for ids in suffixes],
+                                device=self.device)
+            kwargs = dict(generate_kwargs)
+            if past is not None:
+                kwargs["past_key_values"] = from_legacy(expand_batch(past, len(members)))
+            with torch.no_grad():
+                outputs = self.model.generate(input_ids=input_ids, attention_mask=mask, max_new_tokens=max_new_tokens,
+                                              **kwargs)
+            for i, row in zip(members, outputs[:, input_ids.shape[1]:]):
+                generated[i] = row
+        return generated
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
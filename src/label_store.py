@@ -0,0 +1,218 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+import requests
+from wikidata_harvester import SparqlClient
+
+logger = logging.getLogger(__name__)
+
+WIKIDATA_API = "https://www.wikidata.org/w/api.php"
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "wikidata_labels.sqlite")
+WIKIDATA_ID = re.compile(r"^[QP]\d+$")
+WBGETENTITIES_LIMIT = 50  # ids per wbgetentities call
+SQLITE_CHUNK = 500  # stay well below SQLITE_MAX_VARIABLE_NUMBER
+
+_UNKNOWN = object()
+
+
+class WikidataAPIError(RuntimeError):
+    pass
+
+
+def collect_ids(items):
+    """
+    Every QID/PID referenced by the graphs, triples and questions of the QA items
+    """
+    ids = set()
+    for item in items:
+        graph = item.get("graph", {})
+        for node in graph.get("nodes", []):
+            ids.add(str(node["id"]))
+        for edge in graph.get("edges", []):
+            ids.update((str(edge["source"]), str(edge["target"]), str(edge.get("relation_id", ""))))
+        for triple in item.get("triples", []):
+            ids.update(str(part) for part in triple[:3])
+        for match in re.findall(r'http://www\.wikidata\.org/prop/direct/(p\d+)', item.get("question", ""),
+                                flags=re.IGNORECASE):
+            ids.add(match.upper())
+    return sorted(i for i in ids if WIKIDATA_ID.match(i))
+
+
+class LabelStore:
+    """
+    Persistent QID/PID -> label store shared by all datasets and notebooks.
+
+    Lookups go through an in-process LRU, then a SQLite table, and only then to batched
+    wbgetentities calls (50 ids each). Ids Wikidata does not know are stored too, so they are
+    not asked for again; ids of a failed request (e.g. a maxlag error) are not stored. With
+    offline=True the network is never used and unknown ids resolve to None (label() falls back
+    to the id itself).
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, language="en", offline=False, lru_size=100_000,
+                 client=None, api_url=WIKIDATA_API):
+        self.language = language
+        self.offline = offline
+        self.lru_size = lru_size
+        self.client = client
+        self.api_url = api_url
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "db_hits": 0, "fetched": 0, "offline_misses": 0, "fetch_errors": 0}
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS labels (id TEXT, language TEXT, label TEXT, PRIMARY KEY (id, language))"
+        )
+        self.db.commit()
+
+    def _client(self):
+        if self.client is None:
+            self.client = SparqlClient(endpoint=self.api_url, user_agent="KnowledgeGraphLLMProject/1.0", cache_dir=None)
+        return self.client
+
+    def _remember(self, wid, label):
+        self._lru[wid] = label
+        self._lru.move_to_end(wid)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _from_db(self, ids):
+        found = {}
+        for i in range(0, len(ids), SQLITE_CHUNK):
+            chunk = ids[i:i + SQLITE_CHUNK]
+            rows = self.db.execute(
+                f"SELECT id, label FROM labels WHERE language = ? AND id IN ({','.join('?' * len(chunk))})",
+                [self.language, *chunk]
+            )
+            found.update(rows)
+        return found
+
+    def _store(self, labels):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO labels (id, language, label) VALUES (?, ?, ?)",
+            [(wid, self.language, label) for wid, label in labels.items()]
+        )
+        self.db.commit()
+
+    def fetch(self, ids):
+        """
+        Labels of ids from the wbgetentities API, 50 ids per request. Entities the API marks
+        missing, or that have no label in the language, map to None; ids the response does not
+        mention are left out. Raises WikidataAPIError when the API answers with an error
+        (e.g. maxlag), which it does with HTTP 200.
+        """
+        labels = {}
+        for i in range(0, len(ids), WBGETENTITIES_LIMIT):
+            batch = ids[i:i + WBGETENTITIES_LIMIT]
+            data = self._client().get_json({
+                "action": "wbgetentities",
+                "ids": "|".join(batch),
+                "format": "json",
+                "props": "labels",
+                "languages": self.language,
+            })
+            if "error" in data or "entities" not in data:
+                error = data.get("error", {})
+                raise WikidataAPIError(f"wbgetentities failed: {error.get('code', 'no entities')} "
+                                       f"{error.get('info', '')}".strip())
+            for wid in batch:
+                entity = data["entities"].get(wid)
+                if entity is None:
+                    continue
+                labels[wid] = None if "missing" in entity else \
+                    entity.get("labels", {}).get(self.language, {}).get("value")
+        return labels
+
+    def get_many(self, ids):
+        """
+        {id: label or None} for the given ids
+        """
+        ids = list(dict.fromkeys(str(i) for i in ids))
+        result = {}
+        with self._lock:
+            missing = []
+            for wid in ids:
+                label = self._lru.get(wid, _UNKNOWN)
+                if label is _UNKNOWN:
+                    missing.append(wid)
+                else:
+                    self._lru.move_to_end(wid)
+                    self.stats["memory_hits"] += 1
+                    result[wid] = label
+
+            if missing:
+                stored = self._from_db(missing)
+                self.stats["db_hits"] += len(stored)
+                for wid, label in stored.items():
+                    self._remember(wid, label)
+                    result[wid] = label
+                missing = [wid for wid in missing if wid not in stored]
+
+            # only real Wikidata ids are worth a request, uuids and literals are not
+            to_fetch = [wid for wid in missing if WIKIDATA_ID.match(wid)]
+            if self.offline:
+                self.stats["offline_misses"] += len(to_fetch)
+                to_fetch = []
+            for i in range(0, len(to_fetch), WBGETENTITIES_LIMIT):
+                # stored batch by batch, so a failing request only leaves its own ids unresolved
+                try:
+                    fetched = self.fetch(to_fetch[i:i + WBGETENTITIES_LIMIT])
+                except (WikidataAPIError, requests.RequestException) as e:
+                    self.stats["fetch_errors"] += 1
+                    logger.warning(f"Label lookup failed, ids stay unresolved until the next lookup: {e}")
+                    continue
+                self._store(fetched)
+                self.stats["fetched"] += len(fetched)
+                for wid, label in fetched.items():
+                    self._remember(wid, label)
+                    result[wid] = label
+
+        for wid in ids:
+            result.setdefault(wid, None)
+        return result
+
+    def get(self, wid):
+        return self.get_many([wid])[wid]
+
+    def label(self, wid):
+        """
+        Label of wid, or wid itself when it has none
+        """
+        return self.get(wid) or wid
+
+    def labels(self, ids):
+        return {wid: label or wid for wid, label in self.get_many(ids).items()}
+
+    def prefetch(self, ids):
+        """
+        Bulk-populate the store so later lookups are local; returns how many ids were fetched
+        """
+        before = self.stats["fetched"]
+        self.get_many(ids)
+        return self.stats["fetched"] - before
+
+    def add(self, labels):
+        """
+        Seed the store with labels already known locally, e.g. node labels from the QA datasets
+        """
+        labels = {str(wid): label for wid, label in labels.items() if isinstance(label, str)}
+        with self._lock:
+            self._store(labels)
+            for wid, label in labels.items():
+                self._remember(wid, label)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,122 @@
+import gc
+import threading
+
+
+def default_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models, keyed by (kind, name, device, dtype).
+    Every model is loaded once on first use and shared by all callers.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        # one lock per key so two threads never load the same weights twice,
+        # while loading different models does not serialize
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            model = self._models.get(key)
+            if model is None:
+                model = loader()
+                self._models[key] = model
+        return model
+
+    def loaded(self):
+        return list(self._models)
+
+    def unload(self, kind=None, name=None):
+        """
+        Drop cached models matching kind and/or name (all models if both are None)
+        """
+        with self._lock:
+            keys = [k for k in self._models
+                    if (kind is None or k[0] == kind) and (name is None or k[1] == name)]
+            for key in keys:
+                del self._models[key]
+                self._key_locks.pop(key, None)
+
+        if keys:
+            gc.collect()
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+        return keys
+
+
+registry = ModelRegistry()
+
+
+def get_embedder(model_name="all-MiniLM-L6-v2", device=None):
+    device = device or default_device()
+
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device=device)
+
+    return registry.get(("embedder", model_name, device, None), load)
+
+
+def get_generator(model_path, device=None, dtype=None):
+    """
+    Return (tokenizer, model) for a causal LM
+    """
+    import torch
+    device = device or default_device()
+    dtype = dtype or (torch.float16 if device == "cuda" else torch.float32)
+
+    def load():
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            device_map = "auto" if device == "cuda" else None,
+            torch_dtype = dtype,
+            trust_remote_code = True,
+            low_cpu_mem_usage = True,
+        )
+        model.eval()
+        return tokenizer, model
+
+    return registry.get(("generator", model_path, device, str(dtype)), load)
+
+
+def get_bert_scorer(model_type="bert-base-uncased", lang="en", device=None):
+    device = device or default_device()
+
+    def load():
+        from bert_score import BERTScorer
+        return BERTScorer(model_type=model_type, lang=lang, device=device)
+
+    return registry.get(("bert_scorer", model_type, device, None), load)
+
+
+def warmup(embedders=(), generators=(), bert_scorers=(), device=None):
+    """
+    Eagerly load models so the first query does not pay the load cost
+    """
+    for name in embedders:
+        get_embedder(name, device=device)
+    for path in generators:
+        get_generator(path, device=device)
+    for model_type in bert_scorers:
+        get_bert_scorer(model_type, device=device)
+
+
+def unload(kind=None, name=None):
+    return registry.unload(kind=kind, name=name)
@@ -1,30 +1,119 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
 import torch
 import time
 import faiss
 import json
-from sentence_transformers import SentenceTransformer
+import os
 import numpy as np
-
-
-def load_index(index_path):
-    return faiss.read_index(index_path)
+from answer_cache import SemanticAnswerCache
+from context_packer import ContextPacker
+from embedding_cache import cached_encode
+from fact_store import FactStore
+from graph_retrieval import GraphRetriever
+from kg_store import KGStore
+from kv_cache import PrefixKVCache, template_prefix
+from model_registry import get_generator
+from result_stream import JsonlResultWriter, load_done_ids, qa_ids
+from sharded_index import ShardedIndex, fact_matches
+from sparse_index import BM25Index, reciprocal_rank_fusion, sparse_index_path
+
+
+def load_index(index_path, nprobe=None, ef_search=None):
+    # a directory holds a sharded index built with build_db --shard-by
+    if os.path.isdir(index_path):
+        index = ShardedIndex.load(index_path)
+        index.set_search_params(nprobe=nprobe, ef_search=ef_search)
+        return index
+    index = faiss.read_index(index_path)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    # search-time knobs for IVF (nprobe) and HNSW (efSearch) backends, indexes without the knob ignore it
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
 
 def load_metadata(metadata_path):
+    # memory-mapped store: rows are parsed only when retrieve_facts asks for them
+    if metadata_path.endswith(".bin"):
+        return FactStore(metadata_path)
     with open(metadata_path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def embed_query(query, model_name="all-MiniLM-L6-v2"):
-    model = SentenceTransformer(model_name)
-    emb = model.encode([query], convert_to_numpy=True)
+        facts = json.load(f)
+    # incrementally built indexes address facts by stable id instead of position
+    if facts and "id" in facts[0]:
+        return {fact["id"]: fact for fact in facts}
+    return facts
+
+def embed_queries(queries, model_name="all-MiniLM-L6-v2", batch_size=64):
+    # repeated questions are served from the shared embedding cache
+    emb = cached_encode(queries, model_name, batch_size=batch_size)
     faiss.normalize_L2(emb)
     return emb
 
-def retrieve_facts(query, index, metadata, top_k=10):
-    query_emb = embed_query(query)
-    distances, indices = index.search(query_emb, top_k)  # get closest facts
-    results = [metadata[i] for i in indices[0]]
-    return results
+def embed_query(query, model_name="all-MiniLM-L6-v2"):
+    return embed_queries([query], model_name)
+
+def index_ids(index):
+    # fact ids stored in a FAISS or sharded index
+    if isinstance(index, ShardedIndex):
+        return np.concatenate(list(index.shard_ids.values())) if index.shard_ids else np.zeros(0, dtype=np.int64)
+    if hasattr(index, "id_map"):
+        return faiss.vector_to_array(index.id_map)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+def load_sparse_index(index_path, index):
+    # BM25 postings that build_db writes next to the FAISS index, None for indexes built without them
+    # or when they belong to an earlier build over other facts (their ids would point at the wrong facts)
+    path = sparse_index_path(index_path)
+    if not os.path.exists(path + ".npz"):
+        return None
+    if not BM25Index.built_for(path, index_ids(index)):
+        print(f"Ignoring {path}: built for other facts than {index_path}, rebuild it with build_db")
+        return None
+    return BM25Index.load(path)
+
+def retrieve_facts(query, index, metadata, top_k=10, sparse_index=None, filters=None):
+    return retrieve_facts_batch([query], index, metadata, top_k, sparse_index=sparse_index, filters=filters)[0]
+
+def retrieve_facts_batch(queries, index, metadata, top_k=10, with_ids=False, sparse_index=None, candidates=50,
+                         filters=None, filter_oversample=4):
+    # one encode call and one multi-query search for the whole batch
+    query_embs = embed_queries(queries)
+    depth = top_k if sparse_index is None else max(top_k, candidates)
+    if filters and isinstance(index, ShardedIndex):
+        # only matching shards and ids are searched; filters on fields without postings are checked afterwards
+        if index.unindexed_filters(filters):
+            depth = min(depth * filter_oversample, index.ntotal)
+        distances, indices = index.search(query_embs, depth, filters=filters)
+    elif filters:
+        # a single index can only filter afterwards, so it over-fetches
+        distances, indices = index.search(query_embs, min(depth * filter_oversample, index.ntotal))
+    else:
+        distances, indices = index.search(query_embs, depth)  # get closest facts
+    fact_ids = [[int(i) for i in row if i != -1] for row in indices]
+    if sparse_index is not None:
+        # exact entity names the embedder misses come from BM25, the two rankings are fused by rank
+        sparse = sparse_index.search_batch(queries, depth)
+        fact_ids = [reciprocal_rank_fusion([dense, ids.tolist()]) for dense, (ids, _) in zip(fact_ids, sparse)]
+    if filters:
+        fact_ids = [[i for i in row if fact_matches(metadata[i], filters)] for row in fact_ids]
+    fact_ids = [row[:top_k] for row in fact_ids]
+    facts = [[metadata[i] for i in row] for row in fact_ids]
+    # with_ids also returns the fact ids, e.g. to tie cached answers to their source facts
+    return (facts, fact_ids) if with_ids else facts
+
+# the fixed instruction before the first placeholder is what Mistral7BHandler.cache_prefix keeps
+RAG_PROMPT_TEMPLATE = ("The context provided contains relevant facts. Answer based on them.\n"
+                       "Context: {context}\nQuestion: {query}\nAnswer: ")
+
+def build_rag_prompt(query, facts):
+    context = " ".join([fact['text'] for fact in facts])
+    return RAG_PROMPT_TEMPLATE.format(context=context, query=query)
 
 class Mistral7BHandler: 
 
@@ -32,31 +121,43 @@ class Mistral7BHandler:
 
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         # print(f"Load model on {self.device}.")
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_path, 
-            device_map = "auto" if self.device == "cuda" else None, 
-            torch_dtype = torch.float16 if self.device == "cuda" else torch.float32, 
-            trust_remote_code = True, 
-            low_cpu_mem_usage = True,
-        )
-        #.to(self.device)
+        # shared with every other handler for the same model/device
+        self.tokenizer, self.model = get_generator(model_path, device=self.device)
+        # left padding so batched prompts all end where generation starts
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.prefix_cache = None
         # print(next(self.model.parameters()).device)
 
+    def cache_prefix(self, prefix, max_entries = 8):
+        """
+        Keep the KV state of a fixed prompt prefix (e.g. the RAG instruction) and reuse it
+        in generate() and serve() for every prompt that starts with it
+        """
+        if self.prefix_cache is None:
+            self.prefix_cache = PrefixKVCache(self.model, self.tokenizer, max_entries = max_entries)
+        self.prefix_cache.register(prefix)
+        return self.prefix_cache
 
-    def generate(self, prompt, max_length = 32, temperature = 0.7, top_p = 0.9): 
+
+    def generate(self, prompt, max_new_tokens = 32, temperature = 0.7, top_p = 0.9): 
         
-        inputs = self.tokenizer(prompt, return_tensors = "pt").to(self.device) # tokenize input prompt 
         start_time = time.time()
-        outputs = self.model.generate(
-            **inputs, 
-             max_new_tokens=32,
+        generate_kwargs = dict(
+            max_new_tokens = max_new_tokens, # counts generated tokens only, long RAG prompts still get an answer
             # temperature = temperature, 
             # top_p = top_p, 
             do_sample = False, 
             eos_token_id=self.tokenizer.eos_token_id, # stop generation at the end of sequence token
             pad_token_id=self.tokenizer.pad_token_id # pad tokens to align inputs if needed
         )
+        if self.prefix_cache is not None:
+            # the shared instruction prefix is not prefilled again
+            outputs = self.prefix_cache.generate(prompt, **generate_kwargs)
+        else:
+            inputs = self.tokenizer(prompt, return_tensors = "pt").to(self.device) # tokenize input prompt
+            outputs = self.model.generate(**inputs, **generate_kwargs)
 
         elapsed = time.time() - start_time
         print(f"Generation took {elapsed:.2f} seconds")
@@ -64,64 +165,233 @@ class Mistral7BHandler:
 
         return decoded
 
-def rag_generate(handler, query, index, metadata, use_rag=False):
-    
+    def serve(self, max_batch = 8):
+        """
+        Start a continuous-batching scheduler on this model; concurrent callers use
+        scheduler.submit(prompt, max_new_tokens) to stream answers from one shared batch
+        """
+        # imported here, generation_server itself imports this module through retrieval_server
+        from generation_server import ContinuousBatchScheduler
+        return ContinuousBatchScheduler(self.tokenizer, self.model, device = self.device, max_batch = max_batch,
+                                        prefix_cache = self.prefix_cache).start()
+
+    def generate_batch(self, prompts, batch_size = 8, max_new_tokens = 32):
+        """
+        Greedy generation over many prompts, returns only the generated answers.
+        Prompts are sorted by token length so each padded batch wastes little compute.
+        """
+        answers = [None] * len(prompts)
+        start_time = time.time()
+        for i, text in self.iter_generate(prompts, batch_size, max_new_tokens):
+            answers[i] = text
+
+        elapsed = time.time() - start_time
+        print(f"Generated {len(prompts)} answers in {elapsed:.2f} seconds")
+        return answers
+
+    def iter_generate(self, prompts, batch_size = 8, max_new_tokens = 32):
+        """
+        Same as generate_batch, but yields (prompt index, answer) as soon as each batch finishes
+        """
+        lengths = [len(ids) for ids in self.tokenizer(prompts)["input_ids"]]
+        order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+
+        generate_kwargs = dict(
+            max_new_tokens = max_new_tokens,
+            do_sample = False,
+            eos_token_id = self.tokenizer.eos_token_id,
+            pad_token_id = self.tokenizer.pad_token_id
+        )
+        for b in range(0, len(order), batch_size):
+            batch_ids = order[b:b + batch_size]
+            if self.prefix_cache is not None:
+                # the batch starts from the cached prefix state instead of prefilling it per row
+                new_tokens = self.prefix_cache.generate_batch([prompts[i] for i in batch_ids], **generate_kwargs)
+                new_tokens = [row.tolist() for row in new_tokens]
+            else:
+                inputs = self.tokenizer(
+                    [prompts[i] for i in batch_ids], return_tensors = "pt", padding = True
+                ).to(self.device)
+                with torch.no_grad():
+                    outputs = self.model.generate(**inputs, **generate_kwargs)
+                new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+            decoded = self.tokenizer.batch_decode(new_tokens, skip_special_tokens = True)
+            for i, text in zip(batch_ids, decoded):
+                yield i, text.strip()
+
+def rag_generate(handler, query, index, metadata, use_rag=False, graph_retriever=None, packer=None,
+                 answer_cache=None, sparse_index=None):
+
+    if graph_retriever is not None:
+        resolved = graph_retriever.resolve(query)
+        if resolved is not None:
+            if resolved["answer"] is not None:
+                return resolved["answer"]
+            return handler.generate(build_rag_prompt(query, resolved["context"]))
+
+    fact_ids = ()
     if use_rag:
-        retrieved_facts = retrieve_facts(query, index, metadata)
-        context = " ".join([fact['text'] for fact in retrieved_facts])
-        prompt = f"Context: {context}\nQuestion: {query}"
+        retrieved, retrieved_ids = retrieve_facts_batch([query], index, metadata, with_ids=True,
+                                                        sparse_index=sparse_index)
+        retrieved_facts, fact_ids = retrieved[0], retrieved_ids[0]
+
+    if answer_cache is not None:
+        # paraphrases only hit when they retrieved the same facts
+        cached = answer_cache.lookup(query, fact_ids)
+        if cached is not None:
+            return cached
+
+    if use_rag:
+        if packer is not None:
+            # near-duplicate facts are dropped and the rest capped at the packer's token budget
+            retrieved_facts, report = packer.pack(retrieved_facts)
+            print(f"Context: {report['packed_tokens']} tokens, {report['tokens_saved']} saved")
+        prompt = build_rag_prompt(query, retrieved_facts)
         print(prompt)
-        prompt = f"Context: {context}\nQuestion: {query}\nAnswer: "
 
 
     else:
         prompt = query
 
-    return handler.generate(prompt)
-
-
-def evaluate_rag(handler, index, metadata, qa_path, use_rag=True):
+    answer = handler.generate(prompt)
+    if answer_cache is not None:
+        answer_cache.put(query, answer, fact_ids)
+    return answer
+
+
+def evaluate_rag(handler, index, metadata, qa_path, use_rag=True, batch_size=8, top_k=10,
+                 limit=None, output_path="rag_eval_results.jsonl", window_size=256, fsync_every=32,
+                 graph_retriever=None, packer=None, answer_cache=None, sparse_index=None):
+    """
+    Results are appended to output_path (JSONL) as each generation batch finishes.
+    Rerunning with the same output_path skips questions that are already answered.
+    With a graph_retriever, questions it answers by KG traversal never reach the handler,
+    and ambiguous ones get their candidate paths as context instead of retrieved facts.
+    With a packer, retrieved facts are deduplicated and packed into its token budget.
+    With an answer_cache, repeated or paraphrased questions are answered from it and
+    new answers are added to it together with the ids of their retrieved facts; a paraphrase
+    only hits when it retrieves the same top facts as the cached question.
+    With a sparse_index, retrieval fuses BM25 and dense rankings (see retrieve_facts_batch).
+    """
     with open(qa_path, "r", encoding="utf-8") as f:
         qa_pairs = json.load(f)
 
-    print(qa_pairs)
-    print(qa_pairs[0])
-    #qa_pairs = qa_pairs[0]
-    qa_pairs = qa_pairs[:30]
-
-
-    results = []
-
-    for entry in qa_pairs:
-        question = entry["question"]
-        ground_truth = entry["answer"]
-
-        print(f"\n---\nQuestion: {question}")
-        response = rag_generate(handler, question, index, metadata, use_rag=use_rag)
-        print(f"Ground Truth: {ground_truth}")
-        print(f"Model Answer: {response}")
-
-        results.append({
-            "question": question,
-            "ground_truth": ground_truth,
-            "predicted": response
-        })
-
-        
-    with open("rag_eval_results.json", "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    if limit is not None:
+        qa_pairs = qa_pairs[:limit]
+
+    ids = qa_ids(qa_pairs)
+    done = load_done_ids(output_path)
+    pending = [(qid, entry) for qid, entry in zip(ids, qa_pairs) if qid not in done]
+    print(f"Evaluating {len(pending)} QA pairs ({len(qa_pairs) - len(pending)} already done, batch size {batch_size})")
+
+    start_time = time.time()
+    with JsonlResultWriter(output_path, fsync_every=fsync_every) as writer:
+        # work in windows so memory stays bounded and length bucketing still has room to sort
+        for w in range(0, len(pending), window_size):
+            window = pending[w:w + window_size]
+            resolved = [None] * len(window)
+            if graph_retriever is not None:
+                resolved = [graph_retriever.resolve(entry["question"]) for _, entry in window]
+                for (qid, entry), result in zip(window, resolved):
+                    if result is not None and result["answer"] is not None:
+                        writer.write({
+                            "id": qid,
+                            "question": entry["question"],
+                            "ground_truth": entry["answer"],
+                            "predicted": result["answer"],
+                            "source": "graph"
+                        })
+
+            # only questions the graph could not answer are sent to the LLM
+            window = [(item, result) for item, result in zip(window, resolved)
+                      if result is None or result["answer"] is None]
+
+            questions = [entry["question"] for (_, entry), _ in window]
+            fact_ids = [()] * len(window)
+            contexts = [None] * len(window)
+            if use_rag:
+                contexts = [result["context"] if result is not None else None for _, result in window]
+                retrieval = [i for i, context in enumerate(contexts) if context is None]
+                if retrieval:
+                    retrieved, retrieved_ids = retrieve_facts_batch([questions[i] for i in retrieval], index, metadata,
+                                                                    top_k=top_k, with_ids=True,
+                                                                    sparse_index=sparse_index)
+                    for i, facts, row in zip(retrieval, retrieved, retrieved_ids):
+                        contexts[i], fact_ids[i] = facts, row
+
+            if answer_cache is not None:
+                # retrieval runs first: a paraphrase only hits when it retrieved the same facts
+                cached = answer_cache.lookup_batch(questions, fact_ids)
+                for ((qid, entry), _), answer in zip(window, cached):
+                    if answer is not None:
+                        writer.write({
+                            "id": qid,
+                            "question": entry["question"],
+                            "ground_truth": entry["answer"],
+                            "predicted": answer,
+                            "source": "cache"
+                        })
+                keep = [i for i, answer in enumerate(cached) if answer is None]
+                window, questions = [window[i] for i in keep], [questions[i] for i in keep]
+                fact_ids, contexts = [fact_ids[i] for i in keep], [contexts[i] for i in keep]
+
+            if use_rag:
+                if packer is not None:
+                    retrieval = [i for i, row in enumerate(fact_ids) if len(row)]
+                    for i, facts in zip(retrieval, packer.pack_batch([contexts[i] for i in retrieval])):
+                        contexts[i] = facts
+                prompts = [build_rag_prompt(q, context) for q, context in zip(questions, contexts)]
+            else:
+                prompts = questions
+
+            answers = [None] * len(window)
+            for i, response in handler.iter_generate(prompts, batch_size=batch_size):
+                (qid, entry), _ = window[i]
+                answers[i] = response
+                writer.write({
+                    "id": qid,
+                    "question": entry["question"],
+                    "ground_truth": entry["answer"],
+                    "predicted": response
+                })
+            if answer_cache is not None and window:
+                answer_cache.put_batch(questions, answers, fact_ids)
+
+    elapsed = time.time() - start_time
+    print(f"Generated {len(pending)} answers in {elapsed:.2f} seconds, results in {output_path}")
+    if graph_retriever is not None:
+        print(f"Graph retrieval: {graph_retriever.stats}")
+    if packer is not None:
+        print(f"Context packing: {packer.report()}")
+    if answer_cache is not None:
+        print(f"Answer cache: {answer_cache.report()}")
 
 
 if __name__ == "__main__":
 
     handler = Mistral7BHandler()
+    # every RAG prompt starts with the same instruction, its KV state is computed once
+    handler.cache_prefix(template_prefix(RAG_PROMPT_TEMPLATE))
 
     index = load_index("../data/leaders_index.faiss")
     metadata = load_metadata("../data/leaders_metadata.json")
+    # BM25 hits are fused with the dense ones, so exact entity names are not missed
+    sparse_index = load_sparse_index("../data/leaders_index.faiss", index)
 
     qa_path = r"../data/qa_eval_data.json"
 
-    evaluate_rag(handler, index, metadata, qa_path)
+    # multi-hop questions are answered by KG traversal first, only the rest go to the LLM
+    store = KGStore.from_files(["../data/qa_labeled.json", "../data/combined_qa_dataset.json"])
+    graph_retriever = GraphRetriever.from_config(store, "../improved_kg_vectorstore/config.json")
+
+    # bounded prefill: at most 256 context tokens per prompt, near-duplicate facts dropped
+    packer = ContextPacker(handler.tokenizer, budget_tokens=256)
+
+    # repeated and paraphrased questions skip retrieval and generation
+    answer_cache = SemanticAnswerCache(metadata, threshold=0.95, ttl=24 * 3600)
+
+    evaluate_rag(handler, index, metadata, qa_path, batch_size=8, graph_retriever=graph_retriever, packer=packer,
+                 answer_cache=answer_cache, sparse_index=sparse_index)
 
     #prompt = "Who is the Leader of Slovenia?"
     #print("Prompt: \n", prompt)
@@ -0,0 +1,112 @@
+import re
+import numpy as np
+from embedding_cache import cached_encode
+
+STOPWORDS = {'the', 'is', 'at', 'of', 'on', 'a', 'an', 'in', 'to', 'for', 'with', 'by', 'as', 'and', 'or',
+             'who', 'what', 'where', 'when', 'how'}
+URI_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+MULTI_HOP_PATTERNS = ["of the", "who is the", "where was the", "when did the", "birthplace of the",
+                      "spouse of the", "married to the"]
+# (question phrase, boost) pairs checked against the question a document was built from; first match wins
+QUESTION_TYPE_BOOSTS = [("head of state", 0.3), ("birthplace", 0.3), ("spouse", 0.3)]
+
+
+def extract_keywords(text):
+    """
+    Lowercased, punctuation-free words of the text minus stopwords, plus any URIs
+    """
+    if not text:
+        return []
+    text = re.sub(r'[^\w\s]', '', text.lower())
+    keywords = [word for word in text.split() if word not in STOPWORDS and len(word) > 2]
+    keywords.extend(URI_PATTERN.findall(text))
+    return keywords
+
+
+def is_multi_hop_question(question):
+    question = question.lower()
+    return any(pattern in question for pattern in MULTI_HOP_PATTERNS)
+
+
+class BatchedReranker:
+    """
+    Reranks retrieved LangChain documents by cosine similarity to the question plus metadata boosts.
+    All candidates are embedded in one (cached) encode call, or taken from doc_embeddings
+    (e.g. vectors reconstructed from the FAISS index), and scored with one matrix product.
+    """
+
+    def __init__(self, model_name="all-MiniLM-L6-v2"):
+        self.model_name = model_name
+
+    def exact_matches(self, question, documents):
+        return [doc for doc in documents
+                if question in doc.page_content or doc.metadata.get("question", "") == question]
+
+    def metadata_boosts(self, question, documents):
+        # everything that depends only on the question is computed once, not per document
+        question_lower = question.lower()
+        keywords = [k.lower() for k in set(extract_keywords(question))]
+        type_boost = [(phrase, boost) for phrase, boost in QUESTION_TYPE_BOOSTS if phrase in question_lower]
+        multi_hop = is_multi_hop_question(question)
+
+        boosts = np.zeros(len(documents))
+        for i, doc in enumerate(documents):
+            meta = doc.metadata
+            score = 0.0
+
+            # document answers a similar question (only the first matching question type counts)
+            doc_question = meta.get("question", "").lower()
+            if doc_question:
+                for phrase, boost in type_boost:
+                    if phrase in doc_question:
+                        score += boost
+                        break
+
+            entity_name = meta.get("entity_name", "").lower()
+            if entity_name and any(k in entity_name for k in keywords):
+                score += 0.25
+
+            country = meta.get("country", "")
+            if country and country.lower() in question_lower:
+                score += 0.25
+
+            relation = meta.get("relation")
+            if relation and relation.lower() in question_lower:
+                score += 0.25
+
+            answer = meta.get("answer")
+            if answer and answer.lower() in doc.page_content.lower():
+                score += 0.2
+
+            if multi_hop and meta.get("multi_hop", False):
+                score += 0.3
+
+            boosts[i] = score
+        return boosts
+
+    def scores(self, question, documents, doc_embeddings=None):
+        if doc_embeddings is None:
+            vectors = cached_encode([question] + [doc.page_content for doc in documents], self.model_name)
+            question_vector, doc_embeddings = vectors[0], vectors[1:]
+        else:
+            question_vector = cached_encode([question], self.model_name)[0]
+            doc_embeddings = np.asarray(doc_embeddings, dtype=np.float32)
+
+        question_vector = question_vector / max(np.linalg.norm(question_vector), 1e-12)
+        norms = np.maximum(np.linalg.norm(doc_embeddings, axis=1), 1e-12)
+        similarity = (doc_embeddings @ question_vector) / norms
+        return similarity + self.metadata_boosts(question, documents)
+
+    def rerank(self, question, documents, doc_embeddings=None):
+        if not documents:
+            return []
+
+        exact = self.exact_matches(question, documents)
+        if exact:
+            exact_ids = {id(doc) for doc in exact}
+            return exact + [doc for doc in documents if id(doc) not in exact_ids]
+
+        scores = self.scores(question, documents, doc_embeddings)
+        # stable sort keeps retrieval order between equal scores
+        order = np.argsort(-scores, kind="stable")
+        return [documents[i] for i in order]
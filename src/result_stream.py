@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+
+
+def qa_ids(qa_pairs):
+    """
+    Stable IDs for QA items: the item's own "id" if present, otherwise a hash of
+    question + answer. Repeated identical items get an occurrence suffix.
+    """
+    ids = []
+    seen = {}
+    for entry in qa_pairs:
+        if "id" in entry:
+            ids.append(str(entry["id"]))
+            continue
+        key = f"{entry['question']}\x1f{entry.get('answer', '')}"
+        base = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        ids.append(base if n == 0 else f"{base}-{n}")
+    return ids
+
+
+def iter_results(path):
+    """
+    Yield records from a JSONL file one at a time. A truncated last line
+    (left by a crash mid-write) is skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def load_done_ids(path):
+    return {record["id"] for record in iter_results(path) if "id" in record}
+
+
+class JsonlResultWriter:
+    """
+    Append-only JSONL writer. Every record is flushed, and the file is fsynced
+    every `fsync_every` records and on close.
+    """
+
+    def __init__(self, path, fsync_every=32):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._pending = 0
+        self._file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        # a previous crash may have left a partial line without a newline
+        if self._file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
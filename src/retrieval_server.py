@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from prompt_llm import embed_queries, load_index, load_metadata
+from sharded_index import ShardedIndex, fact_matches
+
+logger = logging.getLogger(__name__)
+
+MAX_TOP_K = 100
+MAX_BODY_BYTES = 1 << 20
+
+
+async def read_request(reader):
+    """
+    (method, path, headers, body) of the next request on the connection, or None once the
+    client has closed it; body is None when it exceeds MAX_BODY_BYTES
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        return method, path.split("?", 1)[0], headers, None
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?", 1)[0], headers, body
+
+
+def response_head(status, keep_alive, content_type="application/json", extra=""):
+    return (f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: {content_type}\r\n{extra}"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1")
+
+
+async def write_json(writer, status, payload, keep_alive):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(response_head(status, keep_alive, extra=f"Content-Length: {len(data)}\r\n") + data)
+    await writer.drain()
+
+
+def parse_search_request(body):
+    """
+    (queries, top_k, filters) of a /search body; raises ValueError for anything that would
+    fail inside the shared search batch instead of in this request alone
+    """
+    if not isinstance(body, dict):
+        raise ValueError("body must be a JSON object")
+    if "queries" in body:
+        queries = body["queries"]
+        if not isinstance(queries, list):
+            raise ValueError("queries must be a list of strings")
+    elif "query" in body:
+        queries = [body["query"]]
+    else:
+        raise ValueError("query or queries is required")
+    if not all(isinstance(q, str) for q in queries):
+        raise ValueError("query and queries items must be strings")
+
+    top_k = body.get("top_k", 10)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K:
+        raise ValueError(f"top_k must be an integer from 1 to {MAX_TOP_K}")
+    filters = body.get("filters") or {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    return queries, top_k, filters
+
+
+class RetrievalService:
+    """
+    Index, metadata and embedder loaded once; search_batch answers many requests
+    with one encode call and one index.search.
+    """
+
+    def __init__(self, index, metadata, model_name="all-MiniLM-L6-v2", filter_oversample=4):
+        self.index = index
+        self.metadata = metadata
+        self.model_name = model_name
+        self.filter_oversample = filter_oversample
+
+    def search_batch(self, batch):
+        """
+        batch is a list of (query, top_k, filters); returns one list of
+        {"score", **fact} per request
+        """
+        if self.index.ntotal == 0:
+            return [[] for _ in batch]
+        embeddings = embed_queries([query for query, _, _ in batch], self.model_name)
+
+        if isinstance(self.index, ShardedIndex):
+            # filters are pushed into the sharded index; requests with equal filters share one search
+            groups = {}
+            for i, (_, _, filters) in enumerate(batch):
+                groups.setdefault(json.dumps(filters, sort_keys=True), []).append(i)
+            rows = [None] * len(batch)
+            for key, members in groups.items():
+                filters = json.loads(key)
+                k = max(batch[i][1] for i in members)
+                if self.index.unindexed_filters(filters):
+                    k *= self.filter_oversample  # checked by fact_matches below
+                scores, indices = self.index.search(embeddings[members], min(k, self.index.ntotal), filters=filters)
+                for i, row_scores, row in zip(members, scores, indices):
+                    rows[i] = (row_scores, row)
+        else:
+            # filtered requests over-fetch so enough hits survive the filter
+            k = max(top_k * (self.filter_oversample if filters else 1) for _, top_k, filters in batch)
+            scores, indices = self.index.search(embeddings, min(k, self.index.ntotal))
+            rows = list(zip(scores, indices))
+
+        results = []
+        for (_, top_k, filters), (row_scores, row) in zip(batch, rows):
+            hits = []
+            for score, i in zip(row_scores, row):
+                if i == -1:
+                    continue
+                fact = self.metadata[int(i)]
+                if filters and not fact_matches(fact, filters):
+                    continue
+                hits.append({"score": float(score), **fact})
+                if len(hits) == top_k:
+                    break
+            results.append(hits)
+        return results
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for up to max_wait_ms (or max_batch requests) and runs them
+    as one batch on a worker thread, so the event loop keeps accepting connections meanwhile.
+    """
+
+    def __init__(self, search_batch, max_batch=64, max_wait_ms=5.0, latency_window=10000):
+        self.search_batch = search_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = deque(maxlen=latency_window)
+        self.batch_sizes = deque(maxlen=latency_window)
+        self.stats = {"requests": 0, "batches": 0, "max_queue_depth": 0}
+        self._worker = None
+
+    def start(self):
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, query, top_k=10, filters=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((query, top_k, filters or {}), future, time.perf_counter()))
+        self.stats["requests"] += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue.qsize())
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.search_batch, [req for req, _, _ in batch])
+            except Exception:
+                logger.exception(f"Search batch of {len(batch)} failed, retrying its requests one by one")
+                await self._run_singly(batch)
+                continue
+
+            now = time.perf_counter()
+            self.stats["batches"] += 1
+            self.batch_sizes.append(len(batch))
+            for (_, future, started), result in zip(batch, results):
+                self.latencies.append(now - started)
+                if not future.done():
+                    future.set_result(result)
+
+    async def _run_singly(self, batch):
+        # a failed batch is split so only the request that breaks the search fails
+        loop = asyncio.get_running_loop()
+        for request, future, started in batch:
+            try:
+                result = (await loop.run_in_executor(self.executor, self.search_batch, [request]))[0]
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self.stats["batches"] += 1
+            self.batch_sizes.append(1)
+            self.latencies.append(time.perf_counter() - started)
+            if not future.done():
+                future.set_result(result)
+
+    def report(self):
+        latencies = np.array(self.latencies) * 1000
+        report = {**self.stats, "queue_depth": self.queue.qsize(),
+                  "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0}
+        for p in (50, 90, 99):
+            report[f"latency_p{p}_ms"] = float(np.percentile(latencies, p)) if len(latencies) else 0.0
+        return report
+
+
+class RetrievalServer:
+    """
+    Minimal asyncio HTTP/1.1 server with keep-alive:
+      POST /search  {"query": ..., "top_k": 10, "filters": {"country": "Latvia"}} -> {"results": [...]}
+                    (filters: category, country, entity or any other fact field)
+                    {"queries": [...], ...} -> {"results": [[...], ...]}
+      GET  /stats   batching and latency report
+    """
+
+    def __init__(self, service, host="127.0.0.1", port=8765, max_batch=64, max_wait_ms=5.0):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.batcher = MicroBatcher(service.search_batch, max_batch=max_batch, max_wait_ms=max_wait_ms)
+        self.server = None
+
+    async def start(self):
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Retrieval server listening on http://{self.host}:{self.port}")
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _search(self, body):
+        queries, top_k, filters = parse_search_request(body)
+        if "queries" in body:
+            results = await asyncio.gather(*(self.batcher.submit(q, top_k, filters) for q in queries))
+            return {"results": list(results)}
+        return {"results": await self.batcher.submit(queries[0], top_k, filters)}
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/stats":
+            return 200, self.batcher.report()
+        if method == "POST" and path == "/search":
+            try:
+                payload = json.loads(body or b"{}")
+                return 200, await self._search(payload)
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, {"error": f"bad request: {e}"}
+            except Exception as e:
+                return 500, {"error": f"search failed: {e}"}
+        return 404, {"error": "not found"}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if body is None:
+                    status, payload = 413, {"error": "request body too large"}
+                else:
+                    status, payload = await self._route(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close" and body is not None
+                await write_json(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+class RetrievalClient:
+    """
+    Client for evaluation workers sharing one warm server; mirrors retrieve_facts_batch
+    """
+
+    def __init__(self, url="http://127.0.0.1:8765", timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def search(self, query, top_k=10, filters=None):
+        response = self.session.post(f"{self.url}/search", json={"query": query, "top_k": top_k, "filters": filters},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["results"]
+
+    def retrieve_facts_batch(self, queries, top_k=10, filters=None):
+        response = self.session.post(f"{self.url}/search",
+                                     json={"queries": queries, "top_k": top_k, "filters": filters},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["results"]
+
+    def stats(self):
+        return self.session.get(f"{self.url}/stats", timeout=self.timeout).json()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default="../data/leaders_index.faiss")
+    parser.add_argument("--metadata", default="../data/leaders_metadata.json")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = RetrievalService(load_index(args.index, nprobe=args.nprobe, ef_search=args.ef_search),
+                               load_metadata(args.metadata), model_name=args.model)
+    # encode once so the first request does not pay for loading the embedder
+    embed_queries(["warmup"], args.model)
+    server = RetrievalServer(service, args.host, args.port, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,204 @@
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+
+MANIFEST = "manifest.json"
+ENTITY_FIELDS = ("name", "leader")  # the "entity" filter matches whichever of these a fact has
+FILTER_FIELDS = ("category", "country", "entity")
+NO_VALUE = "_none"
+MIN_TRAINED_SHARD = 2000  # smaller shards are searched exactly, IVF training needs enough points
+
+
+def fact_value(fact, field):
+    if field == "entity":
+        return next((fact[f] for f in ENTITY_FIELDS if f in fact), None)
+    return fact.get(field)
+
+
+def fact_matches(fact, filters):
+    # a filter value may be a single value or a list of accepted values
+    for field, accepted in filters.items():
+        value = fact_value(fact, field)
+        if isinstance(accepted, list) and value not in accepted:
+            return False
+        if not isinstance(accepted, list) and value != accepted:
+            return False
+    return True
+
+
+def shard_file(value):
+    return re.sub(r"[^\w.-]+", "_", str(value)) + ".faiss"
+
+
+def selector_params(index, selector):
+    """
+    Search parameters restricting index to the selected ids, keeping its nprobe / efSearch
+    (search parameters replace the index's own settings instead of extending them)
+    """
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+class ShardedIndex:
+    """
+    Fact index split into one ID-mapped FAISS index per value of shard_field (e.g. category),
+    all addressed by the global fact ids of one metadata list.
+
+    search(x, k, filters) has the FAISS search signature plus filters such as
+    {"category": "Company"} or {"country": ["Latvia", "Estonia"]}. A filter on the shard
+    field only touches the matching shards; filters on other fields (category, country,
+    entity) become ID selectors from postings stored at build time, so non-matching facts
+    are never scored. Filters on fields without postings (see unindexed_filters) are left
+    to the caller, which over-fetches and checks them with fact_matches. Without filters
+    every shard is searched and the hits merged.
+    """
+
+    def __init__(self, shards, shard_field, shard_ids, postings):
+        self.shards = shards
+        self.shard_field = shard_field
+        self.shard_ids = shard_ids
+        self.postings = postings
+        self.ntotal = sum(index.ntotal for index in shards.values())
+        self.d = next(iter(shards.values())).d if shards else 0
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        shards, shard_ids = {}, {}
+        for value, shard in manifest["shards"].items():
+            shards[value] = faiss.read_index(os.path.join(directory, shard["file"]))
+            shard_ids[value] = np.asarray(shard["ids"], dtype=np.int64)
+        postings = {field: {value: np.asarray(ids, dtype=np.int64) for value, ids in values.items()}
+                    for field, values in manifest["postings"].items()}
+        return cls(shards, manifest["shard_field"], shard_ids, postings)
+
+    def shards_for(self, filters):
+        accepted = filters.get(self.shard_field)
+        if accepted is None:
+            return list(self.shards)
+        accepted = accepted if isinstance(accepted, list) else [accepted]
+        return [str(value) for value in accepted if str(value) in self.shards]
+
+    def unindexed_filters(self, filters):
+        """
+        Filters on fields that are neither the shard field nor have postings; search ignores them
+        """
+        return {field: accepted for field, accepted in filters.items()
+                if field != self.shard_field and field not in self.postings}
+
+    def allowed_ids(self, filters):
+        """
+        Sorted ids passing every filter on a field with postings, or None when there is none
+        """
+        allowed = None
+        for field, accepted in filters.items():
+            if field not in self.postings or field == self.shard_field:
+                continue
+            values = self.postings[field]
+            accepted = accepted if isinstance(accepted, list) else [accepted]
+            ids = [values[str(v)] for v in accepted if str(v) in values]
+            ids = np.unique(np.concatenate(ids)) if ids else np.zeros(0, dtype=np.int64)
+            allowed = ids if allowed is None else np.intersect1d(allowed, ids, assume_unique=True)
+        return allowed
+
+    def search(self, x, k, filters=None):
+        filters = filters or {}
+        allowed = self.allowed_ids(filters)
+        scores = np.full((len(x), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(x), k), -1, dtype=np.int64)
+
+        for value in self.shards_for(filters):
+            index = self.shards[value]
+            params = None
+            if allowed is not None:
+                selected = np.intersect1d(self.shard_ids[value], allowed, assume_unique=True)
+                if len(selected) == 0:
+                    continue
+                params = selector_params(index, faiss.IDSelectorBatch(selected))
+            shard_scores, shard_ids = index.search(x, k, params=params)
+            # merge with the hits so far, keeping the k best per query
+            scores = np.concatenate([scores, shard_scores], axis=1)
+            ids = np.concatenate([ids, shard_ids], axis=1)
+            scores[ids == -1] = -np.inf
+            top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+            scores = np.take_along_axis(scores, top, axis=1)
+            ids = np.take_along_axis(ids, top, axis=1)
+        return scores, ids
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        params = faiss.ParameterSpace()
+        for index in self.shards.values():
+            for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+                if value is None:
+                    continue
+                try:
+                    params.set_index_parameter(index, name, value)
+                except RuntimeError:
+                    pass
+
+
+def build_sharded_index(facts, directory, shard_field="category", backend="flat", workers=None,
+                        model_name="all-MiniLM-L6-v2"):
+    """
+    Embed all facts in one batched pass, then train and fill the per-shard indexes in parallel
+    threads (FAISS releases the GIL). Writes the shards, a manifest and the combined metadata
+    (fact id = position) into directory.
+    """
+    from build_db import embed_facts, make_index, save_metadata
+
+    os.makedirs(directory, exist_ok=True)
+    embeddings = np.ascontiguousarray(embed_facts(facts, model_name), dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+
+    groups = {}
+    for i, fact in enumerate(facts):
+        value = fact_value(fact, shard_field)
+        groups.setdefault(NO_VALUE if value is None else str(value), []).append(i)
+
+    def build_shard(item):
+        # OpenMP settings are per thread: one thread per shard build, the shards run side by side
+        faiss.omp_set_num_threads(1)
+        value, members = item
+        ids = np.asarray(members, dtype=np.int64)
+        vectors = embeddings[ids]
+        shard_backend = backend if len(ids) >= MIN_TRAINED_SHARD else "flat"
+        index = faiss.IndexIDMap2(make_index(vectors.shape[1], shard_backend, n_train=len(ids)))
+        if not index.is_trained:
+            index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        faiss.write_index(index, os.path.join(directory, shard_file(value)))
+        return value, len(ids)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        sizes = dict(pool.map(build_shard, groups.items()))
+
+    postings = {}
+    for field in FILTER_FIELDS:
+        values = {}
+        for i, fact in enumerate(facts):
+            value = fact_value(fact, field)
+            if value is not None:
+                values.setdefault(str(value), []).append(i)
+        if values:
+            postings[field] = values
+
+    save_metadata(facts, os.path.join(directory, "metadata.json"))
+    manifest = {
+        "shard_field": shard_field,
+        "backend": backend,
+        "model": model_name,
+        "shards": {value: {"file": shard_file(value), "ids": groups[value]} for value in groups},
+        "postings": postings,
+    }
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    print(f"Built {len(groups)} shards by {shard_field}: {sizes}")
+    return ShardedIndex.load(directory)
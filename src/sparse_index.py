@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from array import array
+from collections import Counter
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# function words carry no entity signal but have the longest postings lists
+STOPWORDS = {'the', 'is', 'at', 'of', 'on', 'a', 'an', 'in', 'to', 'for', 'with', 'by', 'as', 'and', 'or',
+             'who', 'what', 'where', 'when', 'how', 'was', 'did', 'does', 'has', 'are'}
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFC", text).casefold()
+    return [t for t in TOKEN_PATTERN.findall(text) if t not in STOPWORDS]
+
+
+def sparse_index_path(index_path):
+    """
+    Where build_db stores the BM25 index of a FAISS index file
+    """
+    return re.sub(r"\.faiss$", "", index_path) + ".bm25"
+
+
+def ids_fingerprint(ids):
+    """
+    Hash of a set of fact ids, stored with the BM25 index to detect that the FAISS index it
+    was built for has been rebuilt over other facts
+    """
+    return hashlib.sha1(np.sort(np.asarray(ids, dtype=np.int64)).tobytes()).hexdigest()
+
+
+def remove_sparse_index(path):
+    for suffix in (".npz", ".json"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Ids of several rankings (best first) ordered by sum of 1 / (k + rank); ties keep first-seen order
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over fact texts, addressed by the same ids as the FAISS index.
+
+    Postings are CSR arrays per term: document positions (int32) and the precomputed BM25
+    weight of the term in that document (float32), so a query is a gather over its terms'
+    postings plus one bincount, with no per-document Python work.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms = []
+        self._term_index = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.docs = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def build(cls, texts, doc_ids=None, k1=1.2, b=0.75):
+        """
+        BM25 index over texts, which may be any iterable (e.g. a generator streaming a fact
+        file); postings are collected in typed arrays, not per-posting Python objects
+        """
+        index = cls(k1, b)
+        term_index = {}
+        post_terms, post_docs, post_tf = array("q"), array("i"), array("f")
+        doc_len = array("f")
+        for d, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                post_terms.append(term_index.setdefault(term, len(term_index)))
+                post_docs.append(d)
+                post_tf.append(tf)
+
+        post_terms = np.frombuffer(post_terms, dtype=np.int64)
+        post_docs = np.frombuffer(post_docs, dtype=np.int32)
+        post_tf = np.frombuffer(post_tf, dtype=np.float32)
+        doc_len = np.frombuffer(doc_len, dtype=np.float32)
+        order = np.argsort(post_terms, kind="stable")  # docs stay sorted within each term
+        post_terms, post_docs, post_tf = post_terms[order], post_docs[order], post_tf[order]
+
+        df = np.bincount(post_terms, minlength=len(term_index))
+        n_docs = len(doc_len)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_len = float(doc_len.mean()) if n_docs else 0.0
+        norm = k1 * (1 - b + b * doc_len[post_docs] / max(avg_len, 1e-9))
+
+        index.terms = list(term_index)
+        index._term_index = term_index
+        index.indptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        index.docs = post_docs
+        index.weights = (idf[post_terms] * post_tf * (k1 + 1) / (post_tf + norm)).astype(np.float32)
+        index.doc_ids = np.arange(n_docs, dtype=np.int64) if doc_ids is None else np.asarray(doc_ids, dtype=np.int64)
+        return index
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def search(self, query, top_k=10):
+        """
+        (ids, scores) of the top_k facts for query, best first
+        """
+        term_ids = {self._term_index[t] for t in tokenize(query) if t in self._term_index}
+        if not term_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        docs = np.concatenate([self.docs[self.indptr[t]:self.indptr[t + 1]] for t in term_ids])
+        weights = np.concatenate([self.weights[self.indptr[t]:self.indptr[t + 1]] for t in term_ids])
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        if len(scores) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return self.doc_ids[candidates[top]], scores[top].astype(np.float32)
+
+    def search_batch(self, queries, top_k=10):
+        return [self.search(query, top_k) for query in queries]
+
+    def save(self, path):
+        """
+        Save as path + ".npz" (postings) and path + ".json" (terms and parameters)
+        """
+        np.savez(path + ".npz", indptr=self.indptr, docs=self.docs, weights=self.weights, doc_ids=self.doc_ids)
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "n_docs": len(self.doc_ids),
+                       "ids": ids_fingerprint(self.doc_ids), "terms": self.terms}, f, ensure_ascii=False)
+
+    @staticmethod
+    def built_for(path, ids):
+        """
+        Whether the index saved at path covers exactly the given fact ids (files from before
+        the fingerprint was stored never match)
+        """
+        if not os.path.exists(path + ".json") or not os.path.exists(path + ".npz"):
+            return False
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            tables = json.load(f)
+        return tables.get("n_docs") == len(ids) and tables.get("ids") == ids_fingerprint(ids)
+
+    @classmethod
+    def load(cls, path):
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            tables = json.load(f)
+        index = cls(tables["k1"], tables["b"])
+        index.terms = tables["terms"]
+        index._term_index = {term: i for i, term in enumerate(index.terms)}
+        arrays = np.load(path + ".npz")
+        for name in arrays.files:
+            setattr(index, name, arrays[name])
+        return index
@@ -0,0 +1,210 @@
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+logger = logging.getLogger(__name__)
+
+WIKIDATA_SPARQL = "https://query.wikidata.org/sparql"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "sparql_cache")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` requests per second on average, bursts up to `burst`.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of raw responses, one JSON file per sha256(endpoint + query)
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, endpoint, query):
+        return hashlib.sha256(f"{endpoint}\n{query}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put(self, key, response):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(response, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def retry_after_seconds(header):
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date
+    """
+    if not header:
+        return None
+    try:
+        return max(0.0, float(header))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(header)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SparqlClient:
+    """
+    SPARQL client shared by the fact harvesting scripts: every query goes through the
+    response cache, then the rate limiter, and is retried with backoff on 429/5xx.
+    """
+
+    def __init__(self, endpoint=WIKIDATA_SPARQL, user_agent="KnowledgeGraphLLMProject/1.0",
+                 cache_dir=DEFAULT_CACHE_DIR, rate=5.0, burst=5, max_retries=5, backoff=1.0, timeout=30):
+        self.endpoint = endpoint
+        self.headers = {"User-Agent": user_agent, "Accept": "application/sparql-results+json"}
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.stats = {"requests": 0, "cache_hits": 0, "retries": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def query(self, query):
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.endpoint, query)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._count("cache_hits")
+                return cached
+
+        result = self.get_json({"query": query, "format": "json"})
+        if self.cache is not None:
+            self.cache.put(key, result)
+        return result
+
+    def get_json(self, params):
+        """
+        Rate-limited, retried GET of the endpoint with the given parameters, without the response
+        cache; also usable for other Wikidata JSON endpoints such as the action API
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self._count("requests")
+            try:
+                response = self.session.get(self.endpoint, params=params, headers=self.headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise
+                wait = None
+                logger.warning(f"Request to {self.endpoint} failed ({e}), retrying")
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                wait = retry_after_seconds(response.headers.get("Retry-After"))
+                logger.warning(f"{self.endpoint} answered {response.status_code}, retrying")
+
+            if wait is None:
+                # exponential backoff with jitter so parallel workers do not retry in lockstep
+                wait = self.backoff * (2 ** attempt) * (0.5 + random.random())
+            self._count("retries")
+            time.sleep(wait)
+
+
+def harvest(items, fetch, max_workers=5):
+    """
+    Run fetch(item) for every item on a thread pool and return the results in input order.
+    Items whose fetch fails get None and are logged, so one bad entity does not stop the run.
+    """
+    def safe_fetch(item):
+        try:
+            return fetch(item)
+        except Exception as e:
+            logger.error(f"Fetching {item} failed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(safe_fetch, items))
+
+
+def batch_facts_query(qids):
+    values = " ".join(f"wd:{qid}" for qid in qids)
+    return f"""
+    SELECT ?item ?propertyLabel ?valueLabel WHERE {{
+      VALUES ?item {{ {values} }}
+      ?item ?prop ?value .
+      ?property wikibase:directClaim ?prop .
+      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+    }}
+    """
+
+
+def get_facts_batch(qids, run_query, chunk_size=50, max_workers=5):
+    """
+    Fetch the direct-claim facts of many entities with one VALUES query per chunk of QIDs.
+    Returns {qid: [{"propertyLabel": ..., "valueLabel": ...}, ...]} in the same shape the
+    single-entity get_*_facts functions return; QIDs from a failed chunk map to None.
+    """
+    qids = list(dict.fromkeys(qids))
+    chunks = [qids[i:i + chunk_size] for i in range(0, len(qids), chunk_size)]
+    results = harvest(chunks, lambda chunk: run_query(batch_facts_query(chunk)), max_workers=max_workers)
+
+    facts = {qid: [] for qid in qids}
+    for chunk, result in zip(chunks, results):
+        if result is None:
+            for qid in chunk:
+                facts[qid] = None
+            continue
+        # demultiplex the bindings back to the entity they belong to
+        for item in result['results']['bindings']:
+            qid = item.get('item', {}).get('value', '').split('/')[-1]
+            prop = item.get('propertyLabel', {}).get('value')
+            val = item.get('valueLabel', {}).get('value')
+            if prop and val and facts.get(qid) is not None:
+                facts[qid].append({"propertyLabel": prop, "valueLabel": val})
+    return facts
@@ -0,0 +1,54 @@
+import json
+import faiss
+import numpy as np
+import pytest
+import build_db
+from build_db import build_faiss_index, build_incremental_index, save_index
+
+
+def fake_encode(texts, model_name, show_progress_bar=False):
+    vectors = np.zeros((len(texts), 16), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in text.split():
+            vectors[i, sum(map(ord, word)) % 16] += 1
+    return vectors
+
+
+@pytest.fixture(autouse=True)
+def stub_embedder(monkeypatch):
+    monkeypatch.setattr(build_db, "cached_encode", fake_encode)
+
+
+def make_facts(n):
+    return [{"text": f"Fact number {i} about entity {i}"} for i in range(n)]
+
+
+def test_incremental_update_after_same_size_full_rebuild(tmp_path):
+    index_path, metadata_path = str(tmp_path / "index.faiss"), str(tmp_path / "metadata.json")
+    facts = make_facts(10)
+    build_incremental_index(facts, index_path, metadata_path)
+
+    # full rebuild of the same facts leaves a plain index next to the incremental state
+    save_index(build_faiss_index(build_db.embed_facts(facts)), index_path)
+
+    facts[3] = {"text": "An edited fact"}
+    index = build_incremental_index(facts, index_path, metadata_path)
+    assert hasattr(index, "id_map")
+    assert index.ntotal == 10
+
+    stored = faiss.read_index(index_path)
+    query = fake_encode(["An edited fact"], None)
+    faiss.normalize_L2(query)
+    _, ids = stored.search(query, 1)
+    metadata = {fact["id"]: fact for fact in json.load(open(metadata_path, encoding="utf-8"))}
+    assert metadata[int(ids[0, 0])]["text"] == "An edited fact"
+
+
+def test_incremental_update_removes_and_adds_by_id(tmp_path):
+    index_path, metadata_path = str(tmp_path / "index.faiss"), str(tmp_path / "metadata.json")
+    facts = make_facts(10)
+    build_incremental_index(facts, index_path, metadata_path)
+    index = build_incremental_index(facts[2:] + [{"text": "A new fact"}], index_path, metadata_path)
+    ids = set(faiss.vector_to_array(index.id_map).tolist())
+    assert index.ntotal == 9
+    assert ids == set(range(2, 11))
@@ -0,0 +1,103 @@
+import importlib.util
+import os
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+# src/finetune is its own import root (its prompt_llm.py would shadow src/prompt_llm.py on sys.path)
+_spec = importlib.util.spec_from_file_location(
+    "data_pipeline", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "finetune",
+                                  "data_pipeline.py"))
+data_pipeline = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(data_pipeline)
+
+EXAMPLES = [{"question": f"Who leads country {i}?", "answer": "Leader " + "x" * (i * 7 % 23)} for i in range(20)]
+
+
+@pytest.fixture
+def texts():
+    return [data_pipeline.format_example(example) for example in EXAMPLES]
+
+
+@pytest.fixture
+def tokenizer(tiny_lm):
+    tokenizer, _ = tiny_lm
+    tokenizer.pad_token = tokenizer.eos_token  # as in finetune_llm.py
+    return tokenizer
+
+
+def test_cache_key_and_load_or_tokenize(tmp_path, monkeypatch, texts, tokenizer):
+    key = data_pipeline.cache_key(tokenizer, texts, 64)
+    assert key == data_pipeline.cache_key(tokenizer, list(texts), 64)
+    assert key != data_pipeline.cache_key(tokenizer, texts[:-1] + [texts[-1] + "!"], 64)
+    assert key != data_pipeline.cache_key(tokenizer, texts, 128)
+    tokenizer.add_tokens(["<fact>"])
+    assert key != data_pipeline.cache_key(tokenizer, texts, 64)
+
+    first = data_pipeline.load_or_tokenize(texts, tokenizer, 64, str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+
+    def no_tokenizing(*args, **kwargs):
+        raise AssertionError("tokenized again instead of loading the cache")
+
+    monkeypatch.setattr(data_pipeline, "tokenize_texts", no_tokenizing)
+    second = data_pipeline.load_or_tokenize(texts, tokenizer, 64, str(tmp_path))
+    assert [second[i] for i in range(len(second))] == [first[i] for i in range(len(first))]
+    assert first[0]["input_ids"] == tokenizer(texts[0], truncation=True, max_length=64)["input_ids"]
+
+
+def test_padding_collator_masks_only_padding(texts, tokenizer):
+    dataset = data_pipeline.tokenize_texts(texts, tokenizer, 64)
+    # pad == eos, so a real eos inside an example must still be trained on
+    features = [dataset[0], dataset[5], {"input_ids": dataset[1]["input_ids"] + [tokenizer.eos_token_id]}]
+    batch = data_pipeline.PaddingCollator(tokenizer)(features)
+    assert batch["input_ids"].shape[1] % 8 == 0
+    assert batch["input_ids"].shape[1] >= max(len(f["input_ids"]) for f in features)
+    for row, f in enumerate(features):
+        n = len(f["input_ids"])
+        assert batch["attention_mask"][row].tolist() == [1] * n + [0] * (batch["input_ids"].shape[1] - n)
+        assert batch["labels"][row, :n].tolist() == f["input_ids"]
+        assert (batch["labels"][row, n:] == -100).all()
+
+
+def test_packed_dataset_and_collator(texts, tokenizer):
+    dataset = data_pipeline.tokenize_texts(texts, tokenizer, 128)
+    packed = data_pipeline.PackedDataset(dataset, max_length=256)
+    assert len(packed) < len(dataset)
+    assert all(int(length) <= 256 for length in packed.lengths)
+    assert sorted(i for row in packed.rows for i in row) == list(range(len(dataset)))
+
+    rows = [packed[r] for r in range(len(packed))]
+    assert all(len(row["input_ids"]) <= 256 for row in rows)
+    batch = data_pipeline.PackedCollator()(rows[:2])
+    input_ids, position_ids, labels = (batch[k][0].tolist() for k in ("input_ids", "position_ids", "labels"))
+
+    start = 0
+    for row in rows[:2]:
+        for n in row["seq_lengths"]:
+            assert position_ids[start:start + n] == list(range(n))
+            assert labels[start] == -100
+            assert labels[start + 1:start + n] == input_ids[start + 1:start + n]
+            start += n
+    assert start == len(input_ids)
+
+
+@pytest.mark.parametrize("pack", [False, True])
+def test_one_training_step(tmp_path, texts, tiny_lm, tokenizer, pack):
+    _, model = tiny_lm
+    model.config.use_cache = False
+    if pack:
+        assert data_pipeline.packing_supported(model)
+    train_dataset, collator = data_pipeline.build_train_data(texts, tokenizer, 128, pack=pack,
+                                                             cache_dir=str(tmp_path))
+    loader = torch.utils.data.DataLoader(train_dataset, batch_size=1 if pack else 4, collate_fn=collator)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    before = [p.detach().clone() for p in model.parameters()]
+
+    model.train()
+    loss = model(**next(iter(loader)), use_cache=False).loss
+    loss.backward()
+    optimizer.step()
+    assert torch.isfinite(loss)
+    assert any(not torch.equal(a, b) for a, b in zip(before, model.parameters()))
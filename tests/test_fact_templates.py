@@ -0,0 +1,45 @@
+import random
+from context_generation import transform_leader_facts, transform_leader_facts_batch
+from fact_templates import COMPANY, LEADER, PERSON, transform_batch
+from general_facts_generation import transform_company_facts, transform_entity_facts_batch, transform_person_facts
+
+
+def random_rows(domain, rng, n):
+    properties = list(domain["slots"]) + ["unrelated property"]
+    return [{"propertyLabel": rng.choice(properties), "valueLabel": f"value {rng.randrange(5)}"} for _ in range(n)]
+
+
+def test_batch_matches_per_entity_transform():
+    rng = random.Random(0)
+    entities = []
+    results = {}
+    for i in range(60):
+        category = rng.choice(["Company", "Scientist", "Writer"])
+        qid = f"Q{i}"
+        entities.append({"qid": qid, "name": f"Entity {i}", "category": category,
+                         "country": rng.choice([None, "Peru"])})
+        results[qid] = random_rows(COMPANY if category == "Company" else PERSON, rng, rng.randrange(12))
+    results["Q7"] = None  # a chunk that failed to fetch
+
+    expected = []
+    for entity in entities:
+        rows = results[entity["qid"]]
+        if rows is None:
+            expected.append([])
+        elif entity["category"] == "Company":
+            expected.append(transform_company_facts(rows, entity["name"], entity["category"], entity["country"]))
+        else:
+            expected.append(transform_person_facts(rows, entity["name"], entity["category"]))
+    assert transform_entity_facts_batch(entities, results) == expected
+    assert any(expected)
+
+
+def test_leader_batch_and_entities_without_rows():
+    rng = random.Random(1)
+    leaders = [{"qid": f"Q{i}", "name": f"Leader {i}"} for i in range(20)]
+    results = {leader["qid"]: random_rows(LEADER, rng, rng.randrange(15)) for leader in leaders}
+    expected = [transform_leader_facts(results[leader["qid"]], leader["name"]) for leader in leaders]
+    assert transform_leader_facts_batch(leaders, results) == expected
+
+    facts = transform_batch(LEADER, {"a": None, "b": []}, {"a": "A", "b": "B"}, {"a": {}, "b": {}})
+    assert facts == {"b": []}
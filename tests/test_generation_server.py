@@ -0,0 +1,134 @@
+import asyncio
+import json
+import threading
+import pytest
+import requests
+
+torch = pytest.importorskip("torch")
+from generation_server import ContinuousBatchScheduler, GenerationServer  # noqa: E402
+from kv_cache import PrefixKVCache  # noqa: E402
+
+PROMPTS = ["Hello there", "Q: what is the capital of Peru?", "ab", "Q: who leads Latvia?"]
+
+
+def reference(tokenizer, model, prompt, max_new_tokens):
+    ids = tokenizer(prompt, return_tensors="pt")
+    out = model.generate(**ids, max_new_tokens=max_new_tokens, do_sample=False,
+                         eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
+    tokens = out[0, ids["input_ids"].shape[1]:].tolist()
+    return tokens[:tokens.index(tokenizer.eos_token_id)] if tokenizer.eos_token_id in tokens else tokens
+
+
+def step(scheduler):
+    """
+    One iteration of the scheduler loop, run on the test thread so joins and departures are deterministic
+    """
+    scheduler._admit()
+    if scheduler.active:
+        scheduler._decode_step()
+
+
+def drain(stream):
+    deltas = []
+    while not stream._queue.empty():
+        item = stream._queue.get()
+        if item is not stream._DONE:
+            deltas.append(item)
+    return deltas
+
+
+@pytest.mark.parametrize("with_prefix", [False, True])
+def test_staggered_requests_match_greedy_generate(tiny_lm, with_prefix):
+    tokenizer, model = tiny_lm
+    prefix_cache = None
+    if with_prefix:
+        prefix_cache = PrefixKVCache(model, tokenizer, min_prefix_tokens=2)
+        prefix_cache.register("Q: ")
+    scheduler = ContinuousBatchScheduler(tokenizer, model, max_batch=3, prefix_cache=prefix_cache)
+    lengths = [20, 5, 12, 8]
+
+    first = scheduler.submit(PROMPTS[0], lengths[0])
+    for _ in range(3):
+        step(scheduler)
+    # two newcomers join the running sequence, the last one waits for a free slot
+    streams = [first] + [scheduler.submit(prompt, n) for prompt, n in zip(PROMPTS[1:], lengths[1:])]
+    batch_sizes = []
+    while scheduler.active or not scheduler.pending.empty():
+        step(scheduler)
+        batch_sizes.append(len(scheduler.active))
+
+    assert max(batch_sizes) == 3
+    assert scheduler.stats["prefills"] >= 3 and scheduler.stats["completed"] == 4
+    for stream, prompt, n in zip(streams, PROMPTS, lengths):
+        assert stream.tokens == reference(tokenizer, model, prompt, n)
+        assert "".join(drain(stream)) == tokenizer.decode(stream.tokens, skip_special_tokens=True)
+    if with_prefix:
+        assert (prefix_cache.stats["misses"], prefix_cache.stats["hits"]) == (1, 1)
+
+
+def test_stop_at_newline(tiny_lm):
+    tokenizer, model = tiny_lm
+    newline = tokenizer.convert_tokens_to_ids("\n")
+    with torch.no_grad():
+        # make the model prefer a newline wherever it would have produced ")"
+        model.lm_head.weight[newline] = model.lm_head.weight[tokenizer.convert_tokens_to_ids(")")] * 1.1
+
+    text = tokenizer.decode(reference(tokenizer, model, PROMPTS[0], 20), skip_special_tokens=True)
+    answer = text.lstrip("\n")
+    assert "\n" in answer
+    expected = text[:len(text) - len(answer) + answer.index("\n")]
+
+    scheduler = ContinuousBatchScheduler(tokenizer, model)
+    stream = scheduler.submit(PROMPTS[0], 20, stop_at_newline=True)
+    while scheduler.active or not scheduler.pending.empty():
+        step(scheduler)
+    assert "".join(drain(stream)) == expected
+    assert len(stream.tokens) < 20
+
+
+def test_invalid_max_new_tokens(tiny_lm):
+    scheduler = ContinuousBatchScheduler(*tiny_lm)
+    with pytest.raises(ValueError):
+        scheduler.submit("Hello", 0)
+    assert scheduler.stats["requests"] == 0
+
+
+def test_server_streams_and_rejects_bad_requests(tiny_lm):
+    tokenizer, model = tiny_lm
+    scheduler = ContinuousBatchScheduler(tokenizer, model).start()
+    server = GenerationServer(scheduler, port=0)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    async def shutdown():
+        server.server.close()
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(10)
+    url = f"http://127.0.0.1:{server.port}/generate"
+    try:
+        for bad in ({"prompt": "Hello", "max_new_tokens": 0}, {"prompt": "Hello", "max_new_tokens": -3}, {}):
+            assert requests.post(url, json=bad).status_code == 400
+
+        response = requests.post(url, json={"prompt": PROMPTS[2], "max_new_tokens": 6, "stream": True}, stream=True)
+        chunks = [json.loads(line) for line in response.iter_lines() if line]
+        response.close()
+        expected = tokenizer.decode(reference(tokenizer, model, PROMPTS[2], 6), skip_special_tokens=True)
+        assert chunks[-1] == {"done": True, "text": expected.strip()}
+        assert "".join(chunk["token"] for chunk in chunks[:-1]) == expected
+    finally:
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(10)
+        loop.close()
+        scheduler.stop()
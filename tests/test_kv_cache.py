@@ -0,0 +1,67 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+from kv_cache import PrefixKVCache, template_prefix  # noqa: E402
+from prompt_llm import RAG_PROMPT_TEMPLATE, build_rag_prompt  # noqa: E402
+
+QUESTIONS = [
+    ("Where is Paris?", [{"text": "Paris is in France."}]),
+    ("What is the capital of Slovenia?", [{"text": "Ljubljana is the capital of Slovenia, a long fact here."}]),
+    ("y", [{"text": "x"}]),
+    ("Who leads Latvia today?", []),
+]
+
+
+def generate_kwargs(tokenizer):
+    return {"do_sample": False, "eos_token_id": tokenizer.eos_token_id, "pad_token_id": tokenizer.pad_token_id}
+
+
+def until_eos(tokens, eos_token_id):
+    tokens = [int(t) for t in tokens]
+    return tokens[:tokens.index(eos_token_id)] if eos_token_id in tokens else tokens
+
+
+def reference(tokenizer, model, prompt, max_new_tokens):
+    ids = tokenizer(prompt, return_tensors="pt")
+    with torch.no_grad():
+        out = model.generate(**ids, max_new_tokens=max_new_tokens, **generate_kwargs(tokenizer))
+    return until_eos(out[0, ids["input_ids"].shape[1]:], tokenizer.eos_token_id)
+
+
+@pytest.fixture
+def rag_prompts():
+    return [build_rag_prompt(question, facts) for question, facts in QUESTIONS]
+
+
+def test_generate_from_cached_prefix(tiny_lm, rag_prompts):
+    tokenizer, model = tiny_lm
+    cache = PrefixKVCache(model, tokenizer).register(template_prefix(RAG_PROMPT_TEMPLATE))
+    for prompt in rag_prompts:
+        out = cache.generate(prompt, max_new_tokens=12, **generate_kwargs(tokenizer))
+        prompt_len = len(tokenizer(prompt)["input_ids"])
+        assert until_eos(out[0, prompt_len:], tokenizer.eos_token_id) == reference(tokenizer, model, prompt, 12)
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == len(rag_prompts) - 1
+
+
+def test_generate_batch_mixed_groups(tiny_lm, rag_prompts):
+    tokenizer, model = tiny_lm
+    tokenizer.padding_side = "left"
+    cache = PrefixKVCache(model, tokenizer).register(template_prefix(RAG_PROMPT_TEMPLATE))
+    cache.register("Summarize the following text: ")
+    # one group per cached prefix, plus prompts without any
+    prompts = rag_prompts + ["no prefix here at all", "Summarize the following text: a b c",
+                             "Summarize the following text: the quick brown fox", "zz"]
+    generated = cache.generate_batch(prompts, max_new_tokens=12, **generate_kwargs(tokenizer))
+    assert len(generated) == len(prompts)
+    for prompt, tokens in zip(prompts, generated):
+        assert until_eos(tokens, tokenizer.eos_token_id) == reference(tokenizer, model, prompt, 12)
+    assert cache.stats["reused_tokens"] > 0
+
+
+def test_generate_batch_without_registered_prefix(tiny_lm, rag_prompts):
+    tokenizer, model = tiny_lm
+    cache = PrefixKVCache(model, tokenizer)
+    generated = cache.generate_batch(rag_prompts, max_new_tokens=8, **generate_kwargs(tokenizer))
+    for prompt, tokens in zip(rag_prompts, generated):
+        assert until_eos(tokens, tokenizer.eos_token_id) == reference(tokenizer, model, prompt, 8)
+    assert cache.stats["hits"] == 0
@@ -0,0 +1,112 @@
+import pytest
+from label_store import LabelStore, WikidataAPIError
+
+LABELS = {f"Q{i}": f"Entity {i}" for i in range(1, 121)}
+LABELS["P6"] = "head of government"
+
+
+def wbgetentities(params, failing=()):
+    ids = params["ids"].split("|")
+    if set(ids) & set(failing):
+        return 200, {"error": {"code": "maxlag", "info": "Waiting for a database server"}}
+    entities = {}
+    for wid in ids:
+        if wid in LABELS:
+            entities[wid] = {"id": wid, "labels": {"en": {"language": "en", "value": LABELS[wid]}}}
+        else:
+            entities[wid] = {"id": wid, "missing": ""}
+    return 200, {"entities": entities, "success": 1}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "labels.sqlite")
+
+
+def requested_ids(stand_in):
+    return [r["ids"].split("|") for r in stand_in.requests]
+
+
+def test_lookups_are_batched_and_persisted(stand_in, db_path):
+    stand_in.respond = wbgetentities
+    ids = [f"Q{i}" for i in range(1, 121)]
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        labels = store.get_many(ids + ["P6"])
+        assert labels == {wid: LABELS[wid] for wid in ids + ["P6"]}
+        assert [len(batch) for batch in requested_ids(stand_in)] == [50, 50, 21]
+        assert all(r["action"] == "wbgetentities" and r["languages"] == "en" for r in stand_in.requests)
+
+        assert store.get("Q7") == "Entity 7"
+        assert store.stats["memory_hits"] == 1
+        assert len(stand_in.requests) == 3
+
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        assert store.get_many(ids[:10]) == {wid: LABELS[wid] for wid in ids[:10]}
+        assert store.stats["db_hits"] == 10
+    assert len(stand_in.requests) == 3
+
+
+def test_missing_entities_are_stored_and_not_asked_again(stand_in, db_path):
+    stand_in.respond = wbgetentities
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        assert store.get("Q999999") is None
+        assert store.label("Q999999") == "Q999999"
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        assert store.get("Q999999") is None
+        assert store.stats["db_hits"] == 1
+    assert len(stand_in.requests) == 1
+
+
+def test_non_wikidata_ids_are_never_requested(stand_in, db_path):
+    stand_in.respond = wbgetentities
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        assert store.labels(["Q1", "1984", "3f2a-uuid"]) == {"Q1": "Entity 1", "1984": "1984",
+                                                              "3f2a-uuid": "3f2a-uuid"}
+    assert requested_ids(stand_in) == [["Q1"]]
+
+
+def test_offline_mode_uses_only_the_local_store(stand_in, db_path):
+    stand_in.respond = wbgetentities
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        store.get("Q1")
+        store.add({"Q2": "Seeded", "Q3": None})
+
+    with LabelStore(db_path, api_url=stand_in.url, offline=True) as store:
+        assert store.get_many(["Q1", "Q2", "Q4"]) == {"Q1": "Entity 1", "Q2": "Seeded", "Q4": None}
+        assert store.label("Q3") == "Q3"
+        assert store.stats["offline_misses"] == 2
+    assert len(stand_in.requests) == 1
+
+
+def test_api_errors_are_not_persisted(stand_in, db_path):
+    stand_in.respond = lambda params: wbgetentities(params, failing=["Q60"])
+    ids = [f"Q{i}" for i in range(1, 121)]
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        labels = store.get_many(ids)
+        # only the batch with the failing id is unresolved, the others are stored
+        assert [wid for wid in ids if labels[wid] is None] == ids[50:100]
+        assert store.stats["fetch_errors"] == 1
+
+    stand_in.respond = wbgetentities
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        assert store.get_many(ids) == {wid: LABELS[wid] for wid in ids}
+        assert store.stats["db_hits"] == 70
+    assert requested_ids(stand_in)[-1] == ids[50:100]
+
+
+def test_fetch_raises_on_error_responses(stand_in, db_path):
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        stand_in.respond = lambda params: wbgetentities(params, failing=["Q1"])
+        with pytest.raises(WikidataAPIError, match="maxlag"):
+            store.fetch(["Q1"])
+        stand_in.respond = lambda params: (200, {"warnings": {}})
+        with pytest.raises(WikidataAPIError):
+            store.fetch(["Q1"])
+
+
+def test_ids_absent_from_the_response_are_not_stored(stand_in, db_path):
+    stand_in.respond = lambda params: (200, {"entities": {"Q1": wbgetentities({"ids": "Q1"})[1]["entities"]["Q1"]}})
+    with LabelStore(db_path, api_url=stand_in.url) as store:
+        assert store.get_many(["Q1", "Q2"]) == {"Q1": "Entity 1", "Q2": None}
+        assert store.get("Q2") is None
+    assert requested_ids(stand_in) == [["Q1", "Q2"], ["Q2"]]
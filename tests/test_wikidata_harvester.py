@@ -0,0 +1,186 @@
+import time
+import pytest
+import requests
+from wikidata_harvester import SparqlClient, TokenBucket, get_facts_batch, harvest, retry_after_seconds
+
+RESULT = {"results": {"bindings": []}}
+
+
+def make_client(stand_in, **kwargs):
+    kwargs = {"cache_dir": None, "rate": 1000.0, "burst": 1000, "backoff": 0.01, **kwargs}
+    return SparqlClient(endpoint=stand_in.url, **kwargs)
+
+
+def replies(*responses):
+    # answer the n-th request with the n-th response, the last one repeats
+    calls = []
+
+    def respond(params):
+        calls.append(params)
+        return responses[min(len(calls), len(responses)) - 1]
+    return respond
+
+
+def test_retry_after_is_honoured_on_429(stand_in):
+    stand_in.respond = replies((429, {}, {"Retry-After": "0.3"}), (200, RESULT))
+    client = make_client(stand_in)
+    start = time.monotonic()
+    assert client.query("SELECT 1") == RESULT
+    assert time.monotonic() - start >= 0.3
+    assert client.stats == {"requests": 2, "cache_hits": 0, "retries": 1}
+
+
+def test_server_errors_are_retried_with_backoff(stand_in):
+    stand_in.respond = replies((503, {}), (502, {}), (200, RESULT))
+    client = make_client(stand_in, backoff=0.1)
+    start = time.monotonic()
+    assert client.query("SELECT 1") == RESULT
+    # two waits of backoff * 2**attempt * [0.5, 1.5)
+    assert time.monotonic() - start >= 0.1 * 0.5 + 0.2 * 0.5
+    assert client.stats["retries"] == 2
+    assert len(stand_in.requests) == 3
+
+
+def test_retries_give_up_after_max_retries(stand_in):
+    stand_in.respond = replies((500, {}))
+    client = make_client(stand_in, max_retries=2)
+    with pytest.raises(requests.HTTPError):
+        client.query("SELECT 1")
+    assert len(stand_in.requests) == 3
+
+
+def test_client_errors_are_not_retried(stand_in):
+    stand_in.respond = replies((400, {}))
+    client = make_client(stand_in)
+    with pytest.raises(requests.HTTPError):
+        client.query("SELECT 1")
+    assert len(stand_in.requests) == 1
+    assert client.stats["retries"] == 0
+
+
+def test_response_cache_hits_skip_the_endpoint(stand_in, tmp_path):
+    stand_in.respond = replies((200, RESULT))
+    client = make_client(stand_in, cache_dir=str(tmp_path))
+    assert client.query("SELECT 1") == RESULT
+    assert client.query("SELECT 1") == RESULT
+    assert client.query("SELECT 2") == RESULT
+    assert client.stats == {"requests": 2, "cache_hits": 1, "retries": 0}
+
+    # the cache is on disk, a new client reuses it
+    other = make_client(stand_in, cache_dir=str(tmp_path))
+    assert other.query("SELECT 1") == RESULT
+    assert other.stats["requests"] == 0
+    assert len(stand_in.requests) == 2
+
+
+def test_failed_responses_are_not_cached(stand_in, tmp_path):
+    stand_in.respond = replies((400, {}), (200, RESULT))
+    client = make_client(stand_in, cache_dir=str(tmp_path))
+    with pytest.raises(requests.HTTPError):
+        client.query("SELECT 1")
+    assert client.query("SELECT 1") == RESULT
+    assert len(stand_in.requests) == 2
+
+
+def test_client_requests_are_rate_limited(stand_in):
+    stand_in.respond = replies((200, RESULT))
+    client = make_client(stand_in, rate=10.0, burst=1)
+    start = time.monotonic()
+    results = harvest([f"SELECT {i}" for i in range(5)], client.query, max_workers=5)
+    # the burst token covers the first request, the other four wait 0.1 s each
+    assert time.monotonic() - start >= 0.35
+    assert results == [RESULT] * 5
+
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = TokenBucket(rate=20.0, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(4):
+        bucket.acquire()
+    assert time.monotonic() - start >= 4 / 20.0 - 0.01
+
+
+def test_retry_after_seconds_parses_seconds_and_dates():
+    assert retry_after_seconds("2") == 2.0
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds("soon") is None
+    date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert 25 <= retry_after_seconds(date) <= 30
+
+
+def test_harvest_keeps_order_and_isolates_failures():
+    def fetch(item):
+        if item == 3:
+            raise RuntimeError("bad entity")
+        time.sleep(0.01 * (5 - item))
+        return item * 10
+    assert harvest(range(5), fetch, max_workers=5) == [0, 10, 20, None, 40]
+
+
+FACTS = {
+    "Q1": [("head of state", "Alice"), ("capital", "Town")],
+    "Q2": [("head of state", "Bob")],
+    "Q3": [],
+    "Q4": [("currency", "Euro"), ("capital", "City"), ("continent", "Europe")],
+    "Q5": [("capital", "Port")],
+}
+
+
+def values_of(query):
+    values = query.split("VALUES ?item {", 1)[1].split("}", 1)[0]
+    return [v.removeprefix("wd:") for v in values.split()]
+
+
+def sparql_stand_in(params, failing=()):
+    qids = values_of(params["query"])
+    if failing and set(qids) & set(failing):
+        return 400, {}
+    bindings = [{"item": {"value": f"http://www.wikidata.org/entity/{qid}"},
+                 "propertyLabel": {"value": prop}, "valueLabel": {"value": value}}
+                for qid in qids for prop, value in FACTS.get(qid, [])]
+    return 200, {"results": {"bindings": bindings}}
+
+
+def expected(qid):
+    return [{"propertyLabel": prop, "valueLabel": value} for prop, value in FACTS[qid]]
+
+
+def test_facts_are_fetched_in_chunks_and_demultiplexed(stand_in):
+    stand_in.respond = sparql_stand_in
+    client = make_client(stand_in)
+    facts = get_facts_batch(["Q1", "Q2", "Q3", "Q4", "Q5", "Q2"], client.query, chunk_size=2)
+
+    # five distinct QIDs in chunks of two, one VALUES query per chunk
+    assert sorted(values_of(r["query"]) for r in stand_in.requests) == [["Q1", "Q2"], ["Q3", "Q4"], ["Q5"]]
+    assert list(facts) == ["Q1", "Q2", "Q3", "Q4", "Q5"]
+    for qid in FACTS:
+        assert facts[qid] == expected(qid)
+
+
+def test_entities_without_rows_get_an_empty_list(stand_in):
+    stand_in.respond = sparql_stand_in
+    facts = get_facts_batch(["Q3", "Q99"], make_client(stand_in).query, chunk_size=50)
+    assert facts == {"Q3": [], "Q99": []}
+    assert len(stand_in.requests) == 1
+
+
+def test_failed_chunk_maps_only_its_entities_to_none(stand_in):
+    stand_in.respond = lambda params: sparql_stand_in(params, failing=["Q3"])
+    facts = get_facts_batch(list(FACTS), make_client(stand_in).query, chunk_size=2)
+    assert facts["Q3"] is None and facts["Q4"] is None
+    assert facts["Q1"] == expected("Q1") and facts["Q5"] == expected("Q5")
+
+
+def test_rows_without_labels_are_skipped():
+    result = {"results": {"bindings": [
+        {"item": {"value": "http://www.wikidata.org/entity/Q1"}, "propertyLabel": {"value": "capital"}},
+        {"item": {"value": "http://www.wikidata.org/entity/Q1"}, "propertyLabel": {"value": "capital"},
+         "valueLabel": {"value": "Town"}},
+        {"item": {"value": "http://www.wikidata.org/entity/Q7"}, "propertyLabel": {"value": "capital"},
+         "valueLabel": {"value": "Elsewhere"}},
+    ]}}
+    assert get_facts_batch(["Q1"], lambda query: result) == {"Q1": [{"propertyLabel": "capital",
+                                                                     "valueLabel": "Town"}]}